@@ -1,7 +1,6 @@
 import os
 from pydantic import AnyHttpUrl
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from torch import cuda
 
 from dotenv import load_dotenv
 # Load environment variables from .env file
@@ -13,32 +12,168 @@ class Settings(BaseSettings):
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
     REDIS_TTL_SECONDS: int = 86400
 
+    # Deployment: "all" (single host), "web" (API only) or "worker" (python -m app.worker)
+    SERVICE_ROLE: str = os.getenv("SERVICE_ROLE", "all")
+    # Results/emails link here when set (load balancer / CDN); else the request's base URL
+    PUBLIC_BASE_URL: str = os.getenv("PUBLIC_BASE_URL", "")
+
     # SMTP
     SMTP_SERVER: str = os.getenv("SMTP_SERVER", "smtp.gmail.com")
     SMTP_PORT: int = int(os.getenv("SMTP_PORT", "587"))
-    SMTP_USER: str = os.getenv("SMTP_USER", "ibrahimmuhammad271@gmail.com")
-    SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "nyxb zwua duqm pxgb")
+    SMTP_USER: str = os.getenv("SMTP_USER", "")
+    SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
+
+    # Email outbox (see app/services/email_outbox.py)
+    EMAIL_FROM: str = os.getenv("EMAIL_FROM", SMTP_USER)
+    # Off by default unless SMTP credentials are configured (and never on web replicas);
+    # set it to true explicitly for an unauthenticated relay
+    EMAIL_SENDER_ENABLED: bool = os.getenv(
+        "EMAIL_SENDER_ENABLED", str(SERVICE_ROLE != "web" and bool(SMTP_USER and SMTP_PASSWORD))
+    ).lower() == "true"
+    EMAIL_BATCH_SIZE: int = int(os.getenv("EMAIL_BATCH_SIZE", "20"))
+    EMAIL_BLOCK_SECONDS: float = float(os.getenv("EMAIL_BLOCK_SECONDS", "1"))
+    EMAIL_SMTP_TIMEOUT: float = float(os.getenv("EMAIL_SMTP_TIMEOUT", "15"))
+    EMAIL_IDLE_TIMEOUT_SECONDS: float = float(os.getenv("EMAIL_IDLE_TIMEOUT_SECONDS", "240"))
+    EMAIL_MAX_ATTEMPTS: int = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+    EMAIL_RETRY_BASE_DELAY: float = float(os.getenv("EMAIL_RETRY_BASE_DELAY", "10"))
+    EMAIL_RETRY_MAX_DELAY: float = float(os.getenv("EMAIL_RETRY_MAX_DELAY", "600"))
+    EMAIL_VISIBILITY_SECONDS: float = float(os.getenv("EMAIL_VISIBILITY_SECONDS", "120"))
+    EMAIL_MAINTENANCE_INTERVAL_SECONDS: float = float(os.getenv("EMAIL_MAINTENANCE_INTERVAL_SECONDS", "5"))
+
+    # Completion webhooks (see app/services/webhooks.py); empty secret = callback_url refused
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_SENDER_ENABLED: bool = os.getenv("WEBHOOK_SENDER_ENABLED", str(SERVICE_ROLE != "web")).lower() == "true"
+    WEBHOOK_CONCURRENCY: int = int(os.getenv("WEBHOOK_CONCURRENCY", "16"))  # deliveries in flight per sender
+    WEBHOOK_TIMEOUT_SECONDS: float = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+    WEBHOOK_MAX_ATTEMPTS: int = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "6"))
+    WEBHOOK_RETRY_BASE_DELAY: float = float(os.getenv("WEBHOOK_RETRY_BASE_DELAY", "5"))
+    WEBHOOK_RETRY_MAX_DELAY: float = float(os.getenv("WEBHOOK_RETRY_MAX_DELAY", "900"))
+    WEBHOOK_POLL_SECONDS: float = float(os.getenv("WEBHOOK_POLL_SECONDS", "0.5"))
+    # Allow callbacks to loopback / private addresses (local stand-ins, internal integrators)
+    WEBHOOK_ALLOW_PRIVATE: bool = os.getenv("WEBHOOK_ALLOW_PRIVATE", "false").lower() == "true"
 
     # App
     OUTPUT_DIR: str = os.getenv("OUTPUT_DIR", "processed_images")
+    # Original upload + alpha mask kept per task for /render (not publicly mounted)
+    ASSET_DIR: str = os.getenv("ASSET_DIR", "processed_assets")
+    KEEP_RENDER_ASSETS: bool = os.getenv("KEEP_RENDER_ASSETS", "true").lower() == "true"
+    RENDER_CACHE_MAX_BYTES: int = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    RENDER_SOURCE_CACHE_SIZE: int = int(os.getenv("RENDER_SOURCE_CACHE_SIZE", "16"))
+    RENDER_MAX_SIDE: int = int(os.getenv("RENDER_MAX_SIDE", "4096"))
+    # output_format=mask: foreground cut-off of the binary and rle encodings
+    MASK_THRESHOLD: int = int(os.getenv("MASK_THRESHOLD", "128"))
+    # Progressive results: a small, fast WebP preview (preview_url) before the full result.
+    # Opt-in: it is a second inference per job, run only while the CPU pool has a free slot
+    PREVIEW_ENABLED: bool = os.getenv("PREVIEW_ENABLED", "false").lower() == "true"
+    PREVIEW_MODEL: str = os.getenv("PREVIEW_MODEL", "u2netp")
+    PREVIEW_MAX_SIDE: int = int(os.getenv("PREVIEW_MAX_SIDE", "480"))
+    PREVIEW_QUALITY: int = int(os.getenv("PREVIEW_QUALITY", "60"))
+    # Memory bounds (see app/services/memory_budget.py)
+    MAX_IMAGE_PIXELS: int = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))  # source or scaled canvas
+    MEMORY_BUDGET_MB: int = int(os.getenv("MEMORY_BUDGET_MB", "2048"))  # estimated bytes of jobs in flight
+    MEMORY_RSS_LIMIT_MB: int = int(os.getenv("MEMORY_RSS_LIMIT_MB", "0"))  # 0 = 85% of the cgroup limit, if any
     CLEANUP_INTERVAL_HOURS: int = int(os.getenv("CLEANUP_INTERVAL_HOURS", "1"))
 
     # Model
 
-    GPU_ENABLED: bool = cuda.is_available() and os.getenv("GPU_ENABLED", "false").lower() == "true"
-    MODEL_NAMES: list[str] = os.getenv("MODEL_NAMES", "u2net, u2netp, u2net_human_seg").split(",")
+    # Plain env flag: onnxruntime picks the CUDA provider itself when it is installed,
+    # so torch is never imported just to probe for a GPU.
+    GPU_ENABLED: bool = os.getenv("GPU_ENABLED", "false").lower() == "true"
+    MODEL_NAMES: list[str] = [
+        m.strip() for m in os.getenv("MODEL_NAMES", "u2net, u2netp, u2net_human_seg").split(",") if m.strip()
+    ]
     DEFAULT_MODEL: str = os.getenv("DEFAULT_MODEL", "u2net")
     ALLOWED_OUTPUT_FORMATS: list[str] = ["png", "jpg", "jpeg"]
     DEFAULT_OUTPUT_FORMAT: str = os.getenv("DEFAULT_OUTPUT_FORMAT", "png")
     DEFAULT_QUALITY: int = int(os.getenv("DEFAULT_QUALITY", "95"))
     DEFAULT_SCALE: float = float(os.getenv("DEFAULT_SCALE", "1.0"))
 
+    # Animated GIF/WebP and video (see app/services/animation.py)
+    MAX_ANIMATION_UPLOAD_MB: int = int(os.getenv("MAX_ANIMATION_UPLOAD_MB", "20"))
+    ANIMATION_MAX_FRAMES: int = int(os.getenv("ANIMATION_MAX_FRAMES", "300"))  # after frame-rate capping
+    ANIMATION_MAX_SECONDS: float = float(os.getenv("ANIMATION_MAX_SECONDS", "30"))
+    ANIMATION_MAX_FPS: float = float(os.getenv("ANIMATION_MAX_FPS", "15"))
+    ANIMATION_BATCH_SIZE: int = int(os.getenv("ANIMATION_BATCH_SIZE", "4"))  # keyframes per session run
+    ANIMATION_KEYFRAME_INTERVAL: int = int(os.getenv("ANIMATION_KEYFRAME_INTERVAL", "8"))  # max frames reusing a mask
+    ANIMATION_REUSE_MAX_DIFF: float = float(os.getenv("ANIMATION_REUSE_MAX_DIFF", "3"))  # mean |diff|, 0-255
+
+    # Near-duplicate mask reuse (see app/services/dedup.py)
+    DEDUP_ENABLED: bool = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+    DEDUP_PHASH_MAX_DISTANCE: int = int(os.getenv("DEDUP_PHASH_MAX_DISTANCE", "6"))  # of 64 bits
+    DEDUP_DHASH_MAX_DISTANCE: int = int(os.getenv("DEDUP_DHASH_MAX_DISTANCE", "8"))
+    DEDUP_MAX_THUMB_DIFF: float = float(os.getenv("DEDUP_MAX_THUMB_DIFF", "6"))  # mean |diff|, 0-255
+    DEDUP_BUCKET_SIZE: int = int(os.getenv("DEDUP_BUCKET_SIZE", "64"))
+    DEDUP_MAX_CANDIDATES: int = int(os.getenv("DEDUP_MAX_CANDIDATES", "8"))
+
+    # Executors (see app/services/executors.py)
+    CPU_EXECUTOR_KIND: str = os.getenv("CPU_EXECUTOR_KIND", "thread")  # "thread" or "process"
+    CPU_WORKERS: int = int(os.getenv("CPU_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+    IO_WORKERS: int = int(os.getenv("IO_WORKERS", "8"))
+    CODEC_WORKERS: int = int(os.getenv("CODEC_WORKERS", "2"))  # decode / encode threads
+
+    # Pipeline (see app/services/pipeline.py): workers per stage and queue bound
+    PIPELINE_QUEUE_SIZE: int = int(os.getenv("PIPELINE_QUEUE_SIZE", "4"))
+    DECODE_CONCURRENCY: int = int(os.getenv("DECODE_CONCURRENCY", "2"))
+    DEDUP_CONCURRENCY: int = int(os.getenv("DEDUP_CONCURRENCY", "4"))  # near-duplicate lookups (I/O pool)
+    INFERENCE_CONCURRENCY: int = int(os.getenv("INFERENCE_CONCURRENCY", str(max(1, (os.cpu_count() or 2) // 2))))
+    ENCODE_CONCURRENCY: int = int(os.getenv("ENCODE_CONCURRENCY", "2"))
+    STORE_CONCURRENCY: int = int(os.getenv("STORE_CONCURRENCY", "4"))
+
+    # Durable job queue (see app/services/job_queue.py and app/worker.py)
+    # Web replicas (SERVICE_ROLE=web) leave the queue to dedicated workers
+    QUEUE_WORKER_ENABLED: bool = os.getenv("QUEUE_WORKER_ENABLED", str(SERVICE_ROLE != "web")).lower() == "true"
+    # Jobs held per worker; only SCHEDULER_SLOTS of them are in the pipeline, the rest wait to be scheduled
+    QUEUE_WORKER_CONCURRENCY: int = int(os.getenv("QUEUE_WORKER_CONCURRENCY", "32"))
+    QUEUE_VISIBILITY_TIMEOUT_MS: int = int(os.getenv("QUEUE_VISIBILITY_TIMEOUT_MS", "60000"))
+    QUEUE_REAP_INTERVAL_SECONDS: float = float(os.getenv("QUEUE_REAP_INTERVAL_SECONDS", "5"))
+    QUEUE_BLOCK_MS: int = int(os.getenv("QUEUE_BLOCK_MS", "1000"))
+    QUEUE_MAX_ATTEMPTS: int = int(os.getenv("QUEUE_MAX_ATTEMPTS", "4"))
+    QUEUE_RETRY_BASE_DELAY: float = float(os.getenv("QUEUE_RETRY_BASE_DELAY", "2"))
+    QUEUE_RETRY_MAX_DELAY: float = float(os.getenv("QUEUE_RETRY_MAX_DELAY", "60"))
+    QUEUE_PAYLOAD_TTL_SECONDS: int = int(os.getenv("QUEUE_PAYLOAD_TTL_SECONDS", "3600"))
+    QUEUE_MAX_LENGTH: int = int(os.getenv("QUEUE_MAX_LENGTH", "100000"))
+    QUEUE_DEAD_LETTER_MAX: int = int(os.getenv("QUEUE_DEAD_LETTER_MAX", "1000"))
+    # Models whose jobs get their own stream (bgr:jobs:<model>); the rest share bgr:jobs
+    QUEUE_MODEL_STREAMS: str = os.getenv("QUEUE_MODEL_STREAMS", "")
+    # Streams this worker consumes: model names and "*" (shared stream); empty = all
+    WORKER_MODELS: str = os.getenv("WORKER_MODELS", "")
+    # Worker supervisor (python -m app.supervisor): "models@cpus[:runs]" groups, ";"-separated
+    WORKER_GROUPS: str = os.getenv("WORKER_GROUPS", "")
+
+    # Fair scheduling in front of the pipeline (see app/services/fair_queue.py)
+    SCHEDULER_SLOTS: int = int(os.getenv("SCHEDULER_SLOTS", str(INFERENCE_CONCURRENCY + PIPELINE_QUEUE_SIZE)))
+    # Comma-separated "name=value" / "name" strings (parsed in fair_queue.py)
+    LANE_WEIGHTS: str = os.getenv("LANE_WEIGHTS", "interactive=4,bulk=1")
+    INTERACTIVE_MODELS: str = os.getenv("INTERACTIVE_MODELS", "u2netp")
+    MODEL_COSTS: str = os.getenv("MODEL_COSTS", "u2net=4,u2net_human_seg=4,u2netp=1")
+    MODEL_CONCURRENCY: str = os.getenv("MODEL_CONCURRENCY", "")  # e.g. "u2net=2"
+    SCHEDULER_QUANTUM: float = float(os.getenv("SCHEDULER_QUANTUM", "4"))
+
+    # model=auto (see app/services/model_policy.py)
+    AUTO_MODELS: str = os.getenv("AUTO_MODELS", "u2net,u2netp")  # best first
+    AUTO_LATENCY_SLO_SECONDS: float = float(os.getenv("AUTO_LATENCY_SLO_SECONDS", "30"))
+    AUTO_RECOVER_RATIO: float = float(os.getenv("AUTO_RECOVER_RATIO", "0.7"))  # heavier again below SLO x ratio
+    AUTO_SECONDS_PER_COST: float = float(os.getenv("AUTO_SECONDS_PER_COST", "0.5"))  # before any observation
+
 
     ENV: str = "production" # or "development"
     
     AWS_S3_BUCKET: str = os.getenv("AWS_S3_BUCKET", "your-s3-bucket-name")
     AWS_REGION: str = os.getenv("AWS_REGION", "eu-north-1")
     AWS_USE_S3: bool = os.getenv("AWS_USE_S3", "false").lower() == "true"
+    PRESIGNED_URL_EXPIRY: int = int(os.getenv("PRESIGNED_URL_EXPIRY", "3600"))
+    # Presigned POST lifetime for direct-to-storage uploads (POST /uploads/)
+    DIRECT_UPLOAD_EXPIRY_SECONDS: int = int(os.getenv("DIRECT_UPLOAD_EXPIRY_SECONDS", "900"))
+    # Cached presigned URLs are reissued once less than this much validity is left
+    PRESIGN_REFRESH_MARGIN_SECONDS: int = int(os.getenv("PRESIGN_REFRESH_MARGIN_SECONDS", "600"))
+    PRESIGN_CACHE_SIZE: int = int(os.getenv("PRESIGN_CACHE_SIZE", "10000"))
+    # S3-compatible stores (MinIO, Ceph, R2...); empty = AWS
+    AWS_S3_ENDPOINT_URL: str = os.getenv("AWS_S3_ENDPOINT_URL", "")
+    # "local" (OUTPUT_DIR/ASSET_DIR, a shared volume with several nodes) or "s3"
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "s3" if ENV == "production" and AWS_USE_S3 else "local")
+    # In-flight calls per storage backend (S3: also the HTTP connection pool size)
+    STORAGE_LOCAL_CONCURRENCY: int = int(os.getenv("STORAGE_LOCAL_CONCURRENCY", "8"))
+    STORAGE_S3_CONCURRENCY: int = int(os.getenv("STORAGE_S3_CONCURRENCY", "32"))
 
     AWS_S3_USER: str = os.getenv("AWS_S3_USER", "your-s3-user")
     AWS_ACCESS_KEY: str = os.getenv("AWS_ACCESS_KEY", "your-access-key-id")
@@ -49,6 +184,18 @@ class Settings(BaseSettings):
     # Add these two lines:
     SMTP_USE_TLS: bool = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
     BASE_URL: str = os.getenv("BASE_URL", "http://localhost:8000")
+    # Requests sending this value in X-Load-Test-Token skip rate limits (empty = disabled)
+    LOAD_TEST_TOKEN: str = os.getenv("LOAD_TEST_TOKEN", "")
+    # In-process pre-check that rejects clients clearly over a limit without Redis
+    RATE_LIMIT_LOCAL_CACHE: bool = os.getenv("RATE_LIMIT_LOCAL_CACHE", "true").lower() == "true"
+    RATE_LIMIT_LOCAL_MAX_KEYS: int = int(os.getenv("RATE_LIMIT_LOCAL_MAX_KEYS", "10000"))
+    # Admin endpoints (/admin: traces, profiles) need this X-Admin-Token; empty = disabled
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    # Profiling and span traces (see app/services/profiling.py)
+    PROFILE_SAMPLE_RATE: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # fraction of jobs profiled
+    PROFILE_INTERVAL_MS: float = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+    PROFILE_MAX_SECONDS: int = int(os.getenv("PROFILE_MAX_SECONDS", "60"))  # cap of on-demand profiles
+    TRACE_TTL_SECONDS: int = int(os.getenv("TRACE_TTL_SECONDS", "3600"))
     U2NET_HOME: str = os.getenv("U2NET_HOME", "./models/.u2net")
 
 
@@ -1,18 +1,25 @@
 import os
 import logging
-import redis.asyncio as aioredis
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi_limiter import FastAPILimiter
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
 from app.config import settings
-from app.routers import process, download, status as status_router, ui
+from app.redis_client import make_async_client
+from app.routers import process, download, status as status_router, ui, metrics, render, uploads, admin
 from app.services.scheduler import start_scheduler
+from app.services.executors import shutdown_executors
+from app.services.storage import shutdown_storage
+from app.tasks import PIPELINE
+from app.worker import QueueWorker
+from app.services.email_outbox import EmailSender
+from app.services.webhooks import WebhookSender
+from app.services.http_cache import CachedStaticFiles
 from app.routers.ui import templates
 
 # 1. Structured Logging Configuration
@@ -41,8 +48,7 @@ async def lifespan(app: FastAPI):
 
     # Initialize Redis for Rate Limiting
     try:
-        redis_connection = aioredis.from_url(
-            settings.REDIS_URL,
+        redis_connection = make_async_client(
             encoding="utf-8",
             decode_responses=True,
         )
@@ -51,9 +57,30 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"❌ Failed to initialize Rate Limiter: {e}")
     
-    # Start the Background Maintenance Scheduler
-    start_scheduler()
-    logger.info("✅ Background cleanup scheduler active.")
+    # Start the Background Maintenance Scheduler (Redis-locked: one run per interval cluster-wide)
+    scheduler = start_scheduler()
+    logger.info(f"✅ Background cleanup scheduler active (role={settings.SERVICE_ROLE}, storage={settings.STORAGE_BACKEND}).")
+
+    # Consume the durable job queue in this process (can also run as `python -m app.worker`)
+    worker = None
+    if settings.QUEUE_WORKER_ENABLED:
+        worker = QueueWorker()
+        worker.start()
+        logger.info("✅ Queue worker consuming jobs.")
+
+    # Drain the notification outbox over a pooled SMTP session
+    email_sender = None
+    if settings.EMAIL_SENDER_ENABLED:
+        email_sender = EmailSender()
+        email_sender.start()
+        logger.info("✅ Email sender draining the outbox.")
+
+    # Completion webhooks over a pooled HTTP client
+    webhook_sender = None
+    if settings.WEBHOOK_SENDER_ENABLED:
+        webhook_sender = WebhookSender()
+        webhook_sender.start()
+        logger.info("✅ Webhook sender delivering callbacks.")
 
     yield  # Application runs here
 
@@ -61,6 +88,16 @@ async def lifespan(app: FastAPI):
     logger.info("🛑 Shutting down... Cleaning up resources.")
     if 'redis_connection' in locals():
         await redis_connection.close() # type: ignore
+    if worker is not None:
+        await worker.stop()
+    if email_sender is not None:
+        await email_sender.stop()
+    if webhook_sender is not None:
+        await webhook_sender.stop()
+    scheduler.shutdown(wait=False)
+    await PIPELINE.stop()
+    shutdown_executors(wait=False)
+    shutdown_storage()
 
 
 # 3. FastAPI Application Definition
@@ -101,14 +138,20 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 # CRITICAL: This allows the frontend to access http://localhost:8000/processed_images/filename.png
-app.mount("/processed_images", StaticFiles(directory=settings.OUTPUT_DIR), name="processed_images")
+# With several web replicas OUTPUT_DIR is a shared volume, so every replica serves every result.
+# CachedStaticFiles adds Cache-Control on top of StaticFiles' ETag/304 and Range handling.
+app.mount("/processed_images", CachedStaticFiles(directory=settings.OUTPUT_DIR), name="processed_images")
 
 
 # 6. Include Routers
 app.include_router(process.router)
+app.include_router(uploads.router)
 app.include_router(status_router.router)
 app.include_router(download.router)
+app.include_router(render.router)
 app.include_router(ui.router)
+app.include_router(metrics.router)
+app.include_router(admin.router)
 
 
 # 7. Global Exception Handlers
@@ -127,7 +170,11 @@ async def custom_http_exception_handler(request: Request, exc: StarletteHTTPExce
         )
 
     if not is_browser:
-        return {"detail": exc.detail, "status": exc.status_code}
+        return JSONResponse(
+            {"detail": exc.detail, "status": exc.status_code},
+            status_code=exc.status_code,
+            headers=getattr(exc, "headers", None),
+        )
 
     return HTMLResponse(
         content=f"<html><body style='font-family:sans-serif;'><h1>Error {exc.status_code}</h1><p>{exc.detail}</p></body></html>",
@@ -4,9 +4,13 @@ from pydantic import BaseModel, EmailStr
 class ProcessingRequest(BaseModel):
     email: EmailStr
     model: str = "u2net"
-    output_format: str = "png"
+    output_format: str = "png"  # an image format, or "mask" for the alpha matte alone
+    mask_encoding: str = "gray"  # output_format=mask: "gray", "binary" or "rle"
     quality: int = 95
     scale: float = 1.0
+    priority: str = "auto"  # "interactive", "bulk" or "auto" (see fair_queue.lane_for)
+    callback_url: str | None = None  # completion webhook (see app/services/webhooks.py)
+    animated: bool = False  # set by the router for GIF/WebP animations and videos
 
 
 class ProcessingStatus(BaseModel):
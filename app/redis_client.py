@@ -1,4 +1,35 @@
 import redis
+import redis.asyncio as aioredis
 from .config import settings
 
-redis_client = redis.from_url(settings.REDIS_URL)
\ No newline at end of file
+# "fakeredis://" runs everything against an in-process Redis stand-in (local
+# load tests, no server needed). fakeredis is a dev-only dependency, imported
+# only when asked for; sync and async clients share one fake server.
+_FAKE_SCHEME = "fakeredis://"
+_fake_server = None
+
+
+def _fake_server_instance():
+    global _fake_server
+    if _fake_server is None:
+        import fakeredis
+
+        _fake_server = fakeredis.FakeServer()
+    return _fake_server
+
+
+def make_async_client(**kwargs) -> aioredis.Redis:
+    """Async client for the same REDIS_URL (used by the rate limiter)."""
+    if settings.REDIS_URL.startswith(_FAKE_SCHEME):
+        import fakeredis
+
+        return fakeredis.FakeAsyncRedis(server=_fake_server_instance(), **kwargs)
+    return aioredis.from_url(settings.REDIS_URL, **kwargs)
+
+
+if settings.REDIS_URL.startswith(_FAKE_SCHEME):
+    import fakeredis
+
+    redis_client = fakeredis.FakeRedis(server=_fake_server_instance())
+else:
+    redis_client = redis.from_url(settings.REDIS_URL)
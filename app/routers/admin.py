@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from ..config import settings
+from ..services.executors import run_io
+from ..services.profiling import load_profile, load_trace, run_profile
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def require_admin(x_admin_token: str = Header(None)):
+    """
+    X-Admin-Token must match ADMIN_TOKEN. Without ADMIN_TOKEN the admin
+    routes do not exist (404), so they cannot be probed.
+    """
+    token = settings.ADMIN_TOKEN
+    if not token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token.")
+
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin)],
+    include_in_schema=False,
+)
+
+# One on-demand profile at a time: two samplers would skew each other
+_profiling = asyncio.Lock()
+
+
+@router.get("/traces/{task_id}")
+async def get_trace(task_id: str):
+    """
+    Span trace of the task's last attempt: pipeline stages (with queue wait)
+    and Redis writes, in milliseconds from the start of the attempt.
+    """
+    trace = await run_io(load_trace, task_id)
+    if trace is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No trace for this task.")
+    return trace
+
+
+@router.get("/profiles/{task_id}", response_class=PlainTextResponse)
+async def get_profile(task_id: str):
+    """
+    Folded stacks of a sampled task (see PROFILE_SAMPLE_RATE), ready for
+    flamegraph.pl or speedscope.
+    """
+    profile = await run_io(load_profile, task_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No profile for this task.")
+    return PlainTextResponse(profile)
+
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def profile_now(
+    seconds: float = Query(10.0, gt=0),
+    interval_ms: float = Query(None, gt=0),
+    include_idle: bool = Query(False),
+):
+    """
+    Samples every thread of this process for `seconds` (capped at
+    PROFILE_MAX_SECONDS) and returns the folded stacks. This is a wall-clock
+    profile: threads parked in known waits are left out unless include_idle.
+    The sampler runs on its own thread; a second request meanwhile gets 409.
+    """
+    if _profiling.locked():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profile is already running.")
+    seconds = min(seconds, settings.PROFILE_MAX_SECONDS)
+    interval = (interval_ms or settings.PROFILE_INTERVAL_MS) / 1000
+    async with _profiling:
+        logger.info(f"Profiling this process for {seconds:g}s")
+        folded = await run_profile(seconds, interval, include_idle)
+    return PlainTextResponse(folded, headers={"X-Profile-Clock": "wall", "X-Profile-Idle": str(include_idle).lower()})
@@ -1,53 +1,50 @@
 import os
-import json
-import boto3
+import time
 import logging
 from typing import Optional
 
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, status
 from fastapi.responses import FileResponse, RedirectResponse
-from fastapi_limiter.depends import RateLimiter
-from botocore.exceptions import ClientError
+from ..services.rate_limit import RateLimiter
 
-from ..redis_client import redis_client
 from ..config import settings
+from ..services.executors import run_io
+from ..services.task_state import get_task_with_ttl
+from ..services.storage import build_result_key, content_type_for, get_storage
+from ..services.http_cache import cache_control, etag_matches, quote_etag
 
 logger = logging.getLogger("uvicorn.error")
 
-# 1. Global S3 Client (Reusable Connection Pool)
-S3_CLIENT = boto3.client(
-    "s3",
-    region_name=settings.AWS_REGION,
-    aws_access_key_id=settings.AWS_ACCESS_KEY,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-)
-
 router = APIRouter(
     prefix="/download",
     tags=["download"],
 )
 
-@router.get(
+@router.api_route(
     "/{task_id}",
+    methods=["GET", "HEAD"],
     dependencies=[Depends(RateLimiter(times=20, seconds=60))],
 )
-async def download_image(task_id: str):
+async def download_image(task_id: str, request: Request):
     """
     Directs the user to the final image. 
     Uses S3 Presigned URLs for production or Local FileResponse for dev.
+
+    Responses carry a strong ETag (content hash) and a Cache-Control lifetime
+    equal to the remaining task TTL; If-None-Match revalidations get a 304 and
+    local files support Range requests.
     """
-    raw = redis_client.get(task_id)
-    if not raw:
+    meta, ttl = await run_io(get_task_with_ttl, task_id, ("error", "filename", "storage", "s3", "etag", "content_type"))
+    if not meta:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Download link expired or invalid."
         )
 
-    meta = json.loads(raw) # type: ignore
     current_status = meta.get("status")
 
     # 2. Handle non-ready states
-    if current_status == "processing":
+    if current_status in ("queued", "processing"):
         raise HTTPException(
             status_code=status.HTTP_423_LOCKED, 
             detail="Image is still being processed. Please refresh in a few seconds."
@@ -55,43 +52,62 @@ async def download_image(task_id: str):
     elif current_status == "failed":
         raise HTTPException(
             status_code=status.HTTP_410_GONE, 
-            detail=f"Processing failed: {meta.get('error', 'Unknown error')}"
+            detail=f"Processing failed: {meta.get('error') or 'Unknown error'}"
         )
 
     filename = meta.get("filename")
     if not filename:
         raise HTTPException(status_code=404, detail="File metadata missing.")
 
-    # 3. S3 Download Logic (Secure Redirect)
-    if meta.get("s3", False):
+    # 3. Conditional GET: the client already holds this exact content
+    etag = meta.get("etag")
+    cache_headers = {"Cache-Control": cache_control(ttl)}
+    if etag:
+        cache_headers["ETag"] = quote_etag(etag)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+
+    # Older tasks carried an "s3" flag instead of the backend name
+    backend = meta.get("storage") or ("s3" if meta.get("s3") == "1" else "local")
+    key = build_result_key(*filename.rsplit(".", 1))
+
+    # 4. S3 Download Logic (Secure Redirect)
+    if backend == "s3":
+        # botocore is only needed once S3 is actually in play
+        from botocore.exceptions import ClientError
+
         try:
             # Generate a URL that allows the user to download the private S3 object
-            # without making the whole bucket public.
-            presigned_url = S3_CLIENT.generate_presigned_url(
-                "get_object",
-                Params={
-                    "Bucket": settings.AWS_S3_BUCKET,
-                    "Key": f"processed/{filename}",
-                    # This forces the browser to download the file instead of just showing it
-                    "ResponseContentDisposition": f'attachment; filename="MIBTech_{filename}"'
-                },
-                ExpiresIn=3600, # URL expires in 1 hour
+            # without making the whole bucket public. Reused from the presign
+            # cache while it has enough validity left.
+            signed = await get_storage("s3").sign(
+                key,
+                # This forces the browser to download the file instead of just showing it
+                download_name=f"MIBTech_{filename}",
+                content_type=meta.get("content_type") or content_type_for(filename.rsplit(".", 1)[-1]),
+                cache_control=cache_control(ttl),
             )
-            return RedirectResponse(url=presigned_url)
+            # The redirect may be cached (by the browser or a CDN) only while the
+            # presigned URL it points to is still valid.
+            expires_in = int(signed.expires_at - time.time()) if signed.expires_at else settings.PRESIGNED_URL_EXPIRY
+            redirect_max_age = max(0, min(ttl, expires_in - 60))
+            cache_headers["Cache-Control"] = cache_control(redirect_max_age, public=True)
+            return RedirectResponse(url=signed.url, headers=cache_headers)
             
         except ClientError as e:
             logger.error(f"AWS S3 Error: {e}")
             raise HTTPException(status_code=500, detail="Secure storage provider error.")
 
-    # 4. Local Download Logic
-    local_path = os.path.join(settings.OUTPUT_DIR, filename)
+    # 5. Local Download Logic (OUTPUT_DIR is a shared volume when there are several nodes)
+    local_path = get_storage("local").path(key)
     if not os.path.exists(local_path):
         logger.warning(f"File {filename} missing from local disk despite Redis 'completed' status.")
         raise HTTPException(status_code=404, detail="Local file no longer exists.")
 
+    # FileResponse handles Range / If-Range (206) itself and keeps our ETag
     return FileResponse(
         path=local_path, 
         filename=f"MIBTech_{filename}",
-        media_type="image/png" # Standard for bg-removed images
+        media_type=meta.get("content_type") or content_type_for(filename.rsplit(".", 1)[-1]),
+        headers=cache_headers,
     )
-
@@ -5,64 +5,187 @@
 
 import uuid
 import secrets
+from typing import Optional, Tuple
 from fastapi import (
     APIRouter,
     Request,
     UploadFile,
     File,
     Form,
-    BackgroundTasks,
     HTTPException,
     Depends,
     status
 )
 from fastapi.responses import JSONResponse
-from fastapi_limiter.depends import RateLimiter
+from ..services.rate_limit import RateLimiter
 from pydantic import EmailStr, ValidationError
 
 from ..models import ProcessingRequest
 from ..tasks import enqueue_image_processing
 from ..config import settings
+from ..services.memory_budget import ImageTooLarge, check_pixel_budget
+from ..services.animation import ANIMATION_EXTENSIONS, OUTPUT_EXTENSION, probe_media, sniff_animated
+from ..services.direct_upload import PROBE_BYTES
+from ..services.image_processor import MASK_ENCODINGS
+from ..services.model_policy import AUTO_MODEL
+from ..services.webhooks import validate_callback_url
 
 router = APIRouter(prefix="/process", tags=["process"])
 
 # Use constants from settings if possible, otherwise define clearly
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 MiB
-ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "webp"}
+# GIF, animated WebP/PNG and videos may be larger
+MAX_ANIMATION_FILE_SIZE = settings.MAX_ANIMATION_UPLOAD_MB * 1024 * 1024
+ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "webp"} | ANIMATION_EXTENSIONS
 ALLOWED_MODELS = set(settings.MODEL_NAMES) if hasattr(settings, "MODEL_NAMES") else {"u2net", "u2netp", "u2net_human"}
+ALLOWED_PRIORITIES = {"auto", "interactive", "bulk"}
+ALLOWED_MASK_ENCODINGS = set(MASK_ENCODINGS)
+
+
+def client_identity(request: Request) -> str:
+    """Same client key as fastapi-limiter's default identifier, minus the path."""
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "anonymous"
+
+
+def file_extension(filename: Optional[str]) -> str:
+    """Lower-case extension of an upload name; 400 when it is not supported."""
+    extension = filename.split(".")[-1].lower() if filename else ""
+    if extension not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid file type. Supported: {ALLOWED_EXTENSIONS}"
+        )
+    return extension
+
+
+def max_upload_size(extension: str) -> int:
+    # Stills are held to MAX_FILE_SIZE once the header says they are not animated (admit_media)
+    return MAX_ANIMATION_FILE_SIZE if extension in ANIMATION_EXTENSIONS else MAX_FILE_SIZE
+
+
+def build_request(
+    email: str,
+    model: str,
+    output_format: str,
+    quality: int,
+    scale: float,
+    priority: str,
+    mask_encoding: str = "gray",
+    callback_url: Optional[str] = None,
+) -> ProcessingRequest:
+    """Validates the processing options shared by /process and direct uploads."""
+    if model not in ALLOWED_MODELS and model != AUTO_MODEL:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid model. Choose from: {list(ALLOWED_MODELS) + [AUTO_MODEL]}"
+        )
+
+    if priority not in ALLOWED_PRIORITIES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid priority. Choose from: {sorted(ALLOWED_PRIORITIES)}"
+        )
+
+    if output_format.lower() == "mask" and mask_encoding not in ALLOWED_MASK_ENCODINGS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid mask_encoding. Choose from: {sorted(ALLOWED_MASK_ENCODINGS)}"
+        )
+
+    if callback_url:
+        if not settings.WEBHOOK_SECRET:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Webhooks are not enabled on this server."
+            )
+        try:
+            validate_callback_url(callback_url)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    # Build Pydantic model (and catch validation errors early)
+    try:
+        return ProcessingRequest(
+            email=email,
+            model=model,
+            output_format=output_format.lower(),
+            quality=quality,
+            scale=scale,
+            priority=priority,
+            mask_encoding=mask_encoding,
+            callback_url=callback_url or None,
+        )
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors())
+
+
+def too_large_still(size: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File too large ({size} bytes). Maximum size for still images is {MAX_FILE_SIZE} bytes."
+    )
+
+
+def admit_media(header: bytes, size: int, pr: ProcessingRequest) -> Tuple[int, int]:
+    """
+    Pixel budget from the header: a small file can still decode to a huge
+    canvas. Marks animated uploads on `pr`; returns the dimensions.
+    `header` may be the first bytes of a larger upload of `size` bytes.
+    """
+    # 1. A cut-off header only shows Pillow its first frames: trust the container flags
+    hint = sniff_animated(header) if size > len(header) else None
+    if hint is False and size > MAX_FILE_SIZE:
+        raise too_large_still(size)
+
+    try:
+        width, height, animated = probe_media(header)
+        check_pixel_budget(width, height, pr.scale)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not read the image or video header.")
+    animated = animated or bool(hint)
+
+    if not animated and size > MAX_FILE_SIZE:
+        raise too_large_still(size)
+    if animated and pr.output_format == "mask":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="output_format=mask is only available for still images."
+        )
+    if animated:
+        # Frames are cut out into an animated WebP, the only output format with alpha
+        pr.output_format = OUTPUT_EXTENSION
+        pr.animated = True
+    return width, height
+
 
 @router.post(
     "/",
     status_code=status.HTTP_202_ACCEPTED,
-    dependencies=[
-        Depends(RateLimiter(times=1, seconds=15)),
-        Depends(RateLimiter(times=5, seconds=60)),
-    ],
+    # Burst (1 per 15 s) and steady (5 per 60 s) limits, checked in one Redis call
+    dependencies=[Depends(RateLimiter(windows=[(1, 15), (5, 60)]))],
 )
 async def create_task(
     request: Request,
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     email: EmailStr = Form(...),
     model: str = Form("u2net"),
     output_format: str = Form("png"),
     quality: int = Form(95, ge=1, le=100), # Inline validation
     scale: float = Form(1.0, gt=0, le=2.0), # Prevent extreme CPU usage
+    priority: str = Form("auto"), # interactive | bulk | auto
+    mask_encoding: str = Form("gray"), # output_format=mask: gray | binary | rle
+    callback_url: Optional[str] = Form(None), # signed POST on completion or failure
 ):
     # 1) Early validation of file extension (cheap check)
-    extension = file.filename.split(".")[-1].lower() if file.filename else ""
-    if extension not in ALLOWED_EXTENSIONS:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid file type. Supported: {ALLOWED_EXTENSIONS}"
-        )
+    extension = file_extension(file.filename)
 
-    # 2) Early validation of Model Selection
-    if model not in ALLOWED_MODELS:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid model. Choose from: {list(ALLOWED_MODELS)}"
-        )
+    # 2) Early validation of the model, priority and other options
+    pr = build_request(email, model, output_format, quality, scale, priority, mask_encoding, callback_url)
 
     # 3) Validate File Size without reading it all into memory at once
     # We check the actual size of the spool file created by FastAPI/Starlette
@@ -71,47 +194,48 @@ async def create_task(
     size = file.file.tell() # Get current position (size)
     file.file.seek(0) # Reset to beginning for reading
     
-    if size > MAX_FILE_SIZE:
+    max_size = max_upload_size(extension)
+    if size > max_size:
         raise HTTPException(
             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"File too large ({size} bytes). Maximum size is {MAX_FILE_SIZE} bytes."
+            detail=f"File too large ({size} bytes). Maximum size is {max_size} bytes."
         )
 
-    # 4) Build Pydantic model (and catch validation errors early)
+    # 4) Header checks (pixel budget, still vs animated) on the first bytes
+    # only: a still over MAX_FILE_SIZE is refused before the rest is read
+    header = await file.read(PROBE_BYTES)
     try:
-        pr = ProcessingRequest(
-            email=email,
-            model=model,
-            output_format=output_format.lower(),
-            quality=quality,
-            scale=scale,
-        )
-    except ValidationError as e:
-        raise HTTPException(status_code=422, detail=e.errors())
-
-    # 5) Read file bytes now that we know it is safe
-    file_bytes = await file.read()
+        width, height = admit_media(header, size, pr)
+    except HTTPException as e:
+        # Headers Pillow cannot open cut off (animated WebP, some mp4) are read whole
+        if e.status_code != status.HTTP_400_BAD_REQUEST or size <= len(header):
+            raise
+        header += await file.read()
+        width, height = admit_media(header, size, pr)
+    file_bytes = header + await file.read()
 
-    # 6) Generate a secure unique ID and Enqueue
+    # 5) Generate a secure unique ID and Enqueue
     # Using secrets or uuid4 is better than relying on task internal IDs
     task_id = str(uuid.uuid4())
     
-    enqueue_image_processing(
-        background_tasks,
+    await enqueue_image_processing(
         pr, 
         file_bytes,
         file.filename,
         task_id=task_id, # Pass the generated ID
-        base_url=str(request.base_url)
+        base_url=str(request.base_url),
+        client=client_identity(request),
+        dimensions=(width, height),
     )
 
-    # 7) Build clean response URLs
+    # 6) Build clean response URLs
     # Use request.url_for if your routes are named for better maintainability
     status_url = f"{request.base_url}status/{task_id}"
     
     return {
         "processing_id": task_id,
         "status_url": status_url,
+        "output_format": pr.output_format,
         "message": "Image received and queued for processing.",
         "estimated_wait": "Check your email or status URL in a few moments."
     }
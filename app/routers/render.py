@@ -0,0 +1,161 @@
+import hashlib
+import logging
+from typing import Optional
+
+from fastapi import (
+    APIRouter,
+    Depends,
+    File,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+    status,
+)
+from ..services.rate_limit import RateLimiter
+
+from ..config import settings
+from ..services.executors import run_codec, run_io
+from ..services.http_cache import cache_control, etag_matches, quote_etag
+from ..services.memory_budget import ImageTooLarge, check_pixel_budget, probe_dimensions
+from ..services.renderer import RENDER_FORMATS, RenderParams, parse_color, render, render_key
+from ..services.storage import content_type_for
+from ..services.task_state import get_task_with_ttl
+
+logger = logging.getLogger("uvicorn.error")
+
+router = APIRouter(
+    prefix="/render",
+    tags=["render"],
+)
+
+MAX_BACKGROUND_SIZE = 5 * 1024 * 1024  # 5 MiB, same limit as uploads
+
+
+def admit_background(data: bytes) -> None:
+    """Pixel budget from the background's header, before anything decodes it."""
+    try:
+        check_pixel_budget(*probe_dimensions(data), 1.0)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Could not read the background image.")
+
+
+async def _render_response(
+    request: Request,
+    task_id: str,
+    width: Optional[int],
+    height: Optional[int],
+    bg: Optional[str],
+    output_format: str,
+    quality: int,
+    background_image: Optional[bytes] = None,
+) -> Response:
+    # 1. Validate parameters before touching Redis
+    output_format = output_format.lower().strip(".")
+    if output_format not in RENDER_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid format. Choose from: {list(RENDER_FORMATS)}"
+        )
+    try:
+        background = parse_color(bg)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid background color '{bg}'.")
+
+    # 2. The task must be completed and still have its source + mask
+    meta, ttl = await run_io(get_task_with_ttl, task_id, ("assets", "scale", "etag"))
+    if not meta:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Task not found or has expired.")
+    if meta["status"] in ("queued", "processing"):
+        raise HTTPException(status_code=status.HTTP_423_LOCKED, detail="Image is still being processed.")
+    if meta["status"] != "completed":
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Processing failed; nothing to render.")
+    if not meta.get("assets"):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Render assets are not available for this task."
+        )
+
+    params = RenderParams(
+        width=width,
+        height=height,
+        background=background,
+        output_format=output_format,
+        quality=quality,
+        background_image_sha=hashlib.sha256(background_image).hexdigest() if background_image else None,
+    )
+
+    # 3. Derivatives are deterministic, so the ETag is known before rendering
+    etag = render_key(task_id, meta.get("etag") or "", params)
+    headers = {"ETag": quote_etag(etag), "Cache-Control": cache_control(ttl)}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # 4. Render (or hit the LRU) on the codec pool
+    try:
+        content = await run_codec(
+            render,
+            task_id,
+            meta["assets"],
+            float(meta.get("scale") or 1.0),
+            meta.get("etag") or "",
+            params,
+            background_image,
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail="Render assets no longer exist.")
+    except Exception as e:
+        logger.error(f"Render failed for {task_id}: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not render image.")
+
+    return Response(content=content, media_type=content_type_for(output_format), headers=headers)
+
+
+@router.get(
+    "/{task_id}",
+    dependencies=[Depends(RateLimiter(times=120, seconds=60))],
+)
+async def render_derivative(
+    request: Request,
+    task_id: str,
+    width: Optional[int] = Query(None, ge=1, le=settings.RENDER_MAX_SIDE),
+    height: Optional[int] = Query(None, ge=1, le=settings.RENDER_MAX_SIDE),
+    bg: Optional[str] = Query(None, description="Background color (#rrggbb, name) or 'transparent'"),
+    output_format: str = Query("png", alias="format"),
+    quality: int = Query(settings.DEFAULT_QUALITY, ge=1, le=100),
+):
+    """
+    Builds a derivative (resize, background color, format/quality) of a
+    completed task from its stored original and alpha mask, without inference.
+    """
+    return await _render_response(request, task_id, width, height, bg, output_format, quality)
+
+
+@router.post(
+    "/{task_id}",
+    dependencies=[Depends(RateLimiter(times=30, seconds=60))],
+)
+async def render_on_background(
+    request: Request,
+    task_id: str,
+    background: UploadFile = File(...),
+    width: Optional[int] = Form(None, ge=1, le=settings.RENDER_MAX_SIDE),
+    height: Optional[int] = Form(None, ge=1, le=settings.RENDER_MAX_SIDE),
+    output_format: str = Form("jpg", alias="format"),
+    quality: int = Form(settings.DEFAULT_QUALITY, ge=1, le=100),
+):
+    """
+    Composites the cut-out subject onto an uploaded background image.
+    """
+    data = await background.read(MAX_BACKGROUND_SIZE + 1)
+    if len(data) > MAX_BACKGROUND_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Background too large. Maximum size is {MAX_BACKGROUND_SIZE} bytes."
+        )
+    admit_background(data)
+    return await _render_response(request, task_id, width, height, None, output_format, quality, data)
@@ -1,12 +1,18 @@
 import json
 import logging
 from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi_limiter.depends import RateLimiter
-from ..redis_client import redis_client
+from ..services.executors import run_io
+from ..services.rate_limit import RateLimiter
+from ..services.task_state import get_task
+from ..services.storage import build_preview_key, build_result_key, get_storage
 
 
 logger = logging.getLogger("uvicorn.error")
 
+def _float(value):
+    return float(value) if value else None
+
+
 router = APIRouter(
     prefix="/status",
     tags=["status"],
@@ -21,35 +27,76 @@ async def get_status(task_id: str):
     Retrieves the current state of an image processing task from Redis.
     """
     try:
-        # redis_client is used directly; ensure it's the sync or async version 
-        # consistent with your redis_client.py definition.
-        raw = redis_client.get(task_id)
+        # Single HMGET for just the fields this response needs, off the event loop
+        data = await run_io(
+            get_task,
+            task_id,
+            ("model", "model_reason", "email_status", "webhook_status", "webhook_log", "file_url", "filename", "storage", "s3", "error",
+             "preview_url", "preview_storage", "queued_at", "started_at", "preview_at", "finished_at"),
+        )
         
-        if not raw:
+        if not data:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, 
                 detail="Task not found or has expired from the cache."
             )
 
-        data = json.loads(raw) # type: ignore
+        # Presigned URLs expire before the task does: re-sign S3 results on
+        # read (a cache hit while the stored one still has time left)
+        file_url = data.get("file_url")
+        if data.get("storage") == "s3" and data.get("filename"):
+            file_url = await get_storage("s3").presign(build_result_key(*data["filename"].rsplit(".", 1)))
+        preview_url = data.get("preview_url")
+        if data.get("preview_storage") == "s3":
+            preview_url = await get_storage("s3").presign(build_preview_key(task_id))
+
+        # Progressive results: "preview" once the fast preview is stored, "final" when done
+        task_status = data.get("status") or "unknown"
+        if task_status == "completed":
+            stage = "final"
+        elif preview_url and task_status != "failed":
+            stage = "preview"
+        else:
+            stage = None
 
         # Build a clean, structured response
         return {
             "processing_id": task_id,
-            "status": data.get("status", "unknown"),
+            "status": task_status,
             "progress": {
+                "stage": stage,
                 "model_used": data.get("model"),
+                # model=auto: why this model was picked
+                "model_reason": data.get("model_reason"),
                 "email_notified": data.get("email_status") == "sent",
             },
             "result": {
-                "file_url": data.get("file_url"),
+                "file_url": file_url,
+                # Low-res WebP from PREVIEW_MODEL, shown until file_url is ready
+                "preview_url": preview_url,
                 "filename": data.get("filename"),
-                "storage_provider": "s3" if data.get("s3") else "local"
+                # Older tasks carried an "s3" flag instead of the backend name
+                "storage_provider": data.get("storage") or ("s3" if data.get("s3") == "1" else "local"),
+            },
+            "error": data.get("error"), # Only present if status is 'failed'
+            # Only for tasks submitted with a callback_url: one entry per delivery attempt
+            "webhook": {
+                "status": data.get("webhook_status"),
+                "log": json.loads(data.get("webhook_log") or "[]"),
+            } if data.get("webhook_status") else None,
+            # Unix timestamps: queue wait = started - queued, processing = finished - started
+            "timings": {
+                "queued_at": _float(data.get("queued_at")),
+                "started_at": _float(data.get("started_at")),
+                "preview_at": _float(data.get("preview_at")),
+                "finished_at": _float(data.get("finished_at")),
             },
-            "error": data.get("error") # Only present if status is 'failed'
         }
 
+    except HTTPException:
+        raise
     except json.JSONDecodeError:
+        # Only possible for legacy JSON-string entries being migrated
         logger.error(f"Malformed metadata in Redis for task {task_id}")
         raise HTTPException(status_code=500, detail="Internal metadata corruption.")
     except Exception as e:
@@ -0,0 +1,129 @@
+import uuid
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Request, Form, HTTPException, Depends, status
+from pydantic import EmailStr
+
+from ..config import settings
+from ..services import direct_upload
+from ..services.executors import run_io
+from ..services.rate_limit import RateLimiter
+from ..services.storage import build_upload_key, content_type_for, get_storage
+from ..tasks import enqueue_image_processing
+from .process import admit_media, build_request, client_identity, file_extension, max_upload_size
+
+logger = logging.getLogger("uvicorn.error")
+
+router = APIRouter(prefix="/uploads", tags=["uploads"])
+
+
+@router.post(
+    "/",
+    # Burst (1 per 15 s) and steady (5 per 60 s) limits, checked in one Redis call
+    dependencies=[Depends(RateLimiter(windows=[(1, 15), (5, 60)]))],
+)
+async def start_upload(request: Request, filename: str = Form(...)):
+    """
+    Returns a presigned POST for sending the file straight to object storage
+    (see app/services/direct_upload.py), then call `complete_url`.
+    """
+    extension = file_extension(filename)
+    storage = get_storage()
+    upload_id = str(uuid.uuid4())
+    key = build_upload_key(upload_id, extension)
+    max_bytes = max_upload_size(extension)
+    expires_in = settings.DIRECT_UPLOAD_EXPIRY_SECONDS
+
+    try:
+        post = await storage.presign_post(key, content_type_for(extension), max_bytes, expires_in)
+    except NotImplementedError as e:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(e))
+
+    await run_io(
+        direct_upload.create,
+        upload_id,
+        expires_in,
+        key=key,
+        filename=filename,
+        storage=storage.name,
+        client=client_identity(request),
+    )
+    return {
+        "upload_id": upload_id,
+        "url": post.url,
+        # Send these form fields first and the file last, as "file"
+        "fields": post.fields,
+        "max_bytes": max_bytes,
+        "expires_in": expires_in,
+        "complete_url": f"{request.base_url}uploads/{upload_id}/complete",
+    }
+
+
+@router.post(
+    "/{upload_id}/complete",
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(RateLimiter(times=10, seconds=60))],
+)
+async def complete_upload(
+    request: Request,
+    upload_id: str,
+    email: EmailStr = Form(...),
+    model: str = Form("u2net"),
+    output_format: str = Form("png"),
+    quality: int = Form(95, ge=1, le=100),
+    scale: float = Form(1.0, gt=0, le=2.0),
+    priority: str = Form("auto"),
+    mask_encoding: str = Form("gray"),
+    callback_url: Optional[str] = Form(None),
+):
+    """
+    Queues a finished direct upload; same options and response as /process.
+    """
+    # 1) The pending upload
+    upload = await run_io(direct_upload.load, upload_id)
+    if not upload:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found or expired.")
+
+    pr = build_request(email, model, output_format, quality, scale, priority, mask_encoding, callback_url)
+
+    # 2) The object must be there; the store already enforced type and size
+    storage = get_storage(upload["storage"])
+    key = upload["key"]
+    stored = await storage.stat(key)
+    if stored is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="The file has not been uploaded yet.")
+
+    # 3) Header checks from the first bytes only. Containers with their index
+    # at the end (some mp4) are the exception and are read whole.
+    header = await storage.read_head(key, direct_upload.PROBE_BYTES)
+    try:
+        width, height = admit_media(header, stored.size, pr)
+    except HTTPException as e:
+        if e.status_code != status.HTTP_400_BAD_REQUEST or stored.size <= len(header):
+            raise
+        width, height = admit_media(await storage.get(key), stored.size, pr)
+
+    # 4) One job per upload, however often /complete is called
+    if not await run_io(direct_upload.claim, upload_id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="This upload has already been queued.")
+
+    task_id = str(uuid.uuid4())
+    await enqueue_image_processing(
+        pr,
+        None,
+        upload["filename"],
+        task_id=task_id,
+        base_url=str(request.base_url),
+        client=upload.get("client") or client_identity(request),
+        dimensions=(width, height),
+        object_key=key,
+        upload_size=stored.size,
+    )
+    return {
+        "processing_id": task_id,
+        "status_url": f"{request.base_url}status/{task_id}",
+        "output_format": pr.output_format,
+        "message": "Image received and queued for processing.",
+        "estimated_wait": "Check your email or status URL in a few moments."
+    }
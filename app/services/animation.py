@@ -0,0 +1,331 @@
+"""
+Animated GIF / WebP and short videos: frame-streamed background removal.
+
+Frames are decoded one at a time (Pillow for GIF, animated WebP and APNG,
+OpenCV for webm/mp4/mov), resampled to at most ANIMATION_MAX_FPS and cut
+out against a mask. Consecutive frames rarely change much, so the model
+only runs on keyframes:
+
+- a frame becomes a keyframe when its 64x64 grayscale thumbnail differs
+  from the last keyframe's by more than ANIMATION_REUSE_MAX_DIFF (mean
+  absolute gray level), or ANIMATION_KEYFRAME_INTERVAL frames have passed;
+- every other frame reuses the mask of the keyframe before it.
+
+Keyframes are collected ANIMATION_BATCH_SIZE at a time and segmented in one
+session run (image_processor.predict_masks). Cut-out frames go straight
+into an animated WebP encoder, which keeps only compressed frames, so no
+more than ANIMATION_BATCH_SIZE * ANIMATION_KEYFRAME_INTERVAL decoded frames
+wait in memory at once. The output is always an animated WebP (it keeps
+the alpha channel).
+
+The incremental encoder is Pillow's private _webp.WebPAnimEncoder. Builds
+without it fall back to Image.save(save_all=True), which needs every frame
+up front: those are kept PNG-compressed until the end.
+"""
+import logging
+import tempfile
+import warnings
+from contextlib import contextmanager
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageSequence, UnidentifiedImageError
+
+from app.config import settings
+from app.services import metrics
+from app.services.image_processor import cutout, predict_masks
+from app.services.memory_budget import check_pixel_budget, probe_dimensions
+
+try:
+    # Private API, the only incremental animated WebP encoder Pillow has
+    from PIL._webp import WebPAnimEncoder as _WebPAnimEncoder
+except ImportError:
+    _WebPAnimEncoder = None
+
+logger = logging.getLogger("uvicorn.error")
+
+FRAMES = metrics.counter("bgr_animation_frames_total", "Animation frames processed, by mask source.")
+
+# Uploads that may hold several frames; the header decides (a one-frame GIF is a still)
+ANIMATION_EXTENSIONS = {"gif", "webp", "png", "webm", "mp4", "mov"}
+VIDEO_EXTENSIONS = {"webm", "mp4", "mov"}
+OUTPUT_EXTENSION = "webp"
+
+THUMB_SIZE = (64, 64)
+
+
+class AnimationTooLong(ValueError):
+    """More frames or seconds than ANIMATION_MAX_FRAMES / ANIMATION_MAX_SECONDS."""
+
+
+@dataclass
+class Frame:
+    image: Image.Image
+    timestamp_ms: float
+
+
+@dataclass
+class AnimationStats:
+    frames: int = 0
+    keyframes: int = 0
+    duration_ms: float = 0.0
+
+    def fields(self) -> dict:
+        """Task hash fields for the status endpoint and tuning."""
+        return {"frames": self.frames, "keyframes": self.keyframes, "duration_ms": round(self.duration_ms)}
+
+
+@contextmanager
+def _video_capture(data: bytes):
+    """OpenCV only reads from files: spool the upload to a temporary one."""
+    import cv2
+
+    with tempfile.NamedTemporaryFile(suffix=".video") as fh:
+        fh.write(data)
+        fh.flush()
+        capture = cv2.VideoCapture(fh.name)
+        try:
+            if not capture.isOpened():
+                raise ValueError("Unsupported image or video format.")
+            yield capture
+        finally:
+            capture.release()
+
+
+def probe_media(data: bytes) -> Tuple[int, int, bool]:
+    """
+    Width, height and whether the upload is animated, from the header only.
+    Raises ImageTooLarge like probe_dimensions, ValueError for unreadable data.
+    """
+    try:
+        width, height = probe_dimensions(data)
+    except UnidentifiedImageError:
+        import cv2
+
+        with _video_capture(data) as capture:
+            width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if not width or not height:
+            raise ValueError("Could not read the video dimensions.")
+        return width, height, True
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+        with Image.open(BytesIO(data)) as image:
+            return width, height, bool(getattr(image, "is_animated", False))
+
+
+def sniff_animated(header: bytes) -> Optional[bool]:
+    """
+    Whether the first bytes of a GIF, PNG or WebP announce an animation.
+    Pillow cannot tell from a cut-off file (it only sees the frames inside
+    it, and does not open a cut WebP at all). None for other containers.
+    """
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        # Animated GIFs carry the looping extension before their first frame
+        return b"NETSCAPE2.0" in header or b"ANIMEXTS1.0" in header
+    if header[:8] == b"\x89PNG\r\n\x1a\n":
+        # APNG declares acTL before the first IDAT
+        actl, idat = header.find(b"acTL"), header.find(b"IDAT")
+        return actl != -1 and (idat == -1 or actl < idat)
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        # Extended format, animation flag
+        return header[12:16] == b"VP8X" and len(header) > 20 and bool(header[20] & 0x02)
+    if header[:3] == b"\xff\xd8\xff":
+        return False
+    return None
+
+
+def _pillow_frames(image: Image.Image) -> Iterator[Frame]:
+    timestamp = 0.0
+    for frame in ImageSequence.Iterator(image):
+        # The iterator re-uses one seeked image: convert() takes the copy
+        yield Frame(frame.convert("RGBA"), timestamp)
+        timestamp += frame.info.get("duration") or 100
+
+
+def _video_frames(data: bytes) -> Iterator[Frame]:
+    import cv2
+
+    with _video_capture(data) as capture:
+        while True:
+            ok, bgr = capture.read()
+            if not ok:
+                return
+            # Per-frame position: container frame rates (webm) are often bogus
+            timestamp = capture.get(cv2.CAP_PROP_POS_MSEC)
+            yield Frame(Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)), timestamp)
+
+
+def iter_frames(data: bytes, scale: float) -> Iterator[Frame]:
+    """
+    Decoded, scaled frames at no more than ANIMATION_MAX_FPS. Raises
+    AnimationTooLong once the limits are passed, before decoding further.
+    """
+    try:
+        source = _pillow_frames(Image.open(BytesIO(data)))
+    except UnidentifiedImageError:
+        source = _video_frames(data)
+
+    min_gap = 1000.0 / settings.ANIMATION_MAX_FPS if settings.ANIMATION_MAX_FPS > 0 else 0.0
+    next_at: Optional[float] = None
+    count = 0
+    target = None
+    for frame in source:
+        # 1. Drop frames closer together than the output frame rate
+        if next_at is not None and frame.timestamp_ms < next_at:
+            continue
+        next_at = frame.timestamp_ms + min_gap
+
+        # 2. Limits
+        count += 1
+        if count > settings.ANIMATION_MAX_FRAMES or frame.timestamp_ms > settings.ANIMATION_MAX_SECONDS * 1000:
+            raise AnimationTooLong(
+                f"Animations are limited to {settings.ANIMATION_MAX_FRAMES} frames "
+                f"and {settings.ANIMATION_MAX_SECONDS:g} seconds."
+            )
+
+        # 3. Scale (the budget is checked once, all frames share the canvas)
+        if target is None:
+            width, height = frame.image.size
+            check_pixel_budget(width, height, scale)
+            target = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if frame.image.size != target:
+            frame.image = frame.image.resize(target, Image.Resampling.LANCZOS)
+        yield frame
+
+
+def _thumb(image: Image.Image) -> np.ndarray:
+    return np.asarray(image.convert("L").resize(THUMB_SIZE, Image.Resampling.BILINEAR), dtype=np.int16)
+
+
+class AnimatedWebPWriter:
+    """
+    Incremental animated WebP encoder: frames are compressed as they are
+    added. Mirrors Pillow's WebPImagePlugin._save_all, which needs every
+    frame up front.
+    """
+
+    def __init__(self, size: Tuple[int, int], quality: int):
+        self.lossless = quality >= 100
+        self.quality = quality
+        # Keyframe spacing defaults of gif2webp (and of Pillow)
+        kmin, kmax = (9, 17) if self.lossless else (3, 5)
+        self._encoder = _WebPAnimEncoder(size, 0, 0, False, kmin, kmax, False, False)
+
+    def add(self, frame: Image.Image, timestamp_ms: float) -> None:
+        self._encoder.add(frame.getim(), round(timestamp_ms), self.lossless, self.quality, 100, 0)
+
+    def finish(self, end_ms: float) -> bytes:
+        self._encoder.add(None, round(end_ms), self.lossless, self.quality, 100, 0)
+        data = self._encoder.assemble("", "", "")
+        if data is None:
+            raise ValueError("cannot write file as WebP (encoder returned None)")
+        return data
+
+
+class BufferedWebPWriter:
+    """
+    Same interface on Pillow's public API, for builds without the private
+    encoder. Frames wait PNG-compressed and are encoded in finish().
+    """
+
+    def __init__(self, size: Tuple[int, int], quality: int):
+        self.quality = quality
+        self._frames: List[bytes] = []
+        self._timestamps: List[float] = []
+
+    def add(self, frame: Image.Image, timestamp_ms: float) -> None:
+        buffer = BytesIO()
+        frame.save(buffer, format="PNG", compress_level=1)
+        self._frames.append(buffer.getvalue())
+        self._timestamps.append(timestamp_ms)
+
+    def finish(self, end_ms: float) -> bytes:
+        ends = self._timestamps[1:] + [end_ms]
+        durations = [max(1, round(end - start)) for start, end in zip(self._timestamps, ends)]
+        # Image.open is lazy: each frame is decoded when the encoder reaches it
+        first, *rest = [Image.open(BytesIO(data)) for data in self._frames]
+        output = BytesIO()
+        first.save(
+            output,
+            format="WEBP",
+            save_all=True,
+            append_images=rest,
+            duration=durations,
+            loop=0,
+            lossless=self.quality >= 100,
+            quality=self.quality,
+        )
+        return output.getvalue()
+
+
+def webp_writer(size: Tuple[int, int], quality: int):
+    """The incremental encoder when this Pillow build has it."""
+    if _WebPAnimEncoder is None:
+        return BufferedWebPWriter(size, quality)
+    return AnimatedWebPWriter(size, quality)
+
+
+def process_animation(data: bytes, model_name: str, scale: float, quality: int) -> Tuple[bytes, AnimationStats]:
+    """
+    Full streaming unit of work for an animated upload: decode, keyframe
+    inference, cutout and encode. Returns the animated WebP and frame counts.
+    """
+    stats = AnimationStats()
+    writer = None
+    key_thumb: Optional[np.ndarray] = None
+    since_key = 0
+    # Frames waiting for their keyframe's mask; keyframe index -> mask once segmented
+    pending: List[Tuple[Frame, int]] = []
+    keyframes: List[Image.Image] = []
+    masks: List[Image.Image] = []
+    last_timestamp, last_gap = 0.0, 100.0
+
+    def flush() -> None:
+        nonlocal writer
+        masks.extend(predict_masks(keyframes, model_name) if keyframes else [])
+        keyframes.clear()
+        for frame, key_index in pending:
+            if writer is None:
+                writer = webp_writer(frame.image.size, quality)
+            writer.add(cutout(frame.image, masks[key_index]), frame.timestamp_ms)
+        pending.clear()
+        # Only the newest mask can still be reused by later frames
+        del masks[:-1]
+
+    for frame in iter_frames(data, scale):
+        stats.frames += 1
+        if stats.frames > 1:
+            last_gap = frame.timestamp_ms - last_timestamp
+        last_timestamp = frame.timestamp_ms
+
+        # 1. Keyframe, or close enough to the last one to reuse its mask
+        thumb = _thumb(frame.image)
+        is_key = (
+            key_thumb is None
+            or since_key >= settings.ANIMATION_KEYFRAME_INTERVAL
+            or float(np.abs(thumb - key_thumb).mean()) > settings.ANIMATION_REUSE_MAX_DIFF
+        )
+        if is_key:
+            key_thumb, since_key = thumb, 0
+            keyframes.append(frame.image)
+            stats.keyframes += 1
+            FRAMES.inc(source="model")
+        else:
+            since_key += 1
+            FRAMES.inc(source="reused")
+        # Masks of earlier batches were trimmed to the newest one (index 0)
+        pending.append((frame, len(masks) + len(keyframes) - 1))
+
+        # 2. Segment a full batch of keyframes, then emit the frames waiting on them
+        if len(keyframes) >= settings.ANIMATION_BATCH_SIZE:
+            flush()
+
+    if not stats.frames:
+        raise ValueError("The upload contains no frames.")
+    flush()
+    stats.duration_ms = last_timestamp + max(1.0, last_gap)
+    return writer.finish(stats.duration_ms), stats
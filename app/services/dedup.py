@@ -0,0 +1,187 @@
+"""
+Near-duplicate uploads: reuse a recent mask instead of running inference.
+
+The same photo re-exported at another JPEG quality or resized by a phone has
+different bytes but (almost) the same perceptual hashes. Every completed
+task with stored assets is indexed by:
+
+- pHash: 64-bit sign pattern of the low 8x8 DCT coefficients of a 32x32
+  grayscale thumbnail (robust to resizing and recompression),
+- dHash: 64-bit horizontal gradient signs of a 9x8 thumbnail (a second,
+  independent opinion),
+- a 16x16 grayscale thumbnail and the aspect ratio, for final verification.
+
+The pHash is split into 8 bands of 8 bits; each band value is a capped Redis
+ZSET of recent "task_id:phash" members (per model), so any stored image
+within 7 bits of Hamming distance shares at least one bucket with the
+query. Candidates are filtered on the pHash carried in the member, then
+verified against DEDUP_PHASH_MAX_DISTANCE, DEDUP_DHASH_MAX_DISTANCE, the
+aspect ratio and DEDUP_MAX_THUMB_DIFF (mean absolute gray-level difference)
+before the stored mask is rescaled and reused.
+
+Lookups and hits are counted per day in Redis (bgr:dedup:stats:<date>) and
+exported as Prometheus counters; see scripts/dedup_report.py.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from io import BytesIO
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+from app.redis_client import redis_client
+from app.services import metrics
+from app.services.storage import ASSET_MASK, read_asset
+from app.services.task_state import update_task
+
+logger = logging.getLogger("uvicorn.error")
+
+BANDS = 8
+BAND_KEY = "bgr:phash:{model}:{band}:{value:02x}"
+STATS_KEY = "bgr:dedup:stats:{day}"
+STATS_TTL_SECONDS = 90 * 86400
+
+LOOKUPS = metrics.counter("bgr_dedup_lookups_total", "Near-duplicate lookups before inference.")
+HITS = metrics.counter("bgr_dedup_hits_total", "Inference runs avoided by reusing a near-duplicate's mask.")
+
+_N = 32
+# Orthonormal DCT-II basis for the 32x32 pHash thumbnail
+_DCT = np.sqrt(2 / _N) * np.cos(np.pi * (2 * np.arange(_N)[None, :] + 1) * np.arange(_N)[:, None] / (2 * _N))
+_DCT[0] /= np.sqrt(2)
+
+
+@dataclass(frozen=True)
+class Signature:
+    phash: int
+    dhash: int
+    thumb: bytes  # 16x16 grayscale
+    aspect: float
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int("".join("1" if b else "0" for b in bits.ravel()), 2)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def signature(image: Image.Image) -> Signature:
+    """Perceptual hashes of a decoded image (a few small resizes, ~1 ms)."""
+    # Shrink once with a cheap box filter; every hash is computed from this
+    small = image.convert("RGB").resize((64, 64), Image.Resampling.BOX).convert("L")
+
+    pixels = np.asarray(small.resize((_N, _N), Image.Resampling.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:8, :8].ravel()
+    phash = _bits_to_int(low > np.median(low[1:]))
+
+    grad = np.asarray(small.resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    dhash = _bits_to_int(grad[:, 1:] > grad[:, :-1])
+
+    thumb = small.resize((16, 16), Image.Resampling.LANCZOS).tobytes()
+    return Signature(phash=phash, dhash=dhash, thumb=thumb, aspect=image.width / image.height)
+
+
+def _band_keys(model: str, phash: int) -> List[str]:
+    return [
+        BAND_KEY.format(model=model, band=band, value=(phash >> (8 * band)) & 0xFF)
+        for band in range(BANDS)
+    ]
+
+
+def _count(field: str) -> None:
+    key = STATS_KEY.format(day=time.strftime("%Y-%m-%d", time.gmtime()))
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hincrby(key, field, 1)
+    pipe.expire(key, STATS_TTL_SECONDS)
+    pipe.execute()
+
+
+def _candidates(model: str, sig: Signature) -> List[Tuple[int, str]]:
+    pipe = redis_client.pipeline(transaction=False)
+    for key in _band_keys(model, sig.phash):
+        pipe.zrevrange(key, 0, settings.DEDUP_BUCKET_SIZE - 1)
+    seen = {}
+    for members in pipe.execute():
+        for member in members:
+            task_id, _, hex_hash = member.decode().rpartition(":")
+            if task_id in seen:
+                continue
+            distance = hamming(sig.phash, int(hex_hash, 16))
+            if distance <= settings.DEDUP_PHASH_MAX_DISTANCE:
+                seen[task_id] = distance
+    ranked = sorted((d, t) for t, d in seen.items())
+    return ranked[: settings.DEDUP_MAX_CANDIDATES]
+
+
+def _verified(sig: Signature, meta: list) -> bool:
+    status, dhash, thumb, aspect, assets = (v.decode() if isinstance(v, bytes) else v for v in meta)
+    if status != "completed" or not assets or not dhash or not thumb or not aspect:
+        return False
+    if hamming(sig.dhash, int(dhash, 16)) > settings.DEDUP_DHASH_MAX_DISTANCE:
+        return False
+    if abs(sig.aspect - float(aspect)) > 0.01 * sig.aspect:
+        return False
+    ours = np.frombuffer(sig.thumb, dtype=np.uint8).astype(np.int16)
+    theirs = np.frombuffer(bytes.fromhex(thumb), dtype=np.uint8).astype(np.int16)
+    return float(np.abs(ours - theirs).mean()) <= settings.DEDUP_MAX_THUMB_DIFF
+
+
+def find_mask(
+    image: Image.Image, model: str, sig: Optional[Signature] = None
+) -> Optional[Tuple[Image.Image, str]]:
+    """
+    Returns (mask rescaled to `image`, source task id) when a verified
+    near-duplicate processed with the same model is still stored, else None.
+    Never raises: on any lookup problem inference simply runs.
+    """
+    try:
+        sig = sig or signature(image)
+        LOOKUPS.inc()
+        _count("lookups")
+        candidates = _candidates(model, sig)
+        if not candidates:
+            return None
+
+        pipe = redis_client.pipeline(transaction=False)
+        for _, task_id in candidates:
+            pipe.hmget(task_id, ["status", "dhash", "thumb", "aspect", "assets"])
+        for (_, task_id), meta in zip(candidates, pipe.execute()):
+            if not _verified(sig, meta):
+                continue
+            assets = meta[4].decode() if isinstance(meta[4], bytes) else meta[4]
+            try:
+                mask = Image.open(BytesIO(read_asset(task_id, ASSET_MASK, assets))).convert("L")
+            except Exception:
+                continue  # assets already cleaned up
+            if mask.size != image.size:
+                mask = mask.resize(image.size, Image.Resampling.BILINEAR)
+            HITS.inc()
+            _count("hits")
+            return mask, task_id
+    except Exception as e:
+        logger.warning(f"Near-duplicate lookup failed, running inference: {str(e)}")
+    return None
+
+
+def register(task_id: str, model: str, sig: Signature) -> None:
+    """Indexes a completed task whose mask is stored (assets kept)."""
+    update_task(
+        task_id,
+        phash=f"{sig.phash:016x}",
+        dhash=f"{sig.dhash:016x}",
+        thumb=sig.thumb.hex(),
+        aspect=f"{sig.aspect:.6f}",
+    )
+    member = f"{task_id}:{sig.phash:016x}"
+    now = time.time()
+    pipe = redis_client.pipeline(transaction=False)
+    for key in _band_keys(model, sig.phash):
+        pipe.zadd(key, {member: now})
+        # Keep only the most recent uploads per bucket
+        pipe.zremrangebyrank(key, 0, -settings.DEDUP_BUCKET_SIZE - 1)
+        pipe.expire(key, settings.REDIS_TTL_SECONDS)
+    pipe.execute()
@@ -0,0 +1,51 @@
+"""
+Direct uploads: the file goes from the client straight to object storage.
+
+1. POST /uploads/ returns a presigned POST for "uploads/<id>.<ext>". The
+   store itself enforces the content type and the size limit.
+2. The client POSTs the file to that URL; the web tier never sees the bytes.
+3. POST /uploads/<id>/complete checks the stored object (size, header from
+   a ranged read) and enqueues the job by object key. The worker reads the
+   upload from storage instead of Redis.
+
+A pending upload is a Redis hash ("upload:<id>") that lives as long as its
+presigned POST plus COMPLETE_GRACE_SECONDS. Completing claims the hash
+(DEL), so one upload becomes at most one job. Staged objects are deleted
+once their job succeeds; the cleanup job sweeps the rest (on S3 a lifecycle
+rule on the prefix does the same).
+"""
+import logging
+from typing import Dict, Optional
+
+from app.redis_client import redis_client
+
+logger = logging.getLogger("uvicorn.error")
+
+UPLOAD_KEY = "upload:{}"
+# Time to call /complete after the upload window closed
+COMPLETE_GRACE_SECONDS = 3600
+# Enough for the header of any supported image; videos may need the whole file
+PROBE_BYTES = 256 * 1024
+
+
+def create(upload_id: str, expires_in: int, **fields) -> None:
+    key = UPLOAD_KEY.format(upload_id)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(key, mapping={k: str(v) for k, v in fields.items()})
+    pipe.expire(key, expires_in + COMPLETE_GRACE_SECONDS)
+    pipe.execute()
+
+
+def load(upload_id: str) -> Optional[Dict[str, str]]:
+    data = redis_client.hgetall(UPLOAD_KEY.format(upload_id))
+    if not data:
+        return None
+    return {
+        (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+        for k, v in data.items()
+    }
+
+
+def claim(upload_id: str) -> bool:
+    """True for exactly one caller: the one allowed to enqueue the upload."""
+    return bool(redis_client.delete(UPLOAD_KEY.format(upload_id)))
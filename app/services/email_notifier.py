@@ -1,18 +1,20 @@
 import smtplib, ssl
+import time
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from typing import Optional
 from app.config import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
-def send_notification( recipient: str, file_url: str) -> bool:
+
+def build_message(recipient: str, file_url: str) -> MIMEMultipart:
     """
-    Send the “your image is ready” email with HTML formatting.
-    Returns True on success, False on any failure.
+    The “your image is ready” email with HTML formatting.
     """
     msg = MIMEMultipart("alternative")
-    msg["From"] = "ibrahimmuhammad271@gmail.com" # "smtp@mailtrap.io"
+    msg["From"] = settings.EMAIL_FROM
     msg["To"] = recipient
     msg["Subject"] = "Your background‐removed image is ready"
 
@@ -38,15 +40,87 @@ def send_notification( recipient: str, file_url: str) -> bool:
     """
 
     msg.attach(MIMEText(html_body, "html"))
+    return msg
 
-    try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp_server:
-            smtp_server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
-            smtp_server.sendmail(msg["From"], msg["To"], msg.as_string())
 
+class SMTPConnection:
+    """
+    One long-lived SMTP session, reused across messages.
+
+    Connecting (TCP + TLS handshake + AUTH) costs far more than sending, so
+    the session is kept open and only re-established when the server drops
+    it or it has been idle longer than EMAIL_IDLE_TIMEOUT_SECONDS. Not
+    thread-safe: each sender owns one.
+    """
+
+    def __init__(self, host: Optional[str] = None, port: Optional[int] = None):
+        self.host = host or settings.SMTP_SERVER
+        self.port = port or settings.SMTP_PORT
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        timeout = settings.EMAIL_SMTP_TIMEOUT
+        if self.port == 465:
+            smtp: smtplib.SMTP = smtplib.SMTP_SSL(self.host, self.port, timeout=timeout,
+                                                 context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=timeout)
+            if settings.SMTP_USE_TLS:
+                smtp.starttls(context=ssl.create_default_context())
+        smtp.ehlo_or_helo_if_needed()
+        if settings.SMTP_USER and smtp.has_extn("auth"):
+            smtp.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        logger.info(f"SMTP session opened to {self.host}:{self.port}")
+        return smtp
+
+    def _session(self) -> smtplib.SMTP:
+        idle = time.monotonic() - self._last_used
+        if self._smtp is not None and idle > settings.EMAIL_IDLE_TIMEOUT_SECONDS:
+            self.close()
+        if self._smtp is None:
+            self._smtp = self._connect()
+        return self._smtp
+
+    def send(self, msg: MIMEMultipart) -> None:
+        """
+        Sends one message, reconnecting once if the server closed the
+        session in the meantime. SMTP errors propagate to the caller.
+        """
+        for attempt in (1, 2):
+            smtp = self._session()
+            try:
+                smtp.sendmail(msg["From"], [msg["To"]], msg.as_string())
+                self._last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def close(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+def send_notification( recipient: str, file_url: str) -> bool:
+    """
+    Sends the notification over a one-off connection (the service itself
+    goes through the pooled outbox in email_outbox.py).
+    Returns True on success, False on any failure.
+    """
+    connection = SMTPConnection()
+    try:
+        connection.send(build_message(recipient, file_url))
         logger.info(f"Notification sent to {recipient}")
         return True
 
     except Exception as e:
         logger.error(f"[EmailNotifier] failed to send to {recipient}: {e}")
         return False
+    finally:
+        connection.close()
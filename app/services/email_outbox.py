@@ -0,0 +1,184 @@
+"""
+Notification outbox: "your image is ready" emails leave the job path.
+
+process_job only LPUSHes a small JSON entry onto a Redis list; an
+EmailSender drains it in the background over one pooled SMTP session
+(email_notifier.SMTPConnection), so SMTP latency or outages never hold up
+image processing.
+
+- Batching: the sender takes up to EMAIL_BATCH_SIZE entries at a time and
+  sends them back to back over the same session.
+- Reliability: entries are LMOVEd to a "sending" list while in flight, with
+  their claim time in a ZSET; entries stuck there longer than
+  EMAIL_VISIBILITY_SECONDS (sender crashed) go back to the outbox.
+- Retries: transient SMTP failures back off exponentially through a delayed
+  ZSET, up to EMAIL_MAX_ATTEMPTS; refused recipients fail at once.
+- The outcome is recorded on the task hash as email_status
+  (queued / sent / retrying / failed).
+"""
+import asyncio
+import json
+import logging
+import random
+import smtplib
+import socket
+import time
+from typing import List, Optional
+
+from app.config import settings
+from app.redis_client import redis_client
+from app.services import metrics
+from app.services.email_notifier import SMTPConnection, build_message
+from app.services.executors import run_io
+from app.services.task_state import update_task
+
+logger = logging.getLogger("uvicorn.error")
+
+OUTBOX_KEY = "bgr:email:outbox"
+SENDING_KEY = "bgr:email:sending"
+CLAIMS_KEY = "bgr:email:claims"
+DELAYED_KEY = "bgr:email:delayed"
+
+SENT = metrics.counter("bgr_email_sent_total", "Notification emails delivered to the SMTP server.")
+FAILED = metrics.counter("bgr_email_failed_total", "Notification emails given up on.")
+RETRIED = metrics.counter("bgr_email_retried_total", "Notification send attempts scheduled for retry.")
+BATCH_SECONDS = metrics.histogram("bgr_email_batch_seconds", "Time to send one batch of notifications.")
+
+# Failures that say the message itself will never be accepted
+PERMANENT = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPNotSupportedError)
+# Failures that say the server is unreachable: no point trying the rest of the batch
+UNREACHABLE = (smtplib.SMTPConnectError, smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError, socket.gaierror)
+
+
+def enqueue(task_id: str, recipient: str, file_url: str) -> None:
+    entry = json.dumps({"task_id": task_id, "to": recipient, "url": file_url, "attempts": 0})
+    redis_client.lpush(OUTBOX_KEY, entry)
+    update_task(task_id, email_status="queued")
+
+
+def claim_batch(limit: int, block_seconds: float) -> List[str]:
+    """Moves up to `limit` entries into the sending list (blocking for the first)."""
+    first = redis_client.blmove(OUTBOX_KEY, SENDING_KEY, block_seconds, "RIGHT", "LEFT")
+    if first is None:
+        return []
+    batch = [first]
+    while len(batch) < limit:
+        entry = redis_client.lmove(OUTBOX_KEY, SENDING_KEY, "RIGHT", "LEFT")
+        if entry is None:
+            break
+        batch.append(entry)
+    now = time.time()
+    redis_client.zadd(CLAIMS_KEY, {entry: now for entry in batch})
+    return [e.decode() if isinstance(e, bytes) else e for e in batch]
+
+
+def _finish(raw: str) -> None:
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.lrem(SENDING_KEY, 1, raw)
+    pipe.zrem(CLAIMS_KEY, raw)
+    pipe.execute()
+
+
+def _retry_or_fail(raw: str, entry: dict, error: str, permanent: bool) -> None:
+    attempts = entry["attempts"] + 1
+    if permanent or attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        _finish(raw)
+        update_task(entry["task_id"], email_status="failed", email_attempts=attempts)
+        FAILED.inc()
+        logger.error(f"Notification for {entry['task_id']} failed after {attempts} attempt(s): {error}")
+        return
+    ceiling = min(settings.EMAIL_RETRY_MAX_DELAY, settings.EMAIL_RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+    due = time.time() + random.uniform(ceiling / 2, ceiling)
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.zadd(DELAYED_KEY, {json.dumps(dict(entry, attempts=attempts)): due})
+    pipe.lrem(SENDING_KEY, 1, raw)
+    pipe.zrem(CLAIMS_KEY, raw)
+    pipe.execute()
+    update_task(entry["task_id"], email_status="retrying", email_attempts=attempts)
+    RETRIED.inc()
+    logger.warning(f"Notification for {entry['task_id']} attempt {attempts} failed ({error}); will retry")
+
+
+def send_batch(connection: SMTPConnection, batch: List[str]) -> int:
+    """Sends a claimed batch over one session; returns how many were delivered."""
+    started = time.perf_counter()
+    delivered = 0
+    unreachable: Optional[str] = None
+    for raw in batch:
+        entry = json.loads(raw)
+        if unreachable is not None:
+            _retry_or_fail(raw, entry, unreachable, permanent=False)
+            continue
+        try:
+            connection.send(build_message(entry["to"], entry["url"]))
+        except PERMANENT as exc:
+            _retry_or_fail(raw, entry, str(exc), permanent=True)
+        except UNREACHABLE as exc:
+            connection.close()
+            unreachable = f"SMTP server unreachable: {exc}"
+            _retry_or_fail(raw, entry, unreachable, permanent=False)
+        except Exception as exc:
+            # Session is likely unusable; the next message reconnects
+            connection.close()
+            _retry_or_fail(raw, entry, str(exc), permanent=False)
+        else:
+            _finish(raw)
+            update_task(entry["task_id"], email_status="sent", email_attempts=entry["attempts"] + 1)
+            SENT.inc()
+            delivered += 1
+    BATCH_SECONDS.observe(time.perf_counter() - started)
+    return delivered
+
+
+def maintain() -> None:
+    """Promotes due retries and returns entries abandoned by a crashed sender."""
+    now = time.time()
+    for member in redis_client.zrangebyscore(DELAYED_KEY, "-inf", now, start=0, num=100):
+        if redis_client.zrem(DELAYED_KEY, member):
+            redis_client.lpush(OUTBOX_KEY, member)
+
+    # Claimed by a sender that died between LMOVE and recording the claim
+    for member in redis_client.lrange(SENDING_KEY, 0, 199):
+        if redis_client.zscore(CLAIMS_KEY, member) is None:
+            redis_client.zadd(CLAIMS_KEY, {member: now}, nx=True)
+
+    stale_before = now - settings.EMAIL_VISIBILITY_SECONDS
+    for member in redis_client.zrangebyscore(CLAIMS_KEY, "-inf", stale_before, start=0, num=100):
+        if redis_client.zrem(CLAIMS_KEY, member) and redis_client.lrem(SENDING_KEY, 1, member):
+            redis_client.rpush(OUTBOX_KEY, member)  # oldest end: goes out next
+            logger.warning("Re-queued a notification abandoned by a stopped sender")
+
+
+class EmailSender:
+    """Background coroutine draining the outbox through one SMTP session."""
+
+    def __init__(self, connection: Optional[SMTPConnection] = None):
+        self.connection = connection or SMTPConnection()
+        self._stopping = asyncio.Event()
+        self._runner: "asyncio.Task | None" = None
+
+    def start(self) -> None:
+        self._runner = asyncio.create_task(self.run(), name="email-sender")
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._runner is not None:
+            await self._runner
+        await run_io(self.connection.close)
+
+    async def run(self) -> None:
+        last_maintenance = 0.0
+        while not self._stopping.is_set():
+            try:
+                if time.monotonic() - last_maintenance >= settings.EMAIL_MAINTENANCE_INTERVAL_SECONDS:
+                    await run_io(maintain)
+                    last_maintenance = time.monotonic()
+                batch = await run_io(claim_batch, settings.EMAIL_BATCH_SIZE, settings.EMAIL_BLOCK_SECONDS)
+                if batch:
+                    await run_io(send_batch, self.connection, batch)
+            except Exception as e:
+                logger.error(f"Email sender loop error: {str(e)}")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=2.0)
+                except asyncio.TimeoutError:
+                    pass
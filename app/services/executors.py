@@ -0,0 +1,152 @@
+"""
+Dedicated, size-bounded executors for the processing path.
+
+Starlette runs sync endpoints (the template routes in ui.py) and sync
+background tasks on one shared anyio threadpool. Inference and encoding must
+not compete for it, so jobs use private pools instead:
+
+- CPU pool: inference. Threads or processes (CPU_EXECUTOR_KIND).
+- Codec pool: image decode / encode. Threads (Pillow releases the GIL).
+- I/O pool: blocking Redis, S3 and filesystem calls. Always threads.
+
+Each pool admits at most ``max_workers`` calls at a time; extra callers wait
+on an asyncio semaphore, which is what the queue-length gauge measures.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from app.config import settings
+from app.services import metrics
+
+logger = logging.getLogger("uvicorn.error")
+
+QUEUE_LENGTH = metrics.gauge("bgr_executor_queue_length", "Calls waiting for a free executor slot.")
+ACTIVE = metrics.gauge("bgr_executor_active", "Calls currently running in the executor.")
+UTILIZATION = metrics.gauge("bgr_executor_utilization", "Busy slots divided by max_workers (0-1).")
+MAX_WORKERS = metrics.gauge("bgr_executor_max_workers", "Configured size of the executor.")
+
+
+# Set by the process pool's initializer: True only inside its worker processes
+# (uvicorn --workers and supervisor-spawned workers are parents, not pool children)
+_IN_POOL_CHILD = False
+
+
+def _mark_pool_child() -> None:
+    global _IN_POOL_CHILD
+    _IN_POOL_CHILD = True
+
+
+def in_pool_child() -> bool:
+    return _IN_POOL_CHILD
+
+
+class BoundedExecutor:
+    """
+    Wraps a thread or process pool and bounds concurrent submissions to its size.
+    """
+
+    def __init__(self, name: str, max_workers: int, kind: str = "thread"):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind '{kind}' (expected 'thread' or 'process').")
+        self.name = name
+        self.kind = kind
+        self.max_workers = max(1, max_workers)
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._queued = 0
+        self._active = 0
+        MAX_WORKERS.set(self.max_workers, pool=name)
+        self._publish()
+
+    def _get_executor(self) -> Executor:
+        # Created on first use so importing the module never forks or spawns
+        if self._executor is None:
+            if self.kind == "process":
+                # 'spawn' avoids forking a process that holds an event loop and threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_mark_pool_child,
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix=f"bgr-{self.name}",
+                )
+            logger.info(f"Started {self.name} executor ({self.kind}, {self.max_workers} workers)")
+        return self._executor
+
+    def _publish(self) -> None:
+        QUEUE_LENGTH.set(self._queued, pool=self.name)
+        ACTIVE.set(self._active, pool=self.name)
+        UTILIZATION.set(self._active / self.max_workers, pool=self.name)
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def free(self) -> int:
+        """Slots a new submission would get without waiting."""
+        return max(0, self.max_workers - self._active - self._queued)
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Runs ``fn`` in the pool once a slot is free and returns its result."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+        self._queued += 1
+        self._publish()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._queued -= 1
+
+        self._active += 1
+        self._publish()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), partial(fn, *args, **kwargs))
+        finally:
+            self._active -= 1
+            self._semaphore.release()
+            self._publish()
+
+    def shutdown(self, wait: bool = True) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+
+cpu_executor = BoundedExecutor("cpu", settings.CPU_WORKERS, settings.CPU_EXECUTOR_KIND)
+codec_executor = BoundedExecutor("codec", settings.CODEC_WORKERS, "thread")
+io_executor = BoundedExecutor("io", settings.IO_WORKERS, "thread")
+
+
+async def run_cpu(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """CPU-bound work (inference). ``fn`` must be picklable in process mode."""
+    return await cpu_executor.run(fn, *args, **kwargs)
+
+
+async def run_codec(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Image decode / encode, kept off the inference pool so it never starves it."""
+    return await codec_executor.run(fn, *args, **kwargs)
+
+
+async def run_io(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Blocking I/O (sync Redis, boto3, filesystem)."""
+    return await io_executor.run(fn, *args, **kwargs)
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    cpu_executor.shutdown(wait=wait)
+    codec_executor.shutdown(wait=wait)
+    io_executor.shutdown(wait=wait)
@@ -0,0 +1,213 @@
+"""
+Admission scheduler in front of the processing pipeline.
+
+The queue worker pulls a window of jobs from Redis, but only SCHEDULER_SLOTS
+of them may be in the pipeline (decoding, waiting for or running inference,
+encoding) at once. Which waiting job gets the next free slot is decided here:
+
+1. Lanes: "interactive" (quick previews) and "bulk" share slots by weighted
+   round robin (LANE_WEIGHTS, e.g. 4:1), so bulk work never starves but
+   previews overtake it.
+2. Clients: inside a lane, deficit round robin across client identities
+   (the same key the rate limiter uses) with each job costing its estimated
+   inference work, so one client's scale=2.0 batch cannot crowd out others.
+3. Models: at most MODEL_CONCURRENCY[model] jobs of a model are admitted at
+   once; jobs of a capped model are skipped (not blocking the line) until
+   one of them finishes.
+
+Per-lane queue wait (enqueue -> admission) is exported as
+bgr_lane_wait_seconds.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from app.config import settings
+from app.services import metrics
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+LANE_WAIT = metrics.histogram("bgr_lane_wait_seconds", "Time from enqueue to pipeline admission, per lane.")
+LANE_WAITING = metrics.gauge("bgr_lane_waiting", "Jobs waiting for a pipeline slot, per lane.")
+MODEL_ACTIVE = metrics.gauge("bgr_model_active", "Admitted jobs per model.")
+
+
+def parse_map(value: str) -> Dict[str, float]:
+    """'u2net=4,u2netp=1' -> {'u2net': 4.0, 'u2netp': 1.0}"""
+    pairs = (item.split("=", 1) for item in value.split(",") if "=" in item)
+    return {k.strip(): float(v) for k, v in pairs}
+
+
+INTERACTIVE_MODELS = {m.strip() for m in settings.INTERACTIVE_MODELS.split(",") if m.strip()}
+MODEL_COSTS = parse_map(settings.MODEL_COSTS)
+
+
+def lane_for(priority: str, model: str, scale: float) -> str:
+    """
+    Explicit priority wins; otherwise fast models at scale <= 1 are previews.
+    """
+    if priority in LANES:
+        return priority
+    if model in INTERACTIVE_MODELS and scale <= 1.0:
+        return LANE_INTERACTIVE
+    return LANE_BULK
+
+
+def job_cost(model: str, scale: float) -> float:
+    """Relative inference work: model weight x pixel factor (scale^2)."""
+    return MODEL_COSTS.get(model, 1.0) * max(scale, 0.1) ** 2
+
+
+@dataclass
+class _Waiter:
+    lane: str
+    client: str
+    model: str
+    cost: float
+    enqueued_at: float
+    future: "asyncio.Future[None]" = field(repr=False)
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        slots: int,
+        lane_weights: Dict[str, float],
+        model_caps: Optional[Dict[str, float]] = None,
+        quantum: float = 1.0,
+    ):
+        self.slots = max(1, slots)
+        self.lane_weights = {lane: max(1, int(lane_weights.get(lane, 1))) for lane in LANES}
+        self.model_caps = {k: int(v) for k, v in (model_caps or {}).items()}
+        self.quantum = quantum
+        self._free = self.slots
+        # lane -> client -> FIFO of that client's waiting jobs (dict order is the DRR ring)
+        self._lanes: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {lane: OrderedDict() for lane in LANES}
+        self._deficit: Dict[tuple, float] = {}
+        self._credit = dict(self.lane_weights)
+        self._active: Dict[str, int] = {}
+
+    # --- public API -------------------------------------------------------
+
+    @asynccontextmanager
+    async def slot(
+        self, lane: str, client: str, model: str, cost: float, enqueued_at: Optional[float] = None
+    ) -> AsyncIterator[None]:
+        """Waits for a pipeline slot chosen fairly; released on exit."""
+        waiter = await self._acquire(lane, client, model, cost, enqueued_at)
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    def waiting(self, lane: str) -> int:
+        return sum(len(q) for q in self._lanes[lane].values())
+
+    # --- internals ----------------------------------------------------------
+
+    async def _acquire(self, lane, client, model, cost, enqueued_at) -> _Waiter:
+        lane = lane if lane in LANES else LANE_BULK
+        waiter = _Waiter(
+            lane=lane,
+            client=client or "anonymous",
+            model=model,
+            cost=cost,
+            enqueued_at=enqueued_at or time.time(),
+            future=asyncio.get_running_loop().create_future(),
+        )
+        self._lanes[lane].setdefault(waiter.client, deque()).append(waiter)
+        LANE_WAITING.set(self.waiting(lane), lane=lane)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(waiter)  # admitted right as we were cancelled
+            else:
+                self._forget(waiter)
+            raise
+        LANE_WAIT.observe(max(0.0, time.time() - waiter.enqueued_at), lane=lane)
+        return waiter
+
+    def _release(self, waiter: _Waiter) -> None:
+        self._free += 1
+        self._active[waiter.model] = self._active.get(waiter.model, 1) - 1
+        MODEL_ACTIVE.set(self._active[waiter.model], model=waiter.model)
+        self._dispatch()
+
+    def _forget(self, waiter: _Waiter) -> None:
+        clients = self._lanes[waiter.lane]
+        queue = clients.get(waiter.client)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del clients[waiter.client]
+                self._deficit.pop((waiter.lane, waiter.client), None)
+        LANE_WAITING.set(self.waiting(waiter.lane), lane=waiter.lane)
+
+    def _eligible(self, waiter: _Waiter) -> bool:
+        cap = self.model_caps.get(waiter.model)
+        return cap is None or self._active.get(waiter.model, 0) < cap
+
+    def _dispatch(self) -> None:
+        while self._free > 0:
+            waiter = self._next()
+            if waiter is None:
+                return
+            self._free -= 1
+            self._active[waiter.model] = self._active.get(waiter.model, 0) + 1
+            MODEL_ACTIVE.set(self._active[waiter.model], model=waiter.model)
+            LANE_WAITING.set(self.waiting(waiter.lane), lane=waiter.lane)
+            waiter.future.set_result(None)
+
+    def _next(self) -> Optional[_Waiter]:
+        """Weighted round robin over lanes, skipping lanes with nothing eligible."""
+        for _ in range(2):
+            for lane in LANES:
+                if self._credit[lane] > 0:
+                    waiter = self._pick(lane)
+                    if waiter is not None:
+                        self._credit[lane] -= 1
+                        return waiter
+            # Every lane with credit is idle or blocked: start a new round
+            self._credit = dict(self.lane_weights)
+        return None
+
+    def _pick(self, lane: str) -> Optional[_Waiter]:
+        """Deficit round robin across the lane's clients."""
+        clients = self._lanes[lane]
+        if not clients:
+            return None
+        max_cost = max(w.cost for q in clients.values() for w in q)
+        rounds = math.ceil(max_cost / self.quantum) + 1
+        for _ in range(len(clients) * rounds):
+            client, queue = next(iter(clients.items()))
+            key = (lane, client)
+            waiter = next((w for w in queue if self._eligible(w)), None)
+            if waiter is None:
+                clients.move_to_end(client)
+                continue
+            if self._deficit.get(key, 0.0) >= waiter.cost:
+                self._deficit[key] -= waiter.cost
+                queue.remove(waiter)
+                if not queue:
+                    del clients[client]
+                    self._deficit.pop(key, None)
+                return waiter
+            self._deficit[key] = self._deficit.get(key, 0.0) + self.quantum
+            clients.move_to_end(client)
+        return None
+
+
+SCHEDULER = FairScheduler(
+    slots=settings.SCHEDULER_SLOTS,
+    lane_weights=parse_map(settings.LANE_WEIGHTS),
+    model_caps=parse_map(settings.MODEL_CONCURRENCY),
+    quantum=settings.SCHEDULER_QUANTUM,
+)
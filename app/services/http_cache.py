@@ -0,0 +1,57 @@
+"""
+HTTP caching helpers for processed-image delivery (ETag, Cache-Control, 304s).
+"""
+from typing import Optional
+
+from fastapi.staticfiles import StaticFiles
+
+from app.config import settings
+
+
+def quote_etag(value: str) -> str:
+    """Returns a strong ETag header value for a content hash."""
+    return value if value.startswith('"') else f'"{value}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Evaluates an If-None-Match header against our ETag (weak comparison, as
+    RFC 9110 requires for If-None-Match).
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = quote_etag(etag)
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+def cache_control(max_age: int, public: bool = False) -> str:
+    """
+    Cache-Control for an immutable, task-scoped object that disappears after
+    ``max_age`` seconds (the remaining task TTL).
+    """
+    scope = "public" if public else "private"
+    if max_age <= 0:
+        return "no-store"
+    return f"{scope}, max-age={max_age}, immutable"
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles mount for processed images. Starlette already answers
+    If-None-Match / If-Modified-Since with 304 and serves Range requests;
+    this adds a Cache-Control header so browsers stop re-validating at all.
+    File names are unique task ids, so the content never changes in place.
+    """
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("cache-control", cache_control(settings.REDIS_TTL_SECONDS))
+        return response
@@ -1,12 +1,18 @@
 import os
+import json
+import time
+import hashlib
+import logging
 from io import BytesIO
-from typing import Dict
+from typing import Dict, List
 
 import numpy as np
 from PIL import Image, ImageOps
-from rembg import remove, new_session
 from app.config import settings
+from app.services import dedup
+from app.services.memory_budget import check_pixel_budget
 
+logger = logging.getLogger("uvicorn.error")
 
 # 1. Set the model path before the sessions are initialized
 os.environ["U2NET_HOME"] = getattr(settings, "U2NET_HOME", os.path.join(os.getcwd(), "models"))
@@ -17,11 +23,96 @@ SESSIONS: Dict = {}
 
 def get_session(model_name: str):
     """Retrieves or initializes a rembg session."""
-    if model_name not in SESSIONS:
-        # Fallback to u2net if the requested model isn't in your config
-        target_model = model_name if model_name in settings.MODEL_NAMES else "u2net"
+    # Fallback to u2net if the requested model isn't in your config
+    target_model = model_name if model_name in settings.MODEL_NAMES else "u2net"
+    if target_model not in SESSIONS:
+        # rembg pulls in onnxruntime, scipy and numba; import it only once a
+        # process actually runs inference so web-only workers never pay for it.
+        from rembg import new_session
+
         SESSIONS[target_model] = new_session(target_model)
-    return SESSIONS[target_model] # type: ignore
+    return SESSIONS[target_model]
+
+def decode_image(data: bytes, scale: float) -> Image.Image:
+    """
+    Decodes the upload, fixes EXIF orientation and applies the optional scale.
+    """
+    # Open lazily: only the header is read, so oversized canvases fail here
+    input_image = Image.open(BytesIO(data))
+    width, height = input_image.size
+    check_pixel_budget(width, height, scale)
+    target = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+    if scale < 1.0 and input_image.format == "JPEG":
+        # JPEG can decode straight at 1/2, 1/4 or 1/8 size: less memory and time
+        input_image.draft(None, target)
+
+    # Load image and fix orientation (EXIF data often rotates mobile photos)
+    input_image = ImageOps.exif_transpose(input_image)
+    if (input_image.width > input_image.height) != (width > height):
+        target = (target[1], target[0])
+    
+    # Convert to RGB/RGBA if not already to prevent rembg failures
+    if input_image.mode not in ("RGB", "RGBA"):
+        input_image = input_image.convert("RGB")
+
+    # Optional scaling using Resampling.LANCZOS (modern Pillow syntax)
+    if input_image.size != target:
+        input_image = input_image.resize(target, Image.Resampling.LANCZOS)
+
+    return input_image
+
+
+def predict_mask(image: Image.Image, model_name: str) -> Image.Image:
+    """
+    Runs the segmentation model and returns the 8-bit alpha mask ("L" mode).
+    """
+    from rembg import remove
+
+    # Get the specific session lazily
+    session = get_session(model_name)
+    return remove(image, session=session, only_mask=True)
+
+
+# Sessions whose predict() is U2-Net's: same input normalization and output
+BATCHABLE_SESSIONS = {"U2netSession", "U2netpSession", "U2netHumanSegSession"}
+
+
+def predict_masks(images: List[Image.Image], model_name: str) -> List[Image.Image]:
+    """
+    Masks for several same-sized images, from one session run when the model
+    accepts a batch dimension; otherwise one predict_mask call per image.
+    """
+    session = get_session(model_name)
+    inputs = session.inner_session.get_inputs()[0]
+    if (
+        len(images) < 2
+        or type(session).__name__ not in BATCHABLE_SESSIONS
+        or inputs.shape[0] == 1  # a fixed batch of one
+    ):
+        return [predict_mask(image, model_name) for image in images]
+
+    # Same pre- and post-processing as rembg's U2netSession.predict
+    feeds = [
+        session.normalize(image, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320))[inputs.name]
+        for image in images
+    ]
+    preds = session.inner_session.run(None, {inputs.name: np.concatenate(feeds)})[0][:, 0, :, :]
+    masks = []
+    for image, pred in zip(images, preds):
+        pred = (pred - pred.min()) / (pred.max() - pred.min())
+        mask = Image.fromarray((pred * 255).astype("uint8"), mode="L")
+        masks.append(mask.resize(image.size, Image.Resampling.LANCZOS))
+    return masks
+
+
+def cutout(image: Image.Image, mask: Image.Image) -> Image.Image:
+    """
+    Applies the mask as transparency, identical to rembg's default (naive) cutout.
+    """
+    empty = Image.new("RGBA", image.size, 0)
+    return Image.composite(image, empty, mask)
+
 
 def process_image_bytes(
     data: bytes,
@@ -33,32 +124,174 @@ def process_image_bytes(
     memory and orientation.
     """
     try:
-        # Load image and fix orientation (EXIF data often rotates mobile photos)
-        input_image = Image.open(BytesIO(data))
-        input_image = ImageOps.exif_transpose(input_image)
-        
-        # Convert to RGB/RGBA if not already to prevent rembg failures
-        if input_image.mode not in ("RGB", "RGBA"):
-            input_image = input_image.convert("RGB")
-
-        # Optional scaling using Resampling.LANCZOS (modern Pillow syntax)
-        if scale != 1.0:
-            new_size = (int(input_image.width * scale), int(input_image.height * scale))
-            input_image = input_image.resize(new_size, Image.Resampling.LANCZOS)
-
-        # Get the specific session lazily
-        session = get_session(model_name)
-
-        # Process: rembg can take the PIL object directly in many versions,
-        # but converting to numpy is the most stable approach.
-        result_np = remove(np.array(input_image), session=session)
-        
-        return Image.fromarray(result_np)
-        
+        input_image = decode_image(data, scale)
+        return cutout(input_image, predict_mask(input_image, model_name))
     except Exception as e:
-        # Log the error appropriately in your production logs
-        print(f"Error processing image: {e}")
-        raise e
+        logger.error(f"Error processing image: {str(e)}")
+        raise
+
+
+def pil_format_for(ext: str) -> str:
+    """Maps a file extension to the Pillow format name ('jpg' -> 'JPEG')."""
+    return "JPEG" if ext.lower() in ("jpg", "jpeg") else ext.upper()
+
+
+def encode_image(img: Image.Image, ext: str, quality: int) -> bytes:
+    """
+    Serializes the processed image for the requested output format.
+    """
+    save_kwargs = {}
+    if ext in ("jpg", "jpeg"):
+        # Ensure transparency is flattened to a solid color (white) for JPEGs
+        if img.mode in ("RGBA", "LA"):
+            img = img.convert("RGB")
+        save_kwargs["quality"] = quality
+        save_kwargs["optimize"] = True
+    elif ext == "webp":
+        save_kwargs["quality"] = quality
+        save_kwargs["lossless"] = False if quality < 100 else True
+
+    buffer = BytesIO()
+    img.save(buffer, format=pil_format_for(ext), **save_kwargs)
+    return buffer.getvalue()
+
+
+def encode_mask(mask: Image.Image) -> bytes:
+    """
+    Losslessly stores the 8-bit alpha mask; a low zlib level keeps it cheap.
+    """
+    buffer = BytesIO()
+    mask.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+# output_format=mask: encoding -> file extension of the result
+MASK_ENCODINGS = {"gray": "png", "binary": "png", "rle": "json"}
+
+
+def mask_runs(mask: Image.Image, threshold: int) -> List[int]:
+    """
+    Run lengths of the thresholded mask in row-major order, alternating
+    background / foreground and starting with background (possibly 0).
+    """
+    flat = (np.asarray(mask) >= threshold).ravel()
+    if flat.size == 0:
+        return []
+    boundaries = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1, [flat.size]))
+    counts = np.diff(boundaries).tolist()
+    return [0] + counts if flat[0] else counts
+
+
+def encode_mask_output(mask: Image.Image, encoding: str) -> bytes:
+    """
+    The alpha matte alone, for clients that composite themselves: an 8-bit
+    grayscale PNG, a 1-bit PNG or run lengths as JSON (both thresholded at
+    MASK_THRESHOLD). No color image is built or encoded.
+    """
+    threshold = settings.MASK_THRESHOLD
+    if encoding == "rle":
+        width, height = mask.size
+        payload = {"width": width, "height": height, "order": "row-major", "counts": mask_runs(mask, threshold)}
+        return json.dumps(payload, separators=(",", ":")).encode()
+
+    if encoding == "binary":
+        mask = mask.point(lambda value: 255 if value >= threshold else 0, mode="1")
+    buffer = BytesIO()
+    mask.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def render_preview(data: bytes, scale: float) -> bytes:
+    """
+    Fast stand-in for the result: the light PREVIEW_MODEL on a copy decoded
+    at most PREVIEW_MAX_SIDE wide or high, as a small WebP.
+    """
+    # Header only: picks the decode size, so JPEGs decode straight at 1/2 .. 1/8
+    width, height = Image.open(BytesIO(data)).size
+    scale = min(scale, settings.PREVIEW_MAX_SIDE / max(width, height, 1))
+    image = decode_image(data, scale)
+    mask = predict_mask(image, settings.PREVIEW_MODEL)
+    return encode_image(cutout(image, mask), "webp", settings.PREVIEW_QUALITY)
+
+
+def render_image(
+    data: bytes,
+    model_name: str,
+    scale: float,
+    ext: str,
+    quality: int,
+) -> bytes:
+    """
+    Full CPU-bound unit of work (inference + encoding) for one job.
+    Module-level so it can be shipped to a process pool.
+    """
+    return encode_image(process_image_bytes(data, model_name, scale), ext, quality)
+
+
+# --- Pipeline stage adapters (see app/services/pipeline.py) ---
+# Each stage takes the job dict, adds its output and drops inputs it no longer
+# needs so large buffers are freed as early as possible.
+
+def decode_stage(job: dict) -> dict:
+    if job.get("animated"):
+        # Frames are decoded one by one inside infer_stage
+        return job
+    data = job.pop("data")
+    job["image"] = decode_image(data, job["scale"])
+    if job.get("keep_assets"):
+        # The untouched upload is the cheapest form to keep for /render
+        job["source"] = data
+    return job
+
+
+def dedup_stage(job: dict) -> dict:
+    """
+    Near-duplicate lookup (Redis and the stored mask), on the I/O pool so it
+    never holds an inference slot. A hit leaves the decoded mask on the job.
+    """
+    if job.get("animated") or not settings.DEDUP_ENABLED:
+        return job
+    job["signature"] = dedup.signature(job["image"])
+    match = dedup.find_mask(job["image"], job["model"], job["signature"])
+    if match is not None:
+        job["mask"], job["dedup_of"] = match
+    return job
+
+
+def infer_stage(job: dict) -> dict:
+    if job.get("animated"):
+        # Decode, inference and encode interleave per frame; imported here
+        # because app.services.animation builds on this module
+        from app.services.animation import process_animation
+
+        job["encoded"], stats = process_animation(job.pop("data"), job["model"], job["scale"], job["quality"])
+        job.update(stats.fields())
+        return job
+    if "mask" in job:
+        # Near-duplicate of a recent upload (dedup_stage): skip the model
+        return job
+    started = time.perf_counter()
+    job["mask"] = predict_mask(job["image"], job["model"])
+    # Feeds the model=auto latency estimates (app/services/model_policy.py)
+    job["inference_seconds"] = time.perf_counter() - started
+    return job
+
+
+def encode_stage(job: dict) -> dict:
+    if not job.get("animated"):
+        mask = job.pop("mask")
+        if job.get("keep_assets"):
+            job["mask_png"] = encode_mask(mask)
+        image = job.pop("image")
+        if job.get("mask_encoding"):
+            # Mask-only output: no compositing, no color encode
+            job["encoded"] = encode_mask_output(mask, job["mask_encoding"])
+        else:
+            job["encoded"] = encode_image(cutout(image, mask), job["ext"], job["quality"])
+    # Content hash doubles as the strong ETag for downloads
+    job["etag"] = hashlib.sha256(job["encoded"]).hexdigest()
+    job["size"] = len(job["encoded"])
+    return job
 
 
 
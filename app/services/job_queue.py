@@ -0,0 +1,342 @@
+"""
+Durable job queue on Redis Streams.
+
+Jobs are entries of one stream read through a consumer group, so a job
+stays in the group's pending list until a worker acknowledges it. The
+upload bytes live in a separate key with a TTL (stream entries stay small),
+or, for direct uploads, in storage under the job's `object_key`.
+
+- Visibility timeout: a pending entry idle for longer than
+  QUEUE_VISIBILITY_TIMEOUT_MS belonged to a worker that died; the reaper
+  (XAUTOCLAIM) takes it back and re-queues it as a new attempt. Live workers
+  heartbeat their entries (XCLAIM to themselves) so long jobs are not reaped.
+- Retries: TransientError (and connection/OS errors) re-queue the job after
+  an exponential backoff through a delayed ZSET, up to QUEUE_MAX_ATTEMPTS.
+- Dead letters: jobs out of attempts, or failing permanently, are pushed to
+  a capped list with their last error.
+- Model streams: jobs of the models in QUEUE_MODEL_STREAMS go to their own
+  stream (bgr:jobs:<model>, named by the job's `queue` field), so dedicated
+  workers (WORKER_MODELS, app/supervisor.py) consume only their model.
+  Everything else, model=auto included, shares bgr:jobs. Retries and
+  re-queues go back to the stream the job came from.
+
+All calls are sync (shared redis client) and meant to run on the I/O pool.
+"""
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import ResponseError, TimeoutError as RedisTimeoutError
+
+from app.config import settings
+from app.redis_client import redis_client
+from app.services import metrics
+from app.services.storage import get_storage
+
+logger = logging.getLogger("uvicorn.error")
+
+STREAM_KEY = "bgr:jobs"
+GROUP = "bgr-workers"
+DELAYED_KEY = "bgr:jobs:delayed"
+DEAD_KEY = "bgr:jobs:dead"
+PAYLOAD_KEY = "bgr:job:{}:data"
+SHARED_QUEUE = "*"
+
+MODEL_STREAMS = {m.strip() for m in settings.QUEUE_MODEL_STREAMS.split(",") if m.strip()}
+
+ENQUEUED = metrics.counter("bgr_queue_enqueued_total", "Jobs added to the durable queue.")
+RETRIED = metrics.counter("bgr_queue_retried_total", "Job attempts re-queued after a transient failure.")
+REAPED = metrics.counter("bgr_queue_reaped_total", "Jobs reclaimed from crashed or stalled workers.")
+DEAD = metrics.counter("bgr_queue_dead_lettered_total", "Jobs moved to the dead-letter list.")
+DELAYED = metrics.gauge("bgr_queue_delayed", "Jobs waiting for their retry backoff.")
+PENDING = metrics.gauge("bgr_queue_pending", "Jobs delivered to a worker but not yet acknowledged.")
+BACKLOG = metrics.gauge("bgr_queue_backlog", "Jobs in the stream not yet delivered to any worker.")
+
+
+class TransientError(Exception):
+    """A failure worth retrying (storage or network hiccup)."""
+
+
+# Errors that say nothing about the job itself
+RETRYABLE = (TransientError, RedisConnectionError, RedisTimeoutError, ConnectionError, TimeoutError)
+
+
+def queue_for(model: str) -> str:
+    """The job's `queue` field: its model when that has a stream, else the shared one."""
+    return model if model in MODEL_STREAMS else SHARED_QUEUE
+
+
+def stream_for(queue: Optional[str]) -> str:
+    return STREAM_KEY if not queue or queue == SHARED_QUEUE else f"{STREAM_KEY}:{queue}"
+
+
+def worker_streams(models: str) -> List[str]:
+    """
+    Streams for a WORKER_MODELS value: model names and "*" (shared stream).
+    Empty means every stream.
+    """
+    queues = [m.strip() for m in models.split(",") if m.strip()]
+    if not queues:
+        queues = [SHARED_QUEUE, *sorted(MODEL_STREAMS)]
+    for queue in queues:
+        if queue != SHARED_QUEUE and queue not in MODEL_STREAMS:
+            logger.warning(f"WORKER_MODELS names {queue}, but it is not in QUEUE_MODEL_STREAMS: its jobs use the shared stream")
+    return list(dict.fromkeys(stream_for(queue_for(q) if q != SHARED_QUEUE else q) for q in queues))
+
+
+@dataclass
+class Job:
+    message_id: str
+    task_id: str
+    attempts: int
+    fields: Dict[str, str] = field(default_factory=dict)
+    stream: str = STREAM_KEY
+
+    def payload(self) -> Optional[bytes]:
+        object_key = self.fields.get("object_key")
+        if object_key:
+            # Direct upload: the bytes never went through Redis
+            try:
+                return get_storage(self.fields.get("storage")).get_sync(object_key)
+            except FileNotFoundError:
+                return None
+        return redis_client.get(PAYLOAD_KEY.format(self.task_id))  # type: ignore[return-value]
+
+
+def _decode(mapping) -> Dict[str, str]:
+    return {
+        (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+        for k, v in mapping.items()
+    }
+
+
+def ensure_group(streams: Iterable[str] = (STREAM_KEY,)) -> None:
+    for stream in streams:
+        try:
+            redis_client.xgroup_create(stream, GROUP, id="0", mkstream=True)
+        except ResponseError as exc:
+            if "BUSYGROUP" not in str(exc):
+                raise
+
+
+def enqueue(task_id: str, payload: Optional[bytes], **fields) -> str:
+    """
+    Stores the payload and appends the job; returns the stream entry id.
+    The payload TTL outlives the whole retry schedule. Without a payload the
+    fields must carry the `object_key` (and `storage`) holding the upload.
+    The `queue` field (see queue_for) picks the stream.
+    """
+    fields = {k: str(v) for k, v in fields.items() if v is not None}
+    pipe = redis_client.pipeline(transaction=True)
+    if payload is not None:
+        pipe.set(PAYLOAD_KEY.format(task_id), payload, ex=settings.QUEUE_PAYLOAD_TTL_SECONDS)
+    pipe.xadd(stream_for(fields.get("queue")), {"task_id": task_id, "attempts": "0", **fields},
+              maxlen=settings.QUEUE_MAX_LENGTH, approximate=True)
+    message_id = pipe.execute()[-1]
+    ENQUEUED.inc()
+    return message_id.decode() if isinstance(message_id, bytes) else message_id
+
+
+def consume(consumer: str, count: int, block_ms: int, streams: Iterable[str] = (STREAM_KEY,)) -> List[Job]:
+    """
+    Reads up to `count` new jobs for this consumer (blocking up to block_ms)
+    from one or more streams, in one XREADGROUP.
+    """
+    streams = list(streams)
+    try:
+        reply = redis_client.xreadgroup(GROUP, consumer, {s: ">" for s in streams}, count=count, block=block_ms)
+    except ResponseError as exc:
+        if "NOGROUP" not in str(exc):
+            raise
+        ensure_group(streams)
+        return []
+    jobs = []
+    for stream, entries in reply or []:
+        for message_id, raw in entries:
+            data = _decode(raw)
+            jobs.append(Job(
+                message_id=message_id.decode() if isinstance(message_id, bytes) else message_id,
+                task_id=data.pop("task_id"),
+                attempts=int(data.pop("attempts", "0")),
+                fields=data,
+                stream=stream.decode() if isinstance(stream, bytes) else stream,
+            ))
+    return jobs
+
+
+def heartbeat(consumer: str, jobs: List[Job]) -> None:
+    """Resets the idle time of in-flight entries so the reaper leaves them alone."""
+    by_stream: Dict[str, List[str]] = {}
+    for job in jobs:
+        by_stream.setdefault(job.stream, []).append(job.message_id)
+    for stream, message_ids in by_stream.items():
+        redis_client.xclaim(stream, GROUP, consumer, min_idle_time=0, message_ids=message_ids, justid=True)
+
+
+def ack(job: Job) -> None:
+    """Job finished (successfully or for good): drop the entry and its payload."""
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.xack(job.stream, GROUP, job.message_id)
+    pipe.xdel(job.stream, job.message_id)
+    pipe.delete(PAYLOAD_KEY.format(job.task_id))
+    pipe.execute()
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Exponential backoff with full jitter, capped at QUEUE_RETRY_MAX_DELAY."""
+    ceiling = min(settings.QUEUE_RETRY_MAX_DELAY, settings.QUEUE_RETRY_BASE_DELAY * (2 ** attempt))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def dead_letter(job: Job, error: str) -> None:
+    entry = json.dumps({
+        "task_id": job.task_id,
+        "attempts": job.attempts + 1,
+        "error": error,
+        "failed_at": time.time(),
+        **job.fields,
+    })
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.lpush(DEAD_KEY, entry)
+    pipe.ltrim(DEAD_KEY, 0, settings.QUEUE_DEAD_LETTER_MAX - 1)
+    pipe.xack(job.stream, GROUP, job.message_id)
+    pipe.xdel(job.stream, job.message_id)
+    pipe.delete(PAYLOAD_KEY.format(job.task_id))
+    pipe.execute()
+    DEAD.inc()
+    logger.error(f"Job {job.task_id} dead-lettered after {job.attempts + 1} attempt(s): {error}")
+
+
+def retry(job: Job, error: str) -> bool:
+    """
+    Schedules another attempt after a backoff, or dead-letters the job when
+    it is out of attempts. Returns True when the job will run again.
+    """
+    attempts = job.attempts + 1
+    if attempts >= settings.QUEUE_MAX_ATTEMPTS:
+        dead_letter(job, error)
+        return False
+
+    due = time.time() + backoff_seconds(attempts - 1)
+    member = json.dumps({"task_id": job.task_id, "attempts": str(attempts), **job.fields})
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.zadd(DELAYED_KEY, {member: due})
+    pipe.xack(job.stream, GROUP, job.message_id)
+    pipe.xdel(job.stream, job.message_id)
+    pipe.expire(PAYLOAD_KEY.format(job.task_id), settings.QUEUE_PAYLOAD_TTL_SECONDS)
+    pipe.execute()
+    RETRIED.inc()
+    logger.warning(f"Job {job.task_id} attempt {attempts} failed ({error}); retrying in {due - time.time():.1f}s")
+    return True
+
+
+def requeue(job: Job) -> None:
+    """
+    Puts an interrupted job straight back (graceful shutdown), without
+    counting it as an attempt or waiting for the visibility timeout.
+    """
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.xadd(job.stream, {"task_id": job.task_id, "attempts": str(job.attempts), **job.fields},
+              maxlen=settings.QUEUE_MAX_LENGTH, approximate=True)
+    pipe.xack(job.stream, GROUP, job.message_id)
+    pipe.xdel(job.stream, job.message_id)
+    pipe.execute()
+
+
+# KEYS: delayed set, target stream; ARGV: member, max stream length, field/value pairs.
+# Removes and re-adds in one step, so a crash never loses the job in between;
+# ZREM succeeds for exactly one worker, which then owns the re-queue.
+PROMOTE_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then return 0 end
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[2], '*', unpack(ARGV, 3))
+return 1
+"""
+_promote_script = redis_client.register_script(PROMOTE_SCRIPT)
+
+
+def promote_delayed(limit: int = 100) -> int:
+    """Moves retries whose backoff has elapsed back onto the stream."""
+    now = time.time()
+    moved = 0
+    for member in redis_client.zrangebyscore(DELAYED_KEY, "-inf", now, start=0, num=limit):
+        fields = json.loads(member)
+        pairs = [str(value) for item in fields.items() for value in item]
+        moved += int(_promote_script(
+            keys=[DELAYED_KEY, stream_for(fields.get("queue"))],
+            args=[member, settings.QUEUE_MAX_LENGTH, *pairs],
+        ))
+    DELAYED.set(redis_client.zcard(DELAYED_KEY))
+    return moved
+
+
+def backlog(streams: Iterable[str] = (STREAM_KEY,)) -> Dict[str, int]:
+    """
+    Entries of each stream not yet delivered to the consumer group: the
+    group's `lag` from XINFO GROUPS, or, when Redis cannot tell (lag is
+    nil after some deletions), a count of the entries past the group's
+    last delivered id.
+    """
+    depths = {}
+    for stream in streams:
+        depth = 0
+        try:
+            groups = redis_client.xinfo_groups(stream)
+        except ResponseError:
+            groups = []  # stream not created yet
+        for info in groups:
+            name = info["name"].decode() if isinstance(info["name"], bytes) else info["name"]
+            if name != GROUP:
+                continue
+            if info.get("lag") is not None:
+                depth = int(info["lag"])
+            else:
+                last = info["last-delivered-id"]
+                last = last.decode() if isinstance(last, bytes) else last
+                depth = len(redis_client.xrange(stream, f"({last}", "+", count=settings.QUEUE_MAX_LENGTH))
+        depths[stream] = depth
+        BACKLOG.set(depth, stream=stream)
+    return depths
+
+
+def reap(consumer: str, limit: int = 100, streams: Iterable[str] = (STREAM_KEY,)) -> int:
+    """
+    Takes over entries whose worker stopped heartbeating (crash, kill -9,
+    reload) and re-queues each as a new attempt. Returns how many were reaped.
+    """
+    reaped = pending = 0
+    for stream in streams:
+        reply = redis_client.xautoclaim(
+            stream, GROUP, consumer,
+            min_idle_time=settings.QUEUE_VISIBILITY_TIMEOUT_MS, start_id="0-0", count=limit,
+        )
+        claimed = reply[1] if reply else []
+        for message_id, raw in claimed:
+            if raw is None:  # trimmed/deleted entry still listed as pending
+                redis_client.xack(stream, GROUP, message_id)
+                continue
+            data = _decode(raw)
+            job = Job(
+                message_id=message_id.decode() if isinstance(message_id, bytes) else message_id,
+                task_id=data.pop("task_id"),
+                attempts=int(data.pop("attempts", "0")),
+                fields=data,
+                stream=stream,
+            )
+            REAPED.inc()
+            reaped += 1
+            retry(job, "worker stopped responding (visibility timeout)")
+
+        try:
+            pending += redis_client.xpending(stream, GROUP)["pending"]
+        except ResponseError:
+            pass
+    PENDING.set(pending)
+    return reaped
+
+
+def dead_letters(limit: int = 50) -> List[dict]:
+    return [json.loads(item) for item in redis_client.lrange(DEAD_KEY, 0, limit - 1)]
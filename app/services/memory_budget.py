@@ -0,0 +1,256 @@
+"""
+Memory bounds for image jobs.
+
+A 5 MiB upload limit says little about memory: a flat, highly compressed
+PNG can decode to hundreds of megapixels, and scale=2.0 quadruples the
+canvas again before the cutout makes several more copies. Three guards:
+
+1. Pixel budget: the router reads the dimensions from the image header (no
+   decode) and rejects uploads whose source or scaled canvas exceeds
+   MAX_IMAGE_PIXELS. decode_image applies the same check before loading
+   pixels, and the limit is also Pillow's decompression-bomb threshold.
+2. Admission budget: each job carries an estimate of its peak working set
+   (estimate_job_bytes); the worker admits jobs only while the estimates of
+   the jobs in flight fit in MEMORY_BUDGET_MB.
+3. RSS guard: while the process RSS is above MEMORY_RSS_LIMIT_MB the worker
+   stops pulling new jobs from the queue (other workers take them) and
+   holds admitted ones until memory comes back down.
+
+Estimated and observed memory are stored on every task (mem_estimate,
+mem_peak_rss, mem_rss_delta, mem_overlap) so the estimate can be tuned
+against real traffic. RSS is read from /proc and covers this process only:
+with CPU_EXECUTOR_KIND=process the inference children are not included.
+"""
+import asyncio
+import logging
+import os
+import warnings
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from io import BytesIO
+from typing import AsyncIterator, Dict, Optional, Set, Tuple
+
+from PIL import Image
+
+from app.config import settings
+from app.services import metrics
+
+logger = logging.getLogger("uvicorn.error")
+
+# Pillow refuses to even open canvases over twice this (DecompressionBombError);
+# decode_image enforces the budget itself from the header before loading.
+Image.MAX_IMAGE_PIXELS = settings.MAX_IMAGE_PIXELS
+
+# Bytes per pixel of the peak working set (Pillow keeps RGB as 4 bytes/px):
+# decoded source + EXIF-transposed copy, then at the scaled size the resized
+# image, the mask, the transparent canvas, the cutout and the encoded output.
+SOURCE_BYTES_PER_PIXEL = 8
+SCALED_BYTES_PER_PIXEL = 15
+# A decoded RGBA animation frame waiting for its mask
+FRAME_BYTES_PER_PIXEL = 4
+
+RESERVED = metrics.gauge("bgr_memory_reserved_bytes", "Estimated working set of the jobs in flight.")
+RSS = metrics.gauge("bgr_process_rss_bytes", "Resident set size of this process.")
+DEFERRED = metrics.counter("bgr_memory_deferrals_total", "Times a job waited on the memory budget or RSS limit.")
+ESTIMATE_RATIO = metrics.histogram(
+    "bgr_job_memory_ratio",
+    "Observed RSS growth during a job divided by its estimate.",
+    buckets=(0.1, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 2.0, 4.0),
+)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class ImageTooLarge(ValueError):
+    """The image's canvas is over the pixel budget."""
+
+
+def probe_dimensions(data: bytes) -> Tuple[int, int]:
+    """
+    Width and height from the image header; the pixel data is not decoded.
+    Raises ImageTooLarge for canvases Pillow already refuses to open.
+    """
+    try:
+        with warnings.catch_warnings():
+            # Between 1x and 2x the limit Pillow only warns; check_pixel_budget decides
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(BytesIO(data)) as image:
+                return image.size
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e)) from e
+
+
+def check_pixel_budget(width: int, height: int, scale: float) -> None:
+    source = width * height
+    scaled = int(width * scale) * int(height * scale)
+    if max(source, scaled) > settings.MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(
+            f"Image of {width}x{height} at scale {scale} needs {max(source, scaled):,} pixels; "
+            f"the limit is {settings.MAX_IMAGE_PIXELS:,}."
+        )
+
+
+def estimate_job_bytes(width: int, height: int, scale: float, upload_bytes: int = 0) -> int:
+    """Rough peak working set of one job, excluding the model session."""
+    scaled = int(width * scale) * int(height * scale)
+    return upload_bytes + width * height * SOURCE_BYTES_PER_PIXEL + scaled * SCALED_BYTES_PER_PIXEL
+
+
+def estimate_preview_bytes(width: int, height: int, scale: float) -> int:
+    """
+    Extra working set of the progressive preview: the source decoded once
+    more (JPEGs decode smaller, so this is an upper bound) and the
+    PREVIEW_MAX_SIDE copy it is cut out at.
+    """
+    scale = min(scale, settings.PREVIEW_MAX_SIDE / max(width, height, 1))
+    scaled = int(width * scale) * int(height * scale)
+    return width * height * SOURCE_BYTES_PER_PIXEL + scaled * SCALED_BYTES_PER_PIXEL
+
+
+def estimate_animation_bytes(width: int, height: int, scale: float, upload_bytes: int = 0) -> int:
+    """
+    Peak working set of a streamed animation: the upload (and its spooled
+    copy for video), the decoded frames waiting on a keyframe batch and one
+    frame being cut out.
+    """
+    scaled = int(width * scale) * int(height * scale)
+    waiting = settings.ANIMATION_BATCH_SIZE * (settings.ANIMATION_KEYFRAME_INTERVAL + 1)
+    return 2 * upload_bytes + waiting * scaled * FRAME_BYTES_PER_PIXEL + estimate_job_bytes(width, height, scale)
+
+
+def current_rss() -> Optional[int]:
+    """Resident set size in bytes (Linux); None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _cgroup_limit() -> Optional[int]:
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as fh:
+                value = fh.read().strip()
+        except OSError:
+            continue
+        # "max" or a huge sentinel when the container is unlimited
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return None
+
+
+def rss_limit() -> Optional[int]:
+    """MEMORY_RSS_LIMIT_MB, or 85% of the container's memory limit when unset."""
+    if settings.MEMORY_RSS_LIMIT_MB > 0:
+        return settings.MEMORY_RSS_LIMIT_MB * 1024 * 1024
+    limit = _cgroup_limit()
+    return int(limit * 0.85) if limit else None
+
+
+@dataclass(eq=False)  # identity semantics: kept in a set while active
+class Reservation:
+    estimate: int
+    start_rss: Optional[int]
+    peak_rss: Optional[int]
+    overlap: int = 1
+
+    def fields(self) -> Dict[str, int]:
+        """Task hash fields comparing the estimate with what was observed."""
+        fields = {"mem_estimate": self.estimate, "mem_overlap": self.overlap}
+        if self.peak_rss is not None and self.start_rss is not None:
+            fields["mem_peak_rss"] = self.peak_rss
+            fields["mem_rss_delta"] = max(0, self.peak_rss - self.start_rss)
+        return fields
+
+
+class MemoryBudget:
+    """
+    Admission by estimated bytes plus an RSS ceiling. A job is always
+    admitted when nothing else is in flight, so an estimate above the whole
+    budget runs alone instead of waiting forever.
+    """
+
+    def __init__(self, budget_bytes: int, limit_bytes: Optional[int], sample_interval: float = 0.05):
+        self.budget = max(1, budget_bytes)
+        self.limit = limit_bytes
+        self.sample_interval = sample_interval
+        self._reserved = 0
+        self._active: Set[Reservation] = set()
+        self._changed: Optional[asyncio.Condition] = None
+        self._sampler: Optional[asyncio.Task] = None
+
+    @property
+    def reserved(self) -> int:
+        return self._reserved
+
+    def under_pressure(self) -> bool:
+        """True while the process is above the RSS limit."""
+        if self.limit is None:
+            return False
+        rss = current_rss()
+        if rss is not None:
+            RSS.set(rss)
+        return rss is not None and rss > self.limit
+
+    @asynccontextmanager
+    async def reserve(self, estimate: int) -> AsyncIterator[Reservation]:
+        """Waits until `estimate` bytes fit (and RSS is below the limit), then holds them."""
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        async with self._changed:
+            if not self._fits(estimate):
+                DEFERRED.inc()
+                while not self._fits(estimate):
+                    try:
+                        # Woken by releases; the timeout re-checks RSS meanwhile
+                        await asyncio.wait_for(self._changed.wait(), timeout=0.5)
+                    except asyncio.TimeoutError:
+                        pass
+            rss = current_rss()
+            reservation = Reservation(estimate=estimate, start_rss=rss, peak_rss=rss, overlap=len(self._active) + 1)
+            self._reserved += estimate
+            self._active.add(reservation)
+            for other in self._active:
+                other.overlap = max(other.overlap, len(self._active))
+            RESERVED.set(self._reserved)
+        self._ensure_sampler()
+        try:
+            yield reservation
+        finally:
+            self._sample()
+            async with self._changed:
+                self._reserved -= estimate
+                self._active.discard(reservation)
+                RESERVED.set(self._reserved)
+                self._changed.notify_all()
+            if reservation.estimate and reservation.start_rss is not None and reservation.peak_rss is not None:
+                ESTIMATE_RATIO.observe((reservation.peak_rss - reservation.start_rss) / reservation.estimate)
+
+    # --- internals ----------------------------------------------------------
+
+    def _fits(self, estimate: int) -> bool:
+        if not self._active:
+            return True
+        return self._reserved + estimate <= self.budget and not self.under_pressure()
+
+    def _sample(self) -> None:
+        rss = current_rss()
+        if rss is None:
+            return
+        RSS.set(rss)
+        for reservation in self._active:
+            reservation.peak_rss = max(reservation.peak_rss or 0, rss)
+
+    def _ensure_sampler(self) -> None:
+        if self._sampler is None or self._sampler.done():
+            self._sampler = asyncio.create_task(self._run_sampler(), name="memory-sampler")
+
+    async def _run_sampler(self) -> None:
+        """Tracks the peak RSS of running jobs; exits once none are left."""
+        while self._active:
+            self._sample()
+            await asyncio.sleep(self.sample_interval)
+
+
+MEMORY = MemoryBudget(settings.MEMORY_BUDGET_MB * 1024 * 1024, rss_limit())
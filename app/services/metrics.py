@@ -0,0 +1,146 @@
+"""
+Minimal in-process metrics registry with Prometheus text exposition.
+
+Kept dependency-free on purpose: each uvicorn worker exposes its own values
+on GET /metrics and the scraper aggregates across workers.
+"""
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_REGISTRY: Dict[str, "_Metric"] = {}
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Iterable[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{v}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Gauge(_Metric):
+    """A value that can go up and down (queue length, utilization...)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: Dict[LabelKey, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        with _lock:
+            self._values[_label_key(labels)] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels: str) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with _lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(k)} {v}" for k, v in items]
+
+
+class Counter(Gauge):
+    """A monotonically increasing count."""
+    kind = "counter"
+
+    def set(self, value: float, **labels: str) -> None:
+        raise TypeError("Counters can only be incremented.")
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        raise TypeError("Counters can only be incremented.")
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram(_Metric):
+    """Cumulative bucketed observations (latencies, wait times...)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        with _lock:
+            # Layout: one slot per bucket, then +Inf, then sum
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        with _lock:
+            items = [(k, list(v)) for k, v in self._series.items()]
+        for key, series in items:
+            for i, bound in enumerate(self.buckets):
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', str(bound))])} {series[i]}")
+            count = series[len(self.buckets)]
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+def _register(metric: _Metric) -> _Metric:
+    with _lock:
+        existing = _REGISTRY.get(metric.name)
+        if existing is not None:
+            return existing
+        _REGISTRY[metric.name] = metric
+        return metric
+
+
+def gauge(name: str, description: str) -> Gauge:
+    return _register(Gauge(name, description))  # type: ignore[return-value]
+
+
+def counter(name: str, description: str) -> Counter:
+    return _register(Counter(name, description))  # type: ignore[return-value]
+
+
+def histogram(name: str, description: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, description, buckets))  # type: ignore[return-value]
+
+
+def render_prometheus() -> str:
+    """Serializes every registered metric in the Prometheus text format."""
+    with _lock:
+        metrics = list(_REGISTRY.values())
+    return "\n".join(m.render() for m in metrics) + "\n"
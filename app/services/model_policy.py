@@ -0,0 +1,115 @@
+"""
+model=auto: the best model that still meets the latency SLO.
+
+AUTO_MODELS lists the candidates, best (heaviest) first. When a worker picks
+up an auto job, before it waits for a pipeline slot, each candidate's
+end-to-end latency is predicted as
+
+    waited so far + (queued jobs / INFERENCE_CONCURRENCY + 1) x inference time
+
+where "queued jobs" are the jobs this worker already holds (waiting for a
+slot or in the pipeline) plus the backlog of the job's stream (entries not
+yet delivered to any worker, refreshed every QUEUE_REAP_INTERVAL_SECONDS).
+The worker's own share is capped by QUEUE_WORKER_CONCURRENCY; the backlog is
+what shows a congested queue. The inference time is the model's observed average (EWMA of the inference stage
+in this process). Models not observed yet are estimated from an observed one
+through MODEL_COSTS, or as cost x AUTO_SECONDS_PER_COST.
+
+The first candidate predicted within AUTO_LATENCY_SLO_SECONDS wins; when none
+fits, the lightest one. Stepping back up to a heavier model than the last
+choice needs the prediction to clear AUTO_LATENCY_SLO_SECONDS x
+AUTO_RECOVER_RATIO, so the choice does not flap around the threshold.
+
+The chosen model and the reason are written to the task hash ("model",
+"model_reason").
+"""
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from app.config import settings
+from app.services import metrics
+from app.services.fair_queue import MODEL_COSTS
+
+logger = logging.getLogger("uvicorn.error")
+
+AUTO_MODEL = "auto"
+
+CHOSEN = metrics.counter("bgr_auto_model_total", "model=auto jobs, by chosen model.")
+INFERENCE_ESTIMATE = metrics.gauge("bgr_model_inference_seconds", "Average inference time per model (EWMA).")
+
+# Weight of the newest observation in the moving average
+EWMA_ALPHA = 0.2
+
+
+def auto_candidates() -> List[str]:
+    configured = [m.strip() for m in settings.AUTO_MODELS.split(",") if m.strip()]
+    return [m for m in configured if m in settings.MODEL_NAMES] or list(settings.MODEL_NAMES[:1])
+
+
+@dataclass
+class Choice:
+    model: str
+    reason: str
+
+
+class ModelPolicy:
+    def __init__(self, candidates: List[str]):
+        self.candidates = candidates
+        self._seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._last: Optional[str] = None
+
+    def observe(self, model: str, seconds: float) -> None:
+        """Feeds one measured inference time (model runs only, no dedup hits)."""
+        with self._lock:
+            previous = self._seconds.get(model)
+            value = seconds if previous is None else previous + EWMA_ALPHA * (seconds - previous)
+            self._seconds[model] = value
+        INFERENCE_ESTIMATE.set(value, model=model)
+
+    def inference_seconds(self, model: str) -> float:
+        """Observed average, else scaled from an observed model by MODEL_COSTS."""
+        with self._lock:
+            seconds = dict(self._seconds)
+        if model in seconds:
+            return seconds[model]
+        cost = MODEL_COSTS.get(model, 1.0)
+        for other, value in seconds.items():
+            return value * cost / MODEL_COSTS.get(other, 1.0)
+        return cost * settings.AUTO_SECONDS_PER_COST
+
+    def choose(self, queued: int, waited: float) -> Choice:
+        """
+        Picks the model for one job. `queued`: jobs competing with it (held by
+        this worker plus the stream backlog), `waited`: seconds since it was
+        enqueued.
+        """
+        slo = settings.AUTO_LATENCY_SLO_SECONDS
+        rounds = queued / max(1, settings.INFERENCE_CONCURRENCY) + 1
+        last = self._last
+        last_index = self.candidates.index(last) if last in self.candidates else 0
+
+        choice = None
+        for index, model in enumerate(self.candidates):
+            predicted = waited + rounds * self.inference_seconds(model)
+            # 1. Stepping up from the last choice must clear a lower bar
+            limit = slo * settings.AUTO_RECOVER_RATIO if index < last_index else slo
+            if predicted <= limit:
+                choice = Choice(model, f"predicted {predicted:.1f}s <= {limit:.1f}s with {queued} queued")
+                break
+        if choice is None:
+            # 2. Nothing fits: the cheapest model loses the least
+            model = self.candidates[-1]
+            predicted = waited + rounds * self.inference_seconds(model)
+            choice = Choice(model, f"over SLO: predicted {predicted:.1f}s > {slo:.1f}s with {queued} queued")
+
+        if choice.model != last:
+            logger.info(f"model=auto now picks {choice.model} ({choice.reason})")
+        self._last = choice.model
+        CHOSEN.inc(model=choice.model)
+        return choice
+
+
+POLICY = ModelPolicy(auto_candidates())
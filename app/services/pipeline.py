@@ -0,0 +1,145 @@
+"""
+Staged processing pipeline: decode -> inference -> post-process/encode -> store.
+
+Each stage has its own worker coroutines and the stages are connected by
+bounded asyncio queues. While one job is being PNG-encoded or uploaded the
+inference workers already pick up the next decoded image, so the ONNX session
+is kept busy instead of idling on codec and network work. The bounded queues
+give backpressure: when storage is slow, submitters wait instead of piling
+decoded images up in memory.
+
+A job submitted with a Trace (app/services/profiling.py) gets one span per
+stage, with the time it waited in front of the stage as `wait_ms`.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, List, Optional
+
+from app.services import metrics
+
+logger = logging.getLogger("uvicorn.error")
+
+QUEUE_DEPTH = metrics.gauge("bgr_pipeline_queue_depth", "Jobs waiting in front of a pipeline stage.")
+STAGE_SECONDS = metrics.histogram("bgr_pipeline_stage_seconds", "Time spent inside each pipeline stage.")
+
+Runner = Callable[..., Awaitable[Any]]
+
+
+async def run_inline(fn: Callable[[dict], Awaitable[dict]], job: dict) -> dict:
+    """Runner for stages that are coroutines themselves (async storage I/O)."""
+    return await fn(job)
+
+
+@dataclass
+class Stage:
+    """
+    One pipeline step. ``fn`` receives the job dict and returns it (possibly a
+    copy, when ``runner`` ships it to a process pool).
+    """
+    name: str
+    fn: Callable[[dict], dict]
+    runner: Runner
+    concurrency: int = 1
+
+
+@dataclass
+class _Item:
+    job: dict
+    future: "asyncio.Future[dict]"
+    trace: Optional[Any] = None  # profiling.Trace
+    queued: float = 0.0
+
+
+class Pipeline:
+    def __init__(self, stages: List[Stage], queue_size: int = 4):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self) -> None:
+        """Spawns the stage workers on the running event loop."""
+        if self.running:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        for index, stage in enumerate(self.stages):
+            for n in range(max(1, stage.concurrency)):
+                self._workers.append(
+                    asyncio.create_task(self._worker(index), name=f"pipeline-{stage.name}-{n}")
+                )
+        logger.info(
+            "Pipeline started: "
+            + " -> ".join(f"{s.name}x{max(1, s.concurrency)}" for s in self.stages)
+        )
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queues = []
+
+    async def submit(self, job: dict, trace=None) -> dict:
+        """
+        Feeds a job into the first stage and waits for it to leave the last one.
+        Raises whatever exception the failing stage raised.
+        """
+        if not self.running:
+            self.start()
+        future: "asyncio.Future[dict]" = asyncio.get_running_loop().create_future()
+        await self._put(0, _Item(job, future, trace))
+        return await future
+
+    async def _put(self, index: int, item: _Item) -> None:
+        item.queued = time.perf_counter()
+        queue = self._queues[index]
+        await queue.put(item)
+        QUEUE_DEPTH.set(queue.qsize(), stage=self.stages[index].name)
+
+    async def _worker(self, index: int) -> None:
+        stage = self.stages[index]
+        queue = self._queues[index]
+        is_last = index == len(self.stages) - 1
+        while True:
+            item: _Item = await queue.get()
+            QUEUE_DEPTH.set(queue.qsize(), stage=stage.name)
+            if item.future.done():
+                # Submitter went away (cancelled); drop the job
+                continue
+            started = time.perf_counter()
+            fn = stage.fn
+            if item.trace is not None and stage.runner is not run_inline:
+                # Inline stages run on the shared event loop thread: not attributable
+                fn = item.trace.wrap(fn)
+            error = None
+            try:
+                job = await stage.runner(fn, item.job)
+            except asyncio.CancelledError:
+                item.future.cancel()
+                raise
+            except Exception as exc:
+                error = type(exc).__name__
+                if not item.future.done():
+                    item.future.set_exception(exc)
+                continue
+            finally:
+                finished = time.perf_counter()
+                STAGE_SECONDS.observe(finished - started, stage=stage.name)
+                if item.trace is not None:
+                    attrs = {"wait_ms": round((started - item.queued) * 1000, 2)}
+                    if error:
+                        attrs["error"] = error
+                    item.trace.add(stage.name, started, finished, **attrs)
+
+            if is_last:
+                if not item.future.done():
+                    item.future.set_result(job)
+            else:
+                await self._put(index + 1, _Item(job, item.future, item.trace))
+
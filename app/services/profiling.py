@@ -0,0 +1,270 @@
+"""
+Statistical profiling without extra dependencies, and per-job span traces.
+
+Stack sampling reads ``sys._current_frames()`` every few milliseconds from a
+background thread and counts each stack in folded form
+("thread;outer;...;inner <count>" per line), the input format of
+flamegraph.pl, speedscope and most flamegraph viewers.
+
+- Job sampling: PROFILE_SAMPLE_RATE of the jobs are profiled. While one of
+  their pipeline stages runs on a pool thread, that thread is watched and
+  its stacks are attributed to the job; the result is stored for
+  TRACE_TTL_SECONDS (profile:<task_id>). Stages sent to a process pool
+  (CPU_EXECUTOR_KIND=process) run out of reach and are not sampled.
+- Whole-process profiles: profile_process() samples every thread of this
+  process for a few seconds (POST /admin/profile), on a thread of its own
+  (run_profile) so no bounded pool worker is held for that long. Sampling is on the wall
+  clock, so by default threads parked in a known wait (idle pool workers,
+  blocking Redis reads, the event loop's select) are left out, leaving
+  roughly where the process spends CPU; include_idle=True keeps them.
+
+Every job also records a Trace: one span per pipeline stage (with the time
+it waited for the stage) and per Redis state write, stored as JSON under
+trace:<task_id> for TRACE_TTL_SECONDS (GET /admin/traces/<task_id>).
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional
+
+from app.config import settings
+from app.redis_client import redis_client
+from app.services.executors import in_pool_child
+
+logger = logging.getLogger("uvicorn.error")
+
+TRACE_KEY = "trace:{}"
+PROFILE_KEY = "profile:{}"
+
+# Frames kept per stack (innermost); deeper recursion is cut at the root side
+MAX_DEPTH = 64
+
+# Innermost (file, function) of a thread blocked waiting rather than running
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),  # idle ThreadPoolExecutor worker
+    ("selectors.py", "select"),  # event loop with nothing to do
+    ("socket.py", "_read_from_socket"),  # redis-py blocked in XREADGROUP / BLMOVE
+    ("socket.py", "readinto"),
+    ("socket.py", "accept"),
+}
+
+
+# --- stack sampling ---------------------------------------------------------
+
+def _fold(frame, thread_name: str) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+
+def _thread_names() -> Dict[int, str]:
+    return {thread.ident: thread.name for thread in threading.enumerate() if thread.ident is not None}
+
+
+def render_folded(counts: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def is_idle(frame) -> bool:
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def profile_process(seconds: float, interval: float, include_idle: bool = False) -> str:
+    """
+    Wall-clock samples of every thread but the caller (and the job sampler)
+    for `seconds`; returns folded stacks. Threads parked in IDLE_FRAMES are
+    skipped unless `include_idle`. Blocking: run it through run_profile.
+    """
+    me = threading.get_ident()
+    counts: Counter = Counter()
+    names = _thread_names()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me or (not include_idle and is_idle(frame)):
+                continue
+            if ident not in names:
+                names = _thread_names()
+            name = names.get(ident, f"thread-{ident}")
+            if name != "job-sampler":
+                counts[_fold(frame, name)] += 1
+        time.sleep(interval)
+    return render_folded(counts)
+
+
+async def run_profile(seconds: float, interval: float, include_idle: bool = False) -> str:
+    """
+    profile_process on a dedicated "profiler" thread. The I/O pool that
+    Redis, storage and the senders share stays free for the whole profile.
+    """
+    loop = asyncio.get_running_loop()
+    result: "asyncio.Future[str]" = loop.create_future()
+
+    def deliver(value: Optional[str], error: Optional[BaseException]) -> None:
+        if result.done():  # the request went away meanwhile
+            return
+        if error is not None:
+            result.set_exception(error)
+        else:
+            result.set_result(value)
+
+    def target() -> None:
+        try:
+            folded = profile_process(seconds, interval, include_idle)
+        except BaseException as e:
+            loop.call_soon_threadsafe(deliver, None, e)
+        else:
+            loop.call_soon_threadsafe(deliver, folded, None)
+
+    threading.Thread(target=target, name="profiler", daemon=True).start()
+    return await result
+
+
+class JobSampler:
+    """
+    Attributes samples of watched threads to the job they are working on.
+    The sampling thread only runs while at least one thread is watched.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._watched: Dict[int, str] = {}  # thread ident -> task id
+        self._counts: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def watch(self, task_id: str) -> Iterator[None]:
+        """Profiles the current thread on behalf of `task_id` for the duration."""
+        ident = threading.get_ident()
+        with self._lock:
+            self._watched[ident] = task_id
+            self._counts.setdefault(task_id, Counter())
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="job-sampler", daemon=True)
+                self._thread.start()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._watched.pop(ident, None)
+
+    def collect(self, task_id: str) -> str:
+        """Folded stacks recorded for the job so far; forgets them."""
+        with self._lock:
+            return render_folded(self._counts.pop(task_id, Counter()))
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._watched:
+                    self._thread = None
+                    return
+                watched = dict(self._watched)
+            frames = sys._current_frames()
+            for ident, task_id in watched.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = _fold(frame, "job")
+                    with self._lock:
+                        if task_id in self._counts:
+                            self._counts[task_id][stack] += 1
+            time.sleep(self.interval)
+
+
+JOB_SAMPLER = JobSampler(settings.PROFILE_INTERVAL_MS / 1000)
+
+
+def sampled_call(task_id: str, fn: Callable[[dict], dict], job: dict) -> dict:
+    """Stage wrapper for profiled jobs; module-level so it pickles for process pools."""
+    if in_pool_child():
+        # In a CPU pool child: nothing would ever collect the samples
+        return fn(job)
+    with JOB_SAMPLER.watch(task_id):
+        return fn(job)
+
+
+def should_sample() -> bool:
+    return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+# --- span traces ------------------------------------------------------------
+
+@dataclass
+class Trace:
+    """Spans of one job, as offsets from its start (event loop side only)."""
+    task_id: str
+    profile: bool = False
+    started: float = field(default_factory=time.perf_counter)
+    started_at: float = field(default_factory=time.time)
+    spans: List[dict] = field(default_factory=list)
+
+    def add(self, name: str, start: float, end: float, **attrs) -> None:
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self.started) * 1000, 2),
+            "duration_ms": round((end - start) * 1000, 2),
+            **attrs,
+        })
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.add(name, start, time.perf_counter(), **({"error": error} if error else {}))
+
+    def wrap(self, fn: Callable[[dict], dict]) -> Callable[[dict], dict]:
+        """The stage function, sampled on behalf of this job when it is profiled."""
+        return partial(sampled_call, self.task_id, fn) if self.profile else fn
+
+    def to_dict(self) -> dict:
+        return {
+            "task_id": self.task_id,
+            "started_at": self.started_at,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "profiled": self.profile,
+            "spans": self.spans,
+        }
+
+
+def save_trace(trace: Trace) -> None:
+    """Stores the trace (and the job's profile, if sampled) for TRACE_TTL_SECONDS."""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(TRACE_KEY.format(trace.task_id), json.dumps(trace.to_dict()), ex=settings.TRACE_TTL_SECONDS)
+    if trace.profile:
+        pipe.set(PROFILE_KEY.format(trace.task_id), JOB_SAMPLER.collect(trace.task_id), ex=settings.TRACE_TTL_SECONDS)
+    pipe.execute()
+
+
+def load_trace(task_id: str) -> Optional[dict]:
+    raw = redis_client.get(TRACE_KEY.format(task_id))
+    return json.loads(raw) if raw else None
+
+
+def load_profile(task_id: str) -> Optional[str]:
+    raw = redis_client.get(PROFILE_KEY.format(task_id))
+    if raw is None:
+        return None
+    return raw.decode() if isinstance(raw, bytes) else raw
@@ -0,0 +1,178 @@
+"""
+Multi-window rate limiting in one Redis round trip.
+
+Each RateLimiter holds one or more fixed windows, e.g. 1 per 15 s and 5 per
+60 s. All of them are checked and counted by one Lua script, so a request
+costs a single EVALSHA however many windows apply. A request over any window
+is rejected (429 with Retry-After) without being counted in the others.
+Counters use fastapi-limiter's connection, prefix, client identifier and
+429 callback, so the limits behave as the stacked dependencies did.
+
+With RATE_LIMIT_LOCAL_CACHE (the default), each process also rejects
+clients that are clearly over a limit without asking Redis:
+
+- a token bucket per client and window, refilled at times/seconds and
+  holding up to 2 x times. It only counts requests Redis admitted, and a
+  fixed window never admits more than that, so it cannot reject a request
+  Redis would allow;
+- after Redis rejects a client, the rest of its window (the counter's
+  PTTL) is answered locally.
+
+Limiter latency is exported as bgr_rate_limit_seconds{outcome}.
+
+When LOAD_TEST_TOKEN is set, requests carrying it in the X-Load-Test-Token
+header skip every limit, so scripts/loadtest.py can drive the API at a
+target rate. With the setting empty (the default) nothing changes.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+from fastapi_limiter import FastAPILimiter
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.config import settings
+from app.services import metrics
+
+LOAD_TEST_HEADER = "X-Load-Test-Token"
+
+LIMITER_SECONDS = metrics.histogram(
+    "bgr_rate_limit_seconds",
+    "Rate limit check latency, by outcome (allowed, rejected, local_reject).",
+    buckets=(0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+# KEYS: one counter per window; ARGV: limit and window (ms) per key.
+# Returns 0 when admitted (all counters incremented), else the longest PTTL
+# among the windows that are full (nothing incremented).
+MULTI_WINDOW_SCRIPT = """
+local blocked = 0
+for i, key in ipairs(KEYS) do
+  local current = tonumber(redis.call('GET', key) or '0')
+  if current + 1 > tonumber(ARGV[2 * i - 1]) then
+    local ttl = redis.call('PTTL', key)
+    if ttl <= 0 then ttl = tonumber(ARGV[2 * i]) end
+    if ttl > blocked then blocked = ttl end
+  end
+end
+if blocked > 0 then return blocked end
+for i, key in ipairs(KEYS) do
+  if redis.call('INCR', key) == 1 then redis.call('PEXPIRE', key, ARGV[2 * i]) end
+end
+return 0
+"""
+
+
+def is_load_test(request: Request) -> bool:
+    token = settings.LOAD_TEST_TOKEN
+    supplied = request.headers.get(LOAD_TEST_HEADER)
+    return bool(token) and supplied is not None and secrets.compare_digest(supplied, token)
+
+
+class LocalBuckets:
+    """
+    Per-process pre-check (see module docstring). Keys are (client, limiter)
+    pairs; the least recently seen are dropped beyond `max_keys`.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        # key -> ([tokens per window], last refill, blocked until)
+        self._state: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refill(self, key: str, windows: Sequence[Tuple[int, int]], now: float) -> list:
+        state = self._state.get(key)
+        if state is None:
+            state = [[2.0 * times for times, _ in windows], now, 0.0]
+            self._state[key] = state
+            while len(self._state) > self.max_keys:
+                self._state.popitem(last=False)
+        else:
+            elapsed = now - state[1]
+            state[0] = [
+                min(2.0 * times, tokens + elapsed * times / seconds)
+                for tokens, (times, seconds) in zip(state[0], windows)
+            ]
+            state[1] = now
+            self._state.move_to_end(key)
+        return state
+
+    def check(self, key: str, windows: Sequence[Tuple[int, int]]) -> Optional[float]:
+        """Seconds to wait when the client is certainly over a limit, else None."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, _, blocked_until = self._refill(key, windows, now)
+            if blocked_until > now:
+                return blocked_until - now
+            for left, (times, seconds) in zip(tokens, windows):
+                if left < 1.0:
+                    return (1.0 - left) * seconds / times
+        return None
+
+    def admitted(self, key: str, windows: Sequence[Tuple[int, int]]) -> None:
+        with self._lock:
+            state = self._refill(key, windows, time.monotonic())
+            state[0] = [tokens - 1.0 for tokens in state[0]]
+
+    def rejected(self, key: str, windows: Sequence[Tuple[int, int]], retry_after: float) -> None:
+        with self._lock:
+            state = self._refill(key, windows, time.monotonic())
+            state[2] = state[1] + retry_after
+
+
+LOCAL_BUCKETS = LocalBuckets(settings.RATE_LIMIT_LOCAL_MAX_KEYS) if settings.RATE_LIMIT_LOCAL_CACHE else None
+
+
+class RateLimiter:
+    """
+    Dependency enforcing `times` per `seconds`, plus any extra
+    (times, seconds) pairs in `windows`, in one Redis call.
+    """
+
+    def __init__(self, times: int = 0, seconds: int = 0, windows: Sequence[Tuple[int, int]] = ()):
+        self.windows: List[Tuple[int, int]] = ([(times, seconds)] if times and seconds else []) + list(windows)
+        if not self.windows:
+            raise ValueError("RateLimiter needs at least one (times, seconds) window")
+        self.name = ",".join(f"{times}/{seconds}" for times, seconds in self.windows)
+        self._script = None
+
+    async def _check_redis(self, rate_key: str, method: str) -> int:
+        if self._script is None or self._script.registered_client is not FastAPILimiter.redis:
+            # register_script handles EVALSHA and reloads after a SCRIPT FLUSH
+            self._script = FastAPILimiter.redis.register_script(MULTI_WINDOW_SCRIPT)
+        # One hash tag per client: every window key lands in the same cluster slot
+        keys = [f"{FastAPILimiter.prefix}:{{{rate_key}}}:{method}:{times}/{seconds}" for times, seconds in self.windows]
+        args = [value for times, seconds in self.windows for value in (times, seconds * 1000)]
+        return int(await self._script(keys=keys, args=args))
+
+    async def __call__(self, request: Request, response: Response):
+        if is_load_test(request):
+            return None
+        if not FastAPILimiter.redis:
+            raise Exception("You must call FastAPILimiter.init in startup event of fastapi!")
+
+        started = time.perf_counter()
+        rate_key = await FastAPILimiter.identifier(request)
+        local_key = f"{rate_key}|{request.method}|{self.name}"
+
+        # 1. Clearly over a limit: answer without Redis
+        if LOCAL_BUCKETS is not None:
+            wait = LOCAL_BUCKETS.check(local_key, self.windows)
+            if wait is not None:
+                LIMITER_SECONDS.observe(time.perf_counter() - started, outcome="local_reject")
+                return await FastAPILimiter.http_callback(request, response, max(1, int(wait * 1000)))
+
+        # 2. All windows in one round trip
+        pexpire = await self._check_redis(rate_key, request.method)
+        LIMITER_SECONDS.observe(time.perf_counter() - started, outcome="rejected" if pexpire else "allowed")
+        if LOCAL_BUCKETS is not None:
+            if pexpire:
+                LOCAL_BUCKETS.rejected(local_key, self.windows, pexpire / 1000)
+            else:
+                LOCAL_BUCKETS.admitted(local_key, self.windows)
+        if pexpire:
+            return await FastAPILimiter.http_callback(request, response, pexpire)
@@ -0,0 +1,187 @@
+"""
+Derivative rendering from a completed task's stored original + alpha mask.
+
+Thumbnails, solid or image backgrounds and format conversions are produced by
+resizing the cached source/mask and compositing them with numpy, without
+running the model again. Finished derivatives are kept in a byte-bounded LRU
+keyed by the render parameters.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageColor, ImageOps
+
+from app.config import settings
+from app.services import metrics
+from app.services.image_processor import decode_image, encode_image
+from app.services.storage import ASSET_MASK, ASSET_SOURCE, read_asset
+
+RENDER_FORMATS = ("png", "jpg", "jpeg", "webp")
+
+CACHE_HITS = metrics.counter("bgr_render_cache_hits_total", "Derivatives served from the render cache.")
+CACHE_MISSES = metrics.counter("bgr_render_cache_misses_total", "Derivatives that had to be rendered.")
+CACHE_BYTES = metrics.gauge("bgr_render_cache_bytes", "Bytes held by the render cache.")
+
+RGB = Tuple[int, int, int]
+
+
+@dataclass(frozen=True)
+class RenderParams:
+    width: Optional[int] = None
+    height: Optional[int] = None
+    background: Optional[RGB] = None  # None keeps transparency (PNG/WebP)
+    output_format: str = "png"
+    quality: int = 95
+    background_image_sha: Optional[str] = None
+
+    @property
+    def ext(self) -> str:
+        return self.output_format.lower().strip(".")
+
+
+def parse_color(value: Optional[str]) -> Optional[RGB]:
+    """
+    Accepts '#rrggbb', 'rrggbb', '#rgb' or a CSS color name; 'transparent' or
+    empty means no background. Raises ValueError on anything else.
+    """
+    if value is None or value.strip().lower() in ("", "transparent", "none"):
+        return None
+    value = value.strip()
+    if not value.startswith("#") and all(c in "0123456789abcdefABCDEF" for c in value) and len(value) in (3, 6):
+        value = f"#{value}"
+    return ImageColor.getrgb(value)[:3]  # type: ignore[return-value]
+
+
+class _LRU:
+    """Thread-safe LRU bounded by entry count or total bytes."""
+
+    def __init__(self, max_items: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[object, Tuple[object, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size: int = 0) -> None:
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._data.pop(key)[1]
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._data[key] = (value, size)
+            self._bytes += size
+            while self._data and (
+                (self.max_items is not None and len(self._data) > self.max_items)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._bytes -= evicted
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+
+# Decoded sources are large, so keep only a handful; encoded derivatives are small.
+_SOURCES = _LRU(max_items=settings.RENDER_SOURCE_CACHE_SIZE)
+_RENDERS = _LRU(max_bytes=settings.RENDER_CACHE_MAX_BYTES)
+
+
+def render_key(task_id: str, source_etag: str, params: RenderParams) -> str:
+    """Deterministic id of a derivative; also used as its ETag."""
+    raw = f"{task_id}:{source_etag}:{params!r}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _load_sources(task_id: str, assets: str, scale: float) -> Tuple[Image.Image, Image.Image]:
+    cached = _SOURCES.get(task_id)
+    if cached is not None:
+        return cached  # type: ignore[return-value]
+    image = decode_image(read_asset(task_id, ASSET_SOURCE, assets), scale).convert("RGB")
+    mask = Image.open(BytesIO(read_asset(task_id, ASSET_MASK, assets))).convert("L")
+    if mask.size != image.size:
+        mask = mask.resize(image.size, Image.Resampling.BILINEAR)
+    _SOURCES.put(task_id, (image, mask))
+    return image, mask
+
+
+def _target_size(size: Tuple[int, int], width: Optional[int], height: Optional[int]) -> Tuple[int, int]:
+    """Fits inside width x height keeping the aspect ratio (never above RENDER_MAX_SIDE)."""
+    src_w, src_h = size
+    limit = settings.RENDER_MAX_SIDE
+    box_w = min(width or limit, limit)
+    box_h = min(height or limit, limit)
+    if width is None and height is None:
+        box_w = box_h = min(max(src_w, src_h), limit)
+    ratio = min(box_w / src_w, box_h / src_h)
+    return max(1, round(src_w * ratio)), max(1, round(src_h * ratio))
+
+
+def composite(rgb: np.ndarray, alpha: np.ndarray, background: np.ndarray) -> np.ndarray:
+    """
+    out = fg * a + bg * (1 - a), in integer arithmetic over whole arrays.
+    ``background`` is either HxWx3 or broadcastable (1x1x3 for a solid color).
+    """
+    a = alpha[..., None].astype(np.uint16)
+    out = rgb.astype(np.uint16) * a + background.astype(np.uint16) * (255 - a)
+    return ((out + 127) // 255).astype(np.uint8)
+
+
+def render(
+    task_id: str,
+    assets: str,
+    scale: float,
+    source_etag: str,
+    params: RenderParams,
+    background_image: Optional[bytes] = None,
+) -> bytes:
+    """
+    Returns the encoded derivative, rendering it only on a cache miss.
+    Sync and CPU-bound: call through the codec executor.
+    """
+    key = render_key(task_id, source_etag, params)
+    cached = _RENDERS.get(key)
+    if cached is not None:
+        CACHE_HITS.inc()
+        return cached  # type: ignore[return-value]
+    CACHE_MISSES.inc()
+
+    image, mask = _load_sources(task_id, assets, scale)
+    size = _target_size(image.size, params.width, params.height)
+    if size != image.size:
+        # reducing_gap lets Pillow pre-shrink with a cheap box filter first
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        mask = mask.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    rgb = np.asarray(image)
+    alpha = np.asarray(mask)
+
+    background = params.background
+    if background is None and background_image is None and params.ext in ("jpg", "jpeg"):
+        background = (255, 255, 255)  # JPEG has no alpha channel
+
+    if background_image is not None:
+        bg = ImageOps.fit(Image.open(BytesIO(background_image)).convert("RGB"), size, Image.Resampling.LANCZOS)
+        result = Image.fromarray(composite(rgb, alpha, np.asarray(bg)), "RGB")
+    elif background is not None:
+        result = Image.fromarray(composite(rgb, alpha, np.array(background, dtype=np.uint8)[None, None, :]), "RGB")
+    else:
+        result = Image.fromarray(np.dstack([rgb, alpha]), "RGBA")
+
+    encoded = encode_image(result, params.ext, params.quality)
+    _RENDERS.put(key, encoded, len(encoded))
+    CACHE_BYTES.set(_RENDERS.nbytes)
+    return encoded
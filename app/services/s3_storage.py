@@ -0,0 +1,237 @@
+"""
+S3 (or S3-compatible) storage backend.
+
+One boto3 client per process, created on first use: its urllib3 pool holds
+STORAGE_S3_CONCURRENCY connections, matching the backend's bounded pool, so
+concurrent calls reuse warm TLS connections instead of queueing on the pool
+or opening new ones. Point AWS_S3_ENDPOINT_URL at MinIO (or `moto_server`)
+to run against a local stand-in.
+
+Presigned URLs are cached per (key, response overrides) and reused until
+less than PRESIGN_REFRESH_MARGIN_SECONDS of their validity is left. Besides
+saving the signing work on every download, repeated requests then get the
+same URL, which browsers and CDNs can cache.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import AsyncIterable, Iterator, List, Optional
+
+from app.config import settings
+from app.services import metrics
+from app.services.storage import (
+    ASSET_PREFIX,
+    RESULT_PREFIX,
+    UPLOAD_PREFIX,
+    PresignedPost,
+    SignedUrl,
+    Storage,
+    StoredObject,
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+PRESIGN_HITS = metrics.counter("bgr_presign_cache_hits_total", "Presigned URLs reused from the cache.")
+PRESIGN_MISSES = metrics.counter("bgr_presign_cache_misses_total", "Presigned URLs signed afresh.")
+
+# S3 multipart parts must be >= 5 MiB (except the last one)
+PART_SIZE = 8 * 1024 * 1024
+
+
+@lru_cache(maxsize=1)
+def get_s3_client():
+    """Returns the shared boto3 S3 client, creating it on first call."""
+    import boto3
+    from botocore.config import Config
+
+    return boto3.client(
+        "s3",
+        aws_access_key_id=settings.AWS_ACCESS_KEY,
+        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+        region_name=settings.AWS_REGION,
+        endpoint_url=settings.AWS_S3_ENDPOINT_URL or None,
+        config=Config(
+            max_pool_connections=settings.STORAGE_S3_CONCURRENCY,
+            retries={"max_attempts": 3, "mode": "standard"},
+            connect_timeout=5,
+            read_timeout=30,
+            # MinIO and most stand-ins only speak path-style addressing
+            s3={"addressing_style": "path" if settings.AWS_S3_ENDPOINT_URL else "auto"},
+        ),
+    )
+
+
+class S3Storage(Storage):
+    name = "s3"
+    # Direct uploads never completed are swept with the rest
+    prefixes = (RESULT_PREFIX, ASSET_PREFIX, UPLOAD_PREFIX)
+
+    def __init__(self, bucket: str, concurrency: int):
+        super().__init__(concurrency)
+        self.bucket = bucket
+        # (key, download_name, content_type, cache_control) -> URL, LRU order
+        self._signed: "OrderedDict[tuple, SignedUrl]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        return get_s3_client()
+
+    def _object_args(self, content_type: str) -> dict:
+        return {
+            "ContentType": content_type,
+            # Keys are unique per task, so caches may keep them as long as the task lives
+            "CacheControl": f"private, max-age={settings.REDIS_TTL_SECONDS}, immutable",
+        }
+
+    def put_sync(self, key: str, data: bytes, content_type: str) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, **self._object_args(content_type))
+
+    def put_file_sync(self, key: str, fileobj, content_type: str) -> None:
+        # upload_fileobj switches to multipart (parallel parts) for large files
+        self.client.upload_fileobj(fileobj, self.bucket, key, ExtraArgs=self._object_args(content_type))
+
+    def get_sync(self, key: str) -> bytes:
+        client = self.client
+        try:
+            return client.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        except client.exceptions.NoSuchKey as e:
+            raise FileNotFoundError(key) from e
+
+    def read_head_sync(self, key: str, length: int) -> bytes:
+        client = self.client
+        try:
+            response = client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes=0-{length - 1}")
+        except client.exceptions.NoSuchKey as e:
+            raise FileNotFoundError(key) from e
+        return response["Body"].read()
+
+    def stat_sync(self, key: str) -> Optional[StoredObject]:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return StoredObject(key, head["ContentLength"], head["LastModified"].timestamp())
+
+    def delete_sync(self, keys: List[str]) -> None:
+        if len(keys) == 1:
+            self.client.delete_object(Bucket=self.bucket, Key=keys[0])
+        elif keys:
+            self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+            )
+
+    def list_sync(self, prefix: str) -> Iterator[StoredObject]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                yield StoredObject(obj["Key"], obj["Size"], obj["LastModified"].timestamp())
+
+    def presign_post_sync(self, key: str, content_type: str, max_bytes: int, expires_in: int) -> PresignedPost:
+        expires_at = time.time() + expires_in
+        post = self.client.generate_presigned_post(
+            Bucket=self.bucket,
+            Key=key,
+            Fields={"Content-Type": content_type},
+            Conditions=[{"Content-Type": content_type}, ["content-length-range", 1, max_bytes]],
+            ExpiresIn=expires_in,
+        )
+        return PresignedPost(post["url"], post["fields"], expires_at)
+
+    def _cached(self, cache_key: tuple) -> Optional[SignedUrl]:
+        """A cached URL with more than PRESIGN_REFRESH_MARGIN_SECONDS left, if any."""
+        with self._lock:
+            signed = self._signed.get(cache_key)
+            if signed is None:
+                return None
+            if signed.expires_at - time.time() < settings.PRESIGN_REFRESH_MARGIN_SECONDS:
+                del self._signed[cache_key]
+                return None
+            self._signed.move_to_end(cache_key)
+        PRESIGN_HITS.inc()
+        return signed
+
+    def sign_sync(self, key: str, base_url: str = "", **response) -> SignedUrl:
+        cache_key = (key, response.get("download_name"), response.get("content_type"), response.get("cache_control"))
+        signed = self._cached(cache_key)
+        if signed is not None:
+            return signed
+
+        params = {"Bucket": self.bucket, "Key": key}
+        if response.get("download_name"):
+            params["ResponseContentDisposition"] = f'attachment; filename="{response["download_name"]}"'
+        if response.get("content_type"):
+            params["ResponseContentType"] = response["content_type"]
+        if response.get("cache_control"):
+            params["ResponseCacheControl"] = response["cache_control"]
+        expires_at = time.time() + settings.PRESIGNED_URL_EXPIRY
+        url = self.client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=settings.PRESIGNED_URL_EXPIRY
+        )
+        PRESIGN_MISSES.inc()
+
+        signed = SignedUrl(url, expires_at)
+        with self._lock:
+            self._signed[cache_key] = signed
+            while len(self._signed) > settings.PRESIGN_CACHE_SIZE:
+                self._signed.popitem(last=False)
+        return signed
+
+    async def sign(self, key: str, base_url: str = "", **response) -> SignedUrl:
+        # Cache hits are answered on the event loop, without a pool hop
+        cache_key = (key, response.get("download_name"), response.get("content_type"), response.get("cache_control"))
+        return self._cached(cache_key) or await super().sign(key, base_url, **response)
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes], content_type: str) -> None:
+        """
+        Multipart upload fed from the stream, one PART_SIZE buffer at a time.
+        Streams shorter than one part become a single PUT.
+        """
+        buffer = bytearray()
+        upload_id = None
+        parts = []
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                while len(buffer) >= PART_SIZE:
+                    if upload_id is None:
+                        created = await self.pool.run(
+                            self.client.create_multipart_upload,
+                            Bucket=self.bucket, Key=key, **self._object_args(content_type),
+                        )
+                        upload_id = created["UploadId"]
+                    part, buffer = bytes(buffer[:PART_SIZE]), buffer[PART_SIZE:]
+                    parts.append(await self._upload_part(key, upload_id, len(parts) + 1, part))
+
+            if upload_id is None:
+                await self.put(key, bytes(buffer), content_type)
+                return
+            if buffer:
+                parts.append(await self._upload_part(key, upload_id, len(parts) + 1, bytes(buffer)))
+            await self.pool.run(
+                self.client.complete_multipart_upload,
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            if upload_id is not None:
+                try:
+                    await self.pool.run(
+                        self.client.abort_multipart_upload, Bucket=self.bucket, Key=key, UploadId=upload_id
+                    )
+                except Exception as e:
+                    logger.warning(f"Could not abort multipart upload of {key}: {str(e)}")
+            raise
+
+    async def _upload_part(self, key: str, upload_id: str, number: int, data: bytes) -> dict:
+        response = await self.pool.run(
+            self.client.upload_part,
+            Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data,
+        )
+        return {"ETag": response["ETag"], "PartNumber": number}
@@ -1,49 +1,49 @@
-
+import logging
 import os
+import socket
 import time
-import boto3
 from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 
 from app.redis_client import redis_client
 from app.config import settings
+from app.services.storage import get_storage
+
+logger = logging.getLogger("uvicorn.error")
+
+# Long-lived service keys (job stream, email outbox, indexes) carry no TTL on purpose
+PERSISTENT_KEY_PREFIX = b"bgr:"
+
+# Every web and worker process schedules the sweep; whichever claims this key
+# first runs it for the whole cluster and the rest skip that interval.
+CLEANUP_LOCK_KEY = "bgr:lock:cleanup"
+NODE_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _claim_interval() -> bool:
+    """
+    SET NX with a TTL slightly under the interval: one run per interval
+    cluster-wide, and a crashed holder cannot block the next one.
+    """
+    lease = max(60, int(settings.CLEANUP_INTERVAL_HOURS * 3600) - 60)
+    return bool(redis_client.set(CLEANUP_LOCK_KEY, NODE_ID, nx=True, ex=lease))
 
 
 def cleanup_redis_and_files():
+    if not _claim_interval():
+        logger.info(f"Cleanup already ran this interval on {redis_client.get(CLEANUP_LOCK_KEY)!r}; skipping.")
+        return
+
     # Clean expired Redis keys
     for key in redis_client.scan_iter():
+        if key.startswith(PERSISTENT_KEY_PREFIX):
+            continue
         if redis_client.ttl(key) < 0:
             redis_client.delete(key)
 
-    # Clean files depending on environment
-    if settings.ENV == "production" and settings.AWS_USE_S3:
-        # Clean up from S3
-        s3 = boto3.client(
-            "s3",
-            region_name=settings.AWS_REGION,
-            aws_access_key_id=settings.AWS_ACCESS_KEY,
-            aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        )
-
-        # List and optionally delete old S3 objects (example logic: delete if older than TTL)
-        response = s3.list_objects_v2(Bucket=settings.AWS_S3_BUCKET, Prefix="processed/")
-        if "Contents" in response:
-            cutoff_time = datetime.now().timestamp() - settings.REDIS_TTL_SECONDS
-            for obj in response["Contents"]:
-                last_modified = obj["LastModified"].timestamp()
-                if last_modified < cutoff_time:
-                    s3.delete_object(Bucket=settings.AWS_S3_BUCKET, Key=obj["Key"])
-
-    else:
-        # Local file cleanup
-        cutoff = time.time() - settings.REDIS_TTL_SECONDS
-        for fname in os.listdir(settings.OUTPUT_DIR):
-            path = os.path.join(settings.OUTPUT_DIR, fname)
-            try:
-                if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
-                    os.remove(path)
-            except FileNotFoundError:
-                continue
+    # Results and render assets older than the task TTL, wherever they are stored
+    removed = get_storage().cleanup_sync(time.time() - settings.REDIS_TTL_SECONDS)
+    logger.info(f"Cleanup on {NODE_ID} removed {removed} stored object(s).")
 
 
 def start_scheduler():
@@ -55,62 +55,4 @@ def start_scheduler():
         next_run_time=datetime.now() + timedelta(seconds=10),
     )
     scheduler.start()
-
-
-
-# import os
-# import time
-# import boto3
-# from datetime import datetime, timedelta
-# from apscheduler.schedulers.background import BackgroundScheduler
-
-# from app.redis_client import redis_client
-# from app.config import settings
-
-
-# def cleanup_redis_and_files():
-#     # Clean expired Redis keys
-#     for key in redis_client.scan_iter():
-#         if redis_client.ttl(key) < 0:
-#             redis_client.delete(key)
-
-#     # Clean files depending on environment
-#     if settings.ENV == "production" and settings.AWS_USE_S3:
-#         # Clean up from S3
-#         s3 = boto3.client(
-#             "s3",
-#             region_name=settings.AWS_REGION,
-#             aws_access_key_id=settings.AWS_ACCESS_KEY,
-#             aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-#         )
-
-#         # List and optionally delete old S3 objects (example logic: delete if older than TTL)
-#         response = s3.list_objects_v2(Bucket=settings.AWS_S3_BUCKET, Prefix="processed/")
-#         if "Contents" in response:
-#             cutoff_time = datetime.now().timestamp() - settings.REDIS_TTL_SECONDS
-#             for obj in response["Contents"]:
-#                 last_modified = obj["LastModified"].timestamp()
-#                 if last_modified < cutoff_time:
-#                     s3.delete_object(Bucket=settings.AWS_S3_BUCKET, Key=obj["Key"])
-
-#     else:
-#         # Local file cleanup
-#         cutoff = time.time() - settings.REDIS_TTL_SECONDS
-#         for fname in os.listdir(settings.OUTPUT_DIR):
-#             path = os.path.join(settings.OUTPUT_DIR, fname)
-#             try:
-#                 if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
-#                     os.remove(path)
-#             except FileNotFoundError:
-#                 continue
-
-
-# def start_scheduler():
-#     scheduler = BackgroundScheduler()
-#     scheduler.add_job(
-#         func=cleanup_redis_and_files,
-#         trigger="interval",
-#         hours=settings.CLEANUP_INTERVAL_HOURS,
-#         next_run_time=datetime.now() + timedelta(seconds=10),
-#     )
-#     scheduler.start()
+    return scheduler
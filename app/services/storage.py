@@ -1,29 +1,379 @@
+"""
+Where results and render assets live, behind one small interface.
+
+Objects are addressed by key ("processed/<id>.<ext>" for results,
+"assets/<id>.<name>" for render assets, "uploads/<id>.<ext>" for uploads
+sent straight to S3 with a presigned POST) and stored by a backend:
+
+- "local": OUTPUT_DIR / ASSET_DIR on the filesystem. With several nodes
+  these must be a shared volume (NFS, EFS...) mounted at the same path.
+- "s3": an S3 bucket, or any S3-compatible store via AWS_S3_ENDPOINT_URL.
+
+STORAGE_BACKEND picks the backend for new results; each task records the
+backend it used ("storage" / "assets"), so reads keep working after a
+switch. Result URLs never point at a particular replica: local results are
+served from the shared volume by every web node, S3 results are presigned.
+
+Every backend exposes the same operations twice: blocking ``*_sync``
+methods for code already running on a worker thread (render, dedup, the
+cleanup job), and async ``put/get/delete/list/presign/put_stream`` that run
+them on the backend's own bounded pool. Each pool (STORAGE_LOCAL_CONCURRENCY,
+STORAGE_S3_CONCURRENCY) caps in-flight calls per backend and shows up in
+bgr_executor_* as pool="storage-local" / "storage-s3".
+"""
 import os
+import shutil
+import time
+from dataclasses import dataclass
+from typing import AsyncIterable, Dict, Iterator, List, Optional
+
 from app.config import settings
+from app.services.executors import BoundedExecutor
 
 
-if settings.ENV != "production" or not settings.AWS_USE_S3:
+if settings.STORAGE_BACKEND == "local":
     os.makedirs(settings.OUTPUT_DIR, exist_ok=True)
+    os.makedirs(settings.ASSET_DIR, exist_ok=True)
+
+
+# Output extension -> MIME type (used for local responses and S3 metadata)
+CONTENT_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "gif": "image/gif",
+    "webm": "video/webm",
+    "mp4": "video/mp4",
+    "mov": "video/quicktime",
+    "json": "application/json",
+}
+
+
+def content_type_for(ext: str) -> str:
+    return CONTENT_TYPES.get(ext.lower().strip("."), "application/octet-stream")
 
 
 def build_filename(processing_id: str, ext: str) -> str:
     return f"{processing_id}.{ext}"
 
 
-def build_filepath(processing_id: str, ext: str) -> str:
+RESULT_PREFIX = "processed/"
+ASSET_PREFIX = "assets/"
+UPLOAD_PREFIX = "uploads/"
+
+
+def build_result_key(processing_id: str, ext: str) -> str:
     """
-    Returns the full file path for saving locally (used in dev mode).
+    Returns the storage key of a result, the same for every backend.
     """
     filename = build_filename(processing_id, ext)
-    return os.path.join(settings.OUTPUT_DIR, filename)
+    return f"{RESULT_PREFIX}{filename}"
 
 
-def build_s3_key(processing_id: str, ext: str) -> str:
+def build_preview_key(processing_id: str) -> str:
     """
-    Returns the S3 key (i.e., object path) where the file should be stored in S3.
+    Storage key of the progressive preview. Kept next to the result, so it
+    is served and cleaned up the same way.
     """
-    filename = build_filename(processing_id, ext)
-    return f"processed/{filename}"
+    return build_result_key(f"{processing_id}.preview", "webp")
+
+
+# Historical name, from when only S3 used keys
+build_s3_key = build_result_key
+
+
+# Render assets: the original upload ("source") and the alpha mask ("mask.png")
+ASSET_SOURCE = "source"
+ASSET_MASK = "mask.png"
+
+
+def build_asset_path(processing_id: str, name: str) -> str:
+    """
+    Local path of a render asset. Lives outside OUTPUT_DIR so it is never
+    exposed through the /processed_images static mount.
+    """
+    return os.path.join(settings.ASSET_DIR, f"{processing_id}.{name}")
+
+
+def build_asset_key(processing_id: str, name: str) -> str:
+    """
+    Storage key of a render asset.
+    """
+    return f"{ASSET_PREFIX}{processing_id}.{name}"
+
+
+def build_upload_key(upload_id: str, ext: str) -> str:
+    """
+    Staging key of a direct upload.
+    """
+    return f"{UPLOAD_PREFIX}{upload_id}.{ext}"
+
+
+@dataclass
+class StoredObject:
+    key: str
+    size: int
+    modified: float  # epoch seconds
+
+
+@dataclass(frozen=True)
+class SignedUrl:
+    url: str
+    expires_at: Optional[float] = None  # epoch seconds; None = does not expire
+
+
+@dataclass
+class PresignedPost:
+    """An HTML form upload: POST `fields` plus the file (last) to `url`."""
+    url: str
+    fields: Dict[str, str]
+    expires_at: float
+
+
+class Storage:
+    """
+    Backend interface. Keys are "processed/..." or "assets/...". Backends
+    implement the blocking primitives; the async API is derived from them.
+    """
+
+    name = ""
+    # Key prefixes swept by cleanup_sync
+    prefixes = (RESULT_PREFIX, ASSET_PREFIX)
+
+    def __init__(self, concurrency: int):
+        self.pool = BoundedExecutor(f"storage-{self.name}", concurrency, "thread")
+
+    # --- blocking primitives (call from worker threads only) ----------------
+
+    def put_sync(self, key: str, data: bytes, content_type: str) -> None:
+        raise NotImplementedError
+
+    def put_file_sync(self, key: str, fileobj, content_type: str) -> None:
+        """Streams a readable binary file object without loading it whole."""
+        raise NotImplementedError
+
+    def get_sync(self, key: str) -> bytes:
+        """Raises FileNotFoundError when the object is gone."""
+        raise NotImplementedError
+
+    def read_head_sync(self, key: str, length: int) -> bytes:
+        """The first `length` bytes (enough for a header). Raises FileNotFoundError."""
+        raise NotImplementedError
+
+    def stat_sync(self, key: str) -> Optional[StoredObject]:
+        """Size and modification time, or None when the object does not exist."""
+        raise NotImplementedError
+
+    def delete_sync(self, keys: List[str]) -> None:
+        raise NotImplementedError
+
+    def list_sync(self, prefix: str) -> Iterator[StoredObject]:
+        raise NotImplementedError
+
+    def sign_sync(self, key: str, base_url: str = "", **response) -> SignedUrl:
+        """
+        A URL for a result that resolves from any replica, with its expiry.
+        `response` may hold download_name, content_type and cache_control
+        for the served object.
+        """
+        raise NotImplementedError
+
+    def presign_sync(self, key: str, base_url: str = "", **response) -> str:
+        return self.sign_sync(key, base_url, **response).url
+
+    def presign_post_sync(self, key: str, content_type: str, max_bytes: int, expires_in: int) -> PresignedPost:
+        """
+        Lets a client upload `key` straight to the store, with the content
+        type and size enforced by the store itself.
+        """
+        raise NotImplementedError(f"Direct uploads are not supported by the {self.name} storage backend.")
+
+    def cleanup_sync(self, older_than: float) -> int:
+        """Deletes objects last modified before `older_than` (epoch); returns the count."""
+        removed = 0
+        for prefix in self.prefixes:
+            stale = [obj.key for obj in self.list_sync(prefix) if obj.modified < older_than]
+            # Backends delete in batches where they can (S3: 1000 keys per request)
+            for start in range(0, len(stale), 1000):
+                self.delete_sync(stale[start:start + 1000])
+            removed += len(stale)
+        return removed
+
+    # --- async API (bounded per backend) ------------------------------------
+
+    async def put(self, key: str, data: bytes, content_type: str) -> None:
+        await self.pool.run(self.put_sync, key, data, content_type)
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes], content_type: str) -> None:
+        """Writes an async stream of chunks; memory stays at about one part."""
+        raise NotImplementedError
+
+    async def get(self, key: str) -> bytes:
+        return await self.pool.run(self.get_sync, key)
+
+    async def read_head(self, key: str, length: int) -> bytes:
+        return await self.pool.run(self.read_head_sync, key, length)
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        return await self.pool.run(self.stat_sync, key)
+
+    async def delete(self, *keys: str) -> None:
+        await self.pool.run(self.delete_sync, list(keys))
+
+    async def list(self, prefix: str, limit: int = 1000) -> List[StoredObject]:
+        def collect() -> List[StoredObject]:
+            objects = []
+            for obj in self.list_sync(prefix):
+                objects.append(obj)
+                if len(objects) >= limit:
+                    break
+            return objects
+
+        return await self.pool.run(collect)
+
+    async def sign(self, key: str, base_url: str = "", **response) -> SignedUrl:
+        return await self.pool.run(self.sign_sync, key, base_url, **response)
+
+    async def presign(self, key: str, base_url: str = "", **response) -> str:
+        return (await self.sign(key, base_url, **response)).url
+
+    async def presign_post(self, key: str, content_type: str, max_bytes: int, expires_in: int) -> PresignedPost:
+        return await self.pool.run(self.presign_post_sync, key, content_type, max_bytes, expires_in)
+
+    async def presign_many(self, keys: List[str], base_url: str = "", **response) -> List[str]:
+        """Signs a batch in one pool call instead of one hop per URL."""
+        return await self.pool.run(lambda: [self.presign_sync(key, base_url, **response) for key in keys])
+
+    def shutdown(self) -> None:
+        self.pool.shutdown(wait=False)
+
+
+class LocalStorage(Storage):
+    name = "local"
+
+    def __init__(self, output_dir: str, asset_dir: str, concurrency: int):
+        super().__init__(concurrency)
+        # Results are publicly mounted at /processed_images; assets are not
+        self.roots = {RESULT_PREFIX: output_dir, ASSET_PREFIX: asset_dir}
+
+    def path(self, key: str) -> str:
+        for prefix, root in self.roots.items():
+            if key.startswith(prefix):
+                return os.path.join(root, key[len(prefix):])
+        raise ValueError(f"Unknown storage key prefix: {key}")
+
+    def _tmp_path(self, path: str) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+
+    def put_sync(self, key: str, data: bytes, content_type: str) -> None:
+        path = self.path(key)
+        # Write then rename: readers on other nodes never see a partial file
+        tmp = self._tmp_path(path)
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+
+    def put_file_sync(self, key: str, fileobj, content_type: str) -> None:
+        path = self.path(key)
+        tmp = self._tmp_path(path)
+        with open(tmp, "wb") as fh:
+            shutil.copyfileobj(fileobj, fh, 1024 * 1024)
+        os.replace(tmp, path)
+
+    def get_sync(self, key: str) -> bytes:
+        with open(self.path(key), "rb") as fh:
+            return fh.read()
+
+    def read_head_sync(self, key: str, length: int) -> bytes:
+        with open(self.path(key), "rb") as fh:
+            return fh.read(length)
+
+    def stat_sync(self, key: str) -> Optional[StoredObject]:
+        try:
+            stat = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+        return StoredObject(key, stat.st_size, stat.st_mtime)
+
+    def delete_sync(self, keys: List[str]) -> None:
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def list_sync(self, prefix: str) -> Iterator[StoredObject]:
+        directory = self.path(prefix)
+        if not os.path.isdir(directory):
+            return
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file() and not entry.name.endswith(".tmp"):
+                        stat = entry.stat()
+                        yield StoredObject(prefix + entry.name, stat.st_size, stat.st_mtime)
+                except FileNotFoundError:
+                    continue
+
+    def sign_sync(self, key: str, base_url: str = "", **response) -> SignedUrl:
+        base = (settings.PUBLIC_BASE_URL or base_url).rstrip("/")
+        return SignedUrl(f"{base}/processed_images/{key[len(RESULT_PREFIX):]}")
+
+    async def sign(self, key: str, base_url: str = "", **response) -> SignedUrl:
+        # Plain string formatting: no reason to hop to the pool
+        return self.sign_sync(key, base_url, **response)
+
+    async def put_stream(self, key: str, chunks: AsyncIterable[bytes], content_type: str) -> None:
+        path = self.path(key)
+        tmp = self._tmp_path(path)
+        fh = await self.pool.run(open, tmp, "wb")
+        try:
+            async for chunk in chunks:
+                await self.pool.run(fh.write, chunk)
+        except BaseException:
+            await self.pool.run(fh.close)
+            await self.pool.run(os.remove, tmp)
+            raise
+        await self.pool.run(fh.close)
+        await self.pool.run(os.replace, tmp, path)
+
+
+_BACKENDS: Dict[str, Storage] = {}
+
+
+def get_storage(name: Optional[str] = None) -> Storage:
+    """
+    The backend named by a task's "storage"/"assets" field, or the
+    configured STORAGE_BACKEND for new objects.
+    """
+    name = name or settings.STORAGE_BACKEND
+    if name not in _BACKENDS:
+        if name == "s3":
+            # boto3 is only imported once S3 is actually used
+            from app.services.s3_storage import S3Storage
+
+            _BACKENDS[name] = S3Storage(settings.AWS_S3_BUCKET, settings.STORAGE_S3_CONCURRENCY)
+        elif name == "local":
+            _BACKENDS[name] = LocalStorage(settings.OUTPUT_DIR, settings.ASSET_DIR, settings.STORAGE_LOCAL_CONCURRENCY)
+        else:
+            raise ValueError(f"Unknown storage backend '{name}' (expected 'local' or 's3').")
+    return _BACKENDS[name]
+
+
+def read_asset(processing_id: str, name: str, assets: str) -> bytes:
+    """
+    Reads a render asset from where the task stored it ("s3" or "local").
+    Blocking (callers run on the codec or CPU pool). Raises FileNotFoundError
+    when it is gone.
+    """
+    return get_storage(assets).get_sync(build_asset_key(processing_id, name))
+
+
+def shutdown_storage() -> None:
+    for backend in _BACKENDS.values():
+        backend.shutdown()
 
 
 # import os
@@ -0,0 +1,155 @@
+"""
+Task state storage in Redis hashes.
+
+Each task is one hash keyed by its processing id. Writers only send the
+fields that changed (HSET / HDEL) together with the TTL refresh in a single
+pipeline, so every state transition costs one round trip. Readers fetch just
+the fields they need with HMGET instead of decoding a whole JSON blob.
+
+Tasks written by older releases are plain JSON strings (SETEX). They are
+still readable: the first access converts them into a hash in place,
+preserving the remaining TTL.
+"""
+import json
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from redis.exceptions import ResponseError
+
+from app.config import settings
+from app.redis_client import redis_client
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def _is_wrong_type(exc: ResponseError) -> bool:
+    # Errors from a pipeline are prefixed with "Command # N (...) of pipeline caused error: "
+    return "WRONGTYPE" in str(exc)
+
+
+def _encode(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+def _decode(value) -> Optional[str]:
+    if value is None:
+        return None
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def migrate_legacy(task_id: str) -> bool:
+    """
+    Converts a legacy JSON-string task into a hash, keeping its TTL.
+    Returns False when there was nothing to convert.
+    """
+    try:
+        raw = redis_client.get(task_id)
+    except ResponseError as exc:
+        if not _is_wrong_type(exc):
+            raise
+        # Another reader converted it first
+        return False
+    if raw is None:
+        return False
+    data = json.loads(raw)  # type: ignore[arg-type]
+    ttl_ms = redis_client.pttl(task_id)
+
+    mapping = {k: _encode(v) for k, v in data.items() if v is not None}
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(task_id)
+    if mapping:
+        pipe.hset(task_id, mapping=mapping)
+    if ttl_ms and ttl_ms > 0:
+        pipe.pexpire(task_id, ttl_ms)
+    pipe.execute()
+    logger.info(f"Migrated legacy JSON state of task {task_id} to a hash.")
+    return True
+
+
+def update_task(task_id: str, **fields) -> None:
+    """
+    Writes only the given fields (None deletes a field) and refreshes the TTL,
+    all in one pipelined round trip.
+    """
+    to_set: Dict[str, str] = {k: _encode(v) for k, v in fields.items() if v is not None}
+    to_delete = [k for k, v in fields.items() if v is None]
+
+    # No MULTI/EXEC needed: a lone HSET without its EXPIRE is harmless
+    pipe = redis_client.pipeline(transaction=False)
+    if to_set:
+        pipe.hset(task_id, mapping=to_set)
+    if to_delete:
+        pipe.hdel(task_id, *to_delete)
+    pipe.expire(task_id, settings.REDIS_TTL_SECONDS)
+    try:
+        pipe.execute()
+    except ResponseError as exc:
+        if not _is_wrong_type(exc):
+            raise
+        # Key still holds a legacy JSON string: convert, then apply the update
+        migrate_legacy(task_id)
+        update_task(task_id, **fields)
+
+
+def init_task(task_id: str, **fields) -> None:
+    """
+    Creates a fresh task hash (replacing anything stored under the id).
+    """
+    mapping = {k: _encode(v) for k, v in fields.items() if v is not None}
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(task_id)
+    pipe.hset(task_id, mapping=mapping)
+    pipe.expire(task_id, settings.REDIS_TTL_SECONDS)
+    pipe.execute()
+
+
+def get_task(task_id: str, fields: Iterable[str]) -> Optional[Dict[str, Optional[str]]]:
+    """
+    Fetches the requested fields with a single HMGET.
+    Returns None when the task does not exist (or has expired).
+    "status" is always fetched, since every live task has one.
+    """
+    names = list(dict.fromkeys(["status", *fields]))
+    try:
+        values = redis_client.hmget(task_id, names)
+    except ResponseError as exc:
+        if not _is_wrong_type(exc):
+            raise
+        migrate_legacy(task_id)
+        values = redis_client.hmget(task_id, names)
+
+    result = {name: _decode(value) for name, value in zip(names, values)}
+    if result["status"] is None:
+        return None
+    return result
+
+
+def get_task_with_ttl(
+    task_id: str, fields: Iterable[str]
+) -> Tuple[Optional[Dict[str, Optional[str]]], int]:
+    """
+    Like get_task, but also returns the remaining TTL in seconds (HMGET + TTL
+    pipelined in one round trip). Used to derive HTTP cache lifetimes.
+    """
+    names = list(dict.fromkeys(["status", *fields]))
+
+    def _read():
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hmget(task_id, names)
+        pipe.ttl(task_id)
+        return pipe.execute()
+
+    try:
+        values, ttl = _read()
+    except ResponseError as exc:
+        if not _is_wrong_type(exc):
+            raise
+        migrate_legacy(task_id)
+        values, ttl = _read()
+
+    result = {name: _decode(value) for name, value in zip(names, values)}
+    if result["status"] is None:
+        return None, 0
+    return result, max(int(ttl), 0)
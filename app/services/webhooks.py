@@ -0,0 +1,253 @@
+"""
+Completion webhooks: POST a signed payload to the task's callback_url.
+
+Jobs never call out themselves. process_job (and fail_task) only add a
+delivery to a Redis ZSET scored by its due time; a WebhookSender drains it
+through one shared httpx.AsyncClient, whose pool keeps connections to
+integrators warm.
+
+- Concurrency: at most WEBHOOK_CONCURRENCY deliveries are in flight per
+  sender (also the connection pool size).
+- Claiming: a Lua script takes due entries and pushes their score past the
+  request timeout, so several senders never deliver the same entry, and an
+  entry held by a crashed sender becomes due again by itself.
+- Retries: network errors, timeouts, 408, 429 and 5xx back off
+  exponentially (WEBHOOK_RETRY_BASE_DELAY, capped at
+  WEBHOOK_RETRY_MAX_DELAY) up to WEBHOOK_MAX_ATTEMPTS; other 4xx fail at
+  once. Redirects are not followed.
+- The task hash records webhook_status (queued / delivered / retrying /
+  failed) and webhook_log, one JSON entry per attempt.
+
+Every request carries X-Webhook-Id (stable across retries, for
+idempotency), X-Webhook-Timestamp and X-Webhook-Signature:
+"sha256=" + HMAC-SHA256(WEBHOOK_SECRET, "<timestamp>.<body>") in hex.
+scripts/webhook_receiver.py is a local stand-in that verifies them.
+"""
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import random
+import time
+import uuid
+from typing import List, Optional
+from urllib.parse import urlsplit
+
+from app.config import settings
+from app.redis_client import redis_client
+from app.services import metrics
+from app.services.executors import run_io
+from app.services.task_state import get_task, update_task
+
+logger = logging.getLogger("uvicorn.error")
+
+QUEUE_KEY = "bgr:webhooks"
+
+DELIVERED = metrics.counter("bgr_webhook_delivered_total", "Webhook deliveries acknowledged with 2xx.")
+FAILED = metrics.counter("bgr_webhook_failed_total", "Webhook deliveries given up on.")
+RETRIED = metrics.counter("bgr_webhook_retried_total", "Webhook attempts scheduled for retry.")
+ATTEMPT_SECONDS = metrics.histogram("bgr_webhook_attempt_seconds", "Duration of one webhook POST.")
+
+# Status codes worth another attempt; other 4xx mean the receiver refuses the call
+RETRY_STATUS = {408, 425, 429}
+MAX_URL_LENGTH = 2048
+
+# ARGV: now, limit, claimed-until. Returns the claimed members.
+CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, member in ipairs(due) do
+  redis.call('ZADD', KEYS[1], ARGV[3], member)
+end
+return due
+"""
+_claim_script = redis_client.register_script(CLAIM_SCRIPT)
+
+
+def validate_callback_url(url: str) -> str:
+    """
+    http(s) URLs only. Unless WEBHOOK_ALLOW_PRIVATE, literal loopback,
+    private and link-local addresses are refused (names are not resolved
+    here, so this is a guard against mistakes, not DNS rebinding).
+    Raises ValueError.
+    """
+    if len(url) > MAX_URL_LENGTH:
+        raise ValueError("callback_url is too long.")
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("callback_url must be an absolute http(s) URL.")
+    if not settings.WEBHOOK_ALLOW_PRIVATE:
+        host = parts.hostname
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            address = None
+        if host == "localhost" or host.endswith(".localhost") or (
+            address is not None and not address.is_global
+        ):
+            raise ValueError("callback_url must point to a public host.")
+    return url
+
+
+def sign(body: bytes, timestamp: str) -> str:
+    digest = hmac.new(settings.WEBHOOK_SECRET.encode(), timestamp.encode() + b"." + body, hashlib.sha256)
+    return f"sha256={digest.hexdigest()}"
+
+
+def enqueue(task_id: str, url: str, payload: dict) -> None:
+    entry = json.dumps({
+        "id": str(uuid.uuid4()),
+        "task_id": task_id,
+        "url": url,
+        "payload": payload,
+        "attempts": 0,
+    })
+    redis_client.zadd(QUEUE_KEY, {entry: time.time()})
+    update_task(task_id, webhook_status="queued")
+
+
+def claim(limit: int) -> List[str]:
+    now = time.time()
+    # Held until well after the request must have finished
+    claimed_until = now + settings.WEBHOOK_TIMEOUT_SECONDS + 60
+    members = _claim_script(keys=[QUEUE_KEY], args=[now, limit, claimed_until])
+    return [m.decode() if isinstance(m, bytes) else m for m in members]
+
+
+def record_attempt(raw: str, entry: dict, outcome: dict, retry: bool) -> None:
+    """Appends the attempt to the task's log, then removes or re-schedules the entry."""
+    attempts = entry["attempts"] + 1
+    task_id = entry["task_id"]
+    delivered = outcome.get("status_code") is not None and 200 <= outcome["status_code"] < 300
+    give_up = not delivered and (not retry or attempts >= settings.WEBHOOK_MAX_ATTEMPTS)
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.zrem(QUEUE_KEY, raw)
+    if not delivered and not give_up:
+        ceiling = min(settings.WEBHOOK_RETRY_MAX_DELAY, settings.WEBHOOK_RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+        pipe.zadd(QUEUE_KEY, {json.dumps(dict(entry, attempts=attempts)): time.time() + random.uniform(ceiling / 2, ceiling)})
+    pipe.execute()
+
+    state = "delivered" if delivered else ("failed" if give_up else "retrying")
+    current = get_task(task_id, ("webhook_log",))
+    if current is None:
+        return  # task expired meanwhile
+    log = json.loads(current.get("webhook_log") or "[]")
+    log.append(dict(outcome, attempt=attempts, outcome=state))
+    update_task(
+        task_id,
+        webhook_status=state,
+        webhook_attempts=attempts,
+        webhook_log=json.dumps(log[-settings.WEBHOOK_MAX_ATTEMPTS:]),
+    )
+    if delivered:
+        DELIVERED.inc()
+    elif give_up:
+        FAILED.inc()
+        logger.error(f"Webhook for {task_id} failed after {attempts} attempt(s): {outcome.get('error') or outcome.get('status_code')}")
+    else:
+        RETRIED.inc()
+
+
+class WebhookSender:
+    """Background coroutine delivering due webhooks over one pooled HTTP client."""
+
+    def __init__(self, concurrency: int = 0):
+        self.concurrency = concurrency or settings.WEBHOOK_CONCURRENCY
+        self._stopping = asyncio.Event()
+        self._runner: "asyncio.Task | None" = None
+        self._inflight: "set[asyncio.Task]" = set()
+        self._client = None
+
+    def start(self) -> None:
+        import httpx
+
+        self._client = httpx.AsyncClient(
+            timeout=settings.WEBHOOK_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+            follow_redirects=False,
+            headers={"User-Agent": "bgr-webhooks/1", "Content-Type": "application/json"},
+        )
+        self._runner = asyncio.create_task(self.run(), name="webhook-sender")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Unfinished deliveries stay claimed and are retried once their claim lapses."""
+        self._stopping.set()
+        if self._runner is not None:
+            await self._runner
+        if self._inflight:
+            await asyncio.wait(list(self._inflight), timeout=timeout)
+        for task in list(self._inflight):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+
+    async def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                free = self.concurrency - len(self._inflight)
+                if free <= 0:
+                    await asyncio.wait(list(self._inflight), timeout=1.0, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                batch = await run_io(claim, free)
+                for raw in batch:
+                    task = asyncio.create_task(self._deliver(raw))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+                if not batch:
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), timeout=settings.WEBHOOK_POLL_SECONDS)
+                    except asyncio.TimeoutError:
+                        pass
+            except Exception as e:
+                logger.error(f"Webhook sender loop error: {str(e)}")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=2.0)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _deliver(self, raw: str) -> None:
+        import httpx
+
+        entry = json.loads(raw)
+        body = json.dumps(entry["payload"], separators=(",", ":")).encode()
+        timestamp = str(int(time.time()))
+        headers = {
+            "X-Webhook-Id": entry["id"],
+            "X-Webhook-Timestamp": timestamp,
+            "X-Webhook-Signature": sign(body, timestamp),
+        }
+        outcome: dict = {"at": round(time.time(), 3), "status_code": None, "error": None}
+        retry = True
+        started = time.perf_counter()
+        try:
+            response = await self._client.post(entry["url"], content=body, headers=headers)
+            outcome["status_code"] = response.status_code
+            retry = response.status_code in RETRY_STATUS or response.status_code >= 500
+        except (httpx.HTTPError, httpx.InvalidURL) as exc:
+            outcome["error"] = f"{type(exc).__name__}: {exc}" if str(exc) else type(exc).__name__
+            retry = not isinstance(exc, httpx.InvalidURL)
+        finally:
+            elapsed = time.perf_counter() - started
+            ATTEMPT_SECONDS.observe(elapsed)
+            outcome["ms"] = round(elapsed * 1000, 1)
+        try:
+            await run_io(record_attempt, raw, entry, outcome, retry)
+        except Exception as e:
+            # The claim lapses and the delivery is tried again
+            logger.error(f"Could not record webhook attempt for {entry['task_id']}: {str(e)}")
+
+
+def completion_payload(task_id: str, fields: dict) -> dict:
+    return {"event": "task.completed", "processing_id": task_id, "status": "completed", **fields}
+
+
+def failure_payload(task_id: str, error: Optional[str], finished_at: float) -> dict:
+    return {
+        "event": "task.failed",
+        "processing_id": task_id,
+        "status": "failed",
+        "error": error,
+        "finished_at": finished_at,
+    }
@@ -6,6 +6,7 @@ document.addEventListener("DOMContentLoaded", () => {
     const spinner = document.getElementById("status-spinner");
     const resultSection = document.getElementById("result-section");
     const resultImage = document.getElementById("result-image");
+    const resultTitle = document.getElementById("result-title");
     const downloadBtn = document.getElementById("download-btn");
     const errorAlert = document.getElementById("error-msg");
 
@@ -15,6 +16,7 @@ document.addEventListener("DOMContentLoaded", () => {
         // Reset UI
         errorAlert.classList.add("d-none");
         resultSection.classList.add("d-none");
+        resultImage.removeAttribute("src");
         spinner.classList.remove("d-none");
         statusCard.classList.remove("d-none");
 
@@ -28,20 +30,29 @@ document.addEventListener("DOMContentLoaded", () => {
             const check = setInterval(async () => {
                 const s = await fetch(`/status/${processing_id}`);
                 const js = await s.json();
+                const result = js.result || {};
 
                 if (js.status === "completed") {
                     clearInterval(check);
                     spinner.classList.add("d-none");
-                    resultImage.src = js.file_url;
+                    resultImage.src = result.file_url;
+                    resultTitle.textContent = "Done!";
+                    downloadBtn.classList.remove("d-none");
                     downloadBtn.href = `/download/${processing_id}`;
                     resultSection.classList.remove("d-none");
+                } else if (result.preview_url && !resultImage.src) {
+                    // Low-res preview while the full-quality result is rendered
+                    resultImage.src = result.preview_url;
+                    resultTitle.textContent = "Preview, full quality on the way…";
+                    downloadBtn.classList.add("d-none");
+                    resultSection.classList.remove("d-none");
                 } else if (js.status === "failed") {
                     clearInterval(check);
                     spinner.classList.add("d-none");
                     errorAlert.textContent = "Processing failed.";
                     errorAlert.classList.remove("d-none");
                 }
-            }, 4000);
+            }, 1500);
         } catch (err) {
             spinner.classList.add("d-none");
             errorAlert.textContent = err.message;
@@ -0,0 +1,228 @@
+"""
+Worker supervisor: one queue worker per model group, each pinned to its own
+cores.
+
+    WORKER_GROUPS="u2net@0-7;u2netp@8-11:2;*@12-15" python -m app.supervisor
+
+Each ";"-separated group is `models@cpus[:runs]`:
+
+- models: WORKER_MODELS of the child, i.e. model names with their own stream
+  (QUEUE_MODEL_STREAMS) and "*" for the shared stream;
+- cpus: the cores the child is pinned to (sched_setaffinity), as
+  "0-7" or "0,2,4-6";
+- runs: inferences in flight at once (INFERENCE_CONCURRENCY, default 1).
+  They share the process's one session per model (image_processor.SESSIONS)
+  and so its intra-op thread pool, which is sized to len(cpus) through
+  OMP_NUM_THREADS (rembg passes it to onnxruntime as its intra/inter-op
+  thread counts). The group's threads therefore match its cores whatever
+  the number of runs; more runs only overlap pre- and post-processing.
+
+A heavy model then never waits behind, or shares caches with, a light one,
+and each ONNX thread pool stays on the cores it was sized for. Children that
+exit are restarted with a growing delay; SIGINT/SIGTERM are passed on and
+the supervisor waits for the children to drain.
+
+Where affinity is not supported (macOS), children run unpinned.
+"""
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+from app.config import settings
+from app.services.job_queue import MODEL_STREAMS, SHARED_QUEUE
+
+logger = logging.getLogger("uvicorn.error")
+
+RESTART_BASE_DELAY = 1.0
+RESTART_MAX_DELAY = 60.0
+# A child that ran this long is considered healthy again
+RESTART_RESET_SECONDS = 300.0
+STOP_TIMEOUT_SECONDS = 30.0
+
+
+@dataclass
+class WorkerGroup:
+    models: str
+    cpus: Set[int]
+    runs: int = 1
+
+    @property
+    def threads(self) -> int:
+        """ONNX threads of the group's (shared) session per model."""
+        return len(self.cpus)
+
+    def env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.update(
+            SERVICE_ROLE="worker",
+            WORKER_MODELS=self.models,
+            INFERENCE_CONCURRENCY=str(self.runs),
+            CPU_WORKERS=str(self.runs),
+            # Threads share the one session per model, whose pool spans the group's cores
+            CPU_EXECUTOR_KIND="thread",
+            OMP_NUM_THREADS=str(self.threads),
+        )
+        return env
+
+
+def parse_cpus(spec: str) -> Set[int]:
+    cpus: Set[int] = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = (int(x) for x in part.split("-", 1))
+            if last < first:
+                raise ValueError(f"bad CPU range {part!r}")
+            cpus.update(range(first, last + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def parse_groups(spec: str) -> List[WorkerGroup]:
+    """Parses WORKER_GROUPS. Raises ValueError."""
+    groups = []
+    for raw in spec.split(";"):
+        raw = raw.strip()
+        if not raw:
+            continue
+        models, sep, rest = raw.partition("@")
+        if not sep or not models.strip():
+            raise ValueError(f"worker group {raw!r} is not models@cpus[:runs]")
+        cpu_spec, _, runs = rest.partition(":")
+        cpus = parse_cpus(cpu_spec)
+        if not cpus:
+            raise ValueError(f"worker group {raw!r} has no CPUs")
+        groups.append(WorkerGroup(models.strip(), cpus, int(runs) if runs else 1))
+    if not groups:
+        raise ValueError("WORKER_GROUPS is empty")
+    return groups
+
+
+def check_groups(groups: List[WorkerGroup]) -> None:
+    """Warns about layouts that run, but not as intended."""
+    available = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else None
+    claimed: Set[int] = set()
+    served: Set[str] = set()
+    for group in groups:
+        for model in (m.strip() for m in group.models.split(",")):
+            served.add(model)
+            if model != SHARED_QUEUE and model not in MODEL_STREAMS:
+                logger.warning(f"Group {group.models}: {model} is not in QUEUE_MODEL_STREAMS, its jobs stay on the shared stream")
+        if available is not None and not group.cpus <= available:
+            logger.warning(f"Group {group.models}: CPUs {sorted(group.cpus - available)} are not available here")
+        if group.cpus & claimed:
+            logger.warning(f"Group {group.models}: CPUs {sorted(group.cpus & claimed)} are shared with another group")
+        if group.runs > len(group.cpus):
+            logger.warning(f"Group {group.models}: {group.runs} concurrent runs on {len(group.cpus)} CPU(s)")
+        claimed |= group.cpus
+    for queue in [SHARED_QUEUE, *sorted(MODEL_STREAMS)]:
+        if queue not in served:
+            logger.warning(f"No group consumes the {queue} stream: those jobs will wait")
+
+
+class Child:
+    def __init__(self, group: WorkerGroup):
+        self.group = group
+        self.process: Optional[subprocess.Popen] = None
+        self.started = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+
+    def spawn(self) -> None:
+        cpus = self.group.cpus
+        pin = None
+        if hasattr(os, "sched_setaffinity"):
+            # Set in the child before exec, so the ONNX thread pools start pinned
+            pin = lambda: os.sched_setaffinity(0, cpus)  # noqa: E731
+        else:
+            logger.warning(f"CPU affinity is not supported here; group {self.group.models} runs unpinned")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "app.worker"], env=self.group.env(), preexec_fn=pin,
+        )
+        self.started = time.monotonic()
+        logger.info(
+            f"Worker {self.process.pid} for {self.group.models} on CPUs {format_cpus(cpus)} "
+            f"({self.group.runs} concurrent run(s), {self.group.threads} ONNX thread(s))"
+        )
+
+    def poll(self, now: float) -> None:
+        """Restarts the child with exponential backoff once it exited."""
+        if self.process is not None:
+            code = self.process.poll()
+            if code is None:
+                return
+            self.failures = 0 if now - self.started >= RESTART_RESET_SECONDS else self.failures + 1
+            delay = min(RESTART_MAX_DELAY, RESTART_BASE_DELAY * (2 ** max(0, self.failures - 1)))
+            logger.error(f"Worker {self.process.pid} for {self.group.models} exited with {code}; restarting in {delay:.0f}s")
+            self.process = None
+            self.restart_at = now + delay
+        if now >= self.restart_at:
+            self.spawn()
+
+
+def format_cpus(cpus: Set[int]) -> str:
+    ranges, ordered = [], sorted(cpus)
+    start = previous = ordered[0]
+    for cpu in ordered[1:] + [None]:
+        if cpu is not None and cpu == previous + 1:
+            previous = cpu
+            continue
+        ranges.append(str(start) if start == previous else f"{start}-{previous}")
+        if cpu is not None:
+            start = previous = cpu
+    return ",".join(ranges)
+
+
+def main() -> int:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    try:
+        groups = parse_groups(settings.WORKER_GROUPS)
+    except ValueError as e:
+        logger.error(f"Invalid WORKER_GROUPS: {str(e)}")
+        return 2
+    check_groups(groups)
+
+    stopping = []
+
+    def request_stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    children = [Child(group) for group in groups]
+    while not stopping:
+        now = time.monotonic()
+        for child in children:
+            child.poll(now)
+        time.sleep(0.5)
+
+    # 1. Pass the signal on; workers put unfinished jobs back on the queue
+    running = [c.process for c in children if c.process is not None and c.process.poll() is None]
+    for process in running:
+        process.send_signal(stopping[0])
+    # 2. Wait for them to drain, then kill the stragglers
+    deadline = time.monotonic() + STOP_TIMEOUT_SECONDS
+    for process in running:
+        try:
+            process.wait(timeout=max(0.1, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Worker {process.pid} did not stop in time; killing it")
+            process.kill()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,150 +1,359 @@
-import os
-import json
+import asyncio
+import contextlib
+import time
 import uuid
 import logging
-from fastapi import BackgroundTasks
-from .redis_client import redis_client
+from typing import Optional, Tuple
 from .models import ProcessingRequest
-from app.services.image_processor import process_image_bytes
-from app.services.storage import build_filepath
-from app.services.email_notifier import send_notification
-from app.services.s3_uploader import upload_to_s3
+from app.services.image_processor import (
+    MASK_ENCODINGS,
+    decode_stage,
+    dedup_stage,
+    encode_stage,
+    infer_stage,
+    render_preview,
+)
+from app.services.storage import (
+    ASSET_MASK,
+    ASSET_SOURCE,
+    build_asset_key,
+    build_filename,
+    build_preview_key,
+    build_result_key,
+    content_type_for,
+    get_storage,
+)
+from app.services import dedup, email_outbox, webhooks
+from app.services.executors import cpu_executor, run_codec, run_cpu, run_io
+from app.services.pipeline import Pipeline, Stage, run_inline
+from app.services.task_state import get_task, init_task, update_task
+from app.services import job_queue
+from app.services.job_queue import TransientError
+from app.services.fair_queue import lane_for
+from app.services.memory_budget import estimate_animation_bytes, estimate_job_bytes, estimate_preview_bytes
+from app.services.profiling import Trace, save_trace, should_sample
+from app.services.model_policy import POLICY
 from app.config import settings
 
 
 logger = logging.getLogger("uvicorn.error")
 
-def enqueue_image_processing(
-    bg: BackgroundTasks,
+async def enqueue_image_processing(
     request: ProcessingRequest,
-    file_bytes: bytes,
+    file_bytes: Optional[bytes],
     filename: str,
     task_id: str, 
     base_url: str,
+    client: str = "",
+    dimensions: Optional[Tuple[int, int]] = None,
+    object_key: Optional[str] = None,
+    upload_size: int = 0,
 ):
     """
-    Initiates the background worker. task_id is pre-generated by the router
-    to allow the frontend to begin polling immediately.
+    Hands the job to the durable Redis queue (app/services/job_queue.py).
+    task_id is pre-generated by the router to allow the frontend to begin
+    polling immediately; the job survives restarts of this process.
+    `dimensions` (from the image header) size the job's memory reservation.
+    Direct uploads pass `object_key` (and `upload_size`) instead of the bytes.
     """
     processing_id = task_id or str(uuid.uuid4())
-    
-    bg.add_task(
-        _background_task, 
-        processing_id, 
-        request, 
-        file_bytes, 
-        filename, 
-        base_url
+    lane = lane_for(request.priority, request.model, request.scale)
+    estimate = estimate_animation_bytes if request.animated else estimate_job_bytes
+    upload_bytes = len(file_bytes) if file_bytes is not None else upload_size
+    mem_estimate = estimate(*dimensions, request.scale, upload_bytes) if dimensions else 0
+    if dimensions and wants_preview(request):
+        mem_estimate += estimate_preview_bytes(*dimensions, request.scale)
+
+    # 1. Task state first, so a fast worker never sees a missing hash
+    await run_io(
+        init_task,
+        processing_id,
+        status="queued",
+        email=request.email,
+        model=request.model,
+        scale=request.scale,
+        lane=lane,
+        original_name=filename,
+        queued_at=f"{time.time():.3f}",
+        mem_estimate=mem_estimate,
+        callback_url=request.callback_url,
+    )
+    await run_io(
+        job_queue.enqueue,
+        processing_id,
+        file_bytes,
+        request=request.model_dump_json(),
+        filename=filename,
+        base_url=base_url,
+        client=client,
+        lane=lane,
+        queue=job_queue.queue_for(request.model),
+        enqueued_at=time.time(),
+        mem_estimate=mem_estimate,
+        object_key=object_key,
+        storage=get_storage().name if object_key else None,
     )
     return processing_id
 
 
-def _background_task(
+async def _store_stage(job: dict) -> dict:
+    """
+    Last pipeline stage: persists the encoded output (and the render assets)
+    through the configured storage backend and resolves its public URL.
+    """
+    processing_id, ext = job["task_id"], job["ext"]
+    data = job.pop("encoded")
+    source, mask_png = job.pop("source", None), job.pop("mask_png", None)
+    storage = get_storage()
+
+    try:
+        key = build_result_key(processing_id, ext)
+        writes = [storage.put(key, data, content_type_for(ext))]
+        if source is not None and mask_png is not None:
+            writes.append(storage.put(build_asset_key(processing_id, ASSET_SOURCE), source, "application/octet-stream"))
+            writes.append(storage.put(build_asset_key(processing_id, ASSET_MASK), mask_png, "image/png"))
+            job["assets"] = storage.name
+        # The three objects are independent: write them concurrently
+        await asyncio.gather(*writes)
+        # Local results are served from the shared volume by any web replica,
+        # S3 results through a presigned URL
+        public_url = await storage.presign(key, job["base_url"])
+    except Exception as e:
+        logger.error(f"Storing {processing_id} in {storage.name} storage failed: {str(e)}")
+        raise TransientError(f"{storage.name} storage write failed") from e
+
+    job.update({
+        "filename": build_filename(processing_id, ext),
+        "file_url": public_url,
+        "storage": storage.name,
+    })
+    return job
+
+
+# Decode and encode run on the codec pool, the near-duplicate lookup on the I/O
+# pool, inference on the CPU pool and the store step on the storage backend's own pool; bounded queues between them keep inference fed
+# while earlier jobs are still being encoded or uploaded.
+PIPELINE = Pipeline(
+    [
+        Stage("decode", decode_stage, run_codec, settings.DECODE_CONCURRENCY),
+        Stage("dedup", dedup_stage, run_io, settings.DEDUP_CONCURRENCY),
+        Stage("inference", infer_stage, run_cpu, settings.INFERENCE_CONCURRENCY),
+        Stage("encode", encode_stage, run_codec, settings.ENCODE_CONCURRENCY),
+        Stage("store", _store_stage, run_inline, settings.STORE_CONCURRENCY),
+    ],
+    queue_size=settings.PIPELINE_QUEUE_SIZE,
+)
+
+
+def result_extension(request: ProcessingRequest) -> str:
+    """File extension of the result: the output format, or the mask encoding's."""
+    if request.output_format == "mask":
+        return MASK_ENCODINGS[request.mask_encoding]
+    return request.output_format.lower().strip(".")
+
+
+def wants_preview(request: ProcessingRequest) -> bool:
+    """
+    Still-image cut-outs only, and only when the full result is slower than
+    the preview would be (not already on PREVIEW_MODEL). PREVIEW_ENABLED is
+    off by default.
+    """
+    return (
+        settings.PREVIEW_ENABLED
+        and not request.animated
+        and request.output_format != "mask"
+        and request.model != settings.PREVIEW_MODEL
+    )
+
+
+def preview_fits_here() -> bool:
+    """
+    Worker-side conditions for starting a preview now: a free CPU slot, so
+    it never queues ahead of full-quality inference, and a worker that
+    serves PREVIEW_MODEL anyway, so dedicated workers load no extra session.
+    """
+    models = {m.strip() for m in settings.WORKER_MODELS.split(",") if m.strip()}
+    serves_model = not models or job_queue.SHARED_QUEUE in models or settings.PREVIEW_MODEL in models
+    return serves_model and cpu_executor.free > 0
+
+
+async def _publish_preview(
+    processing_id: str,
+    request: ProcessingRequest,
+    file_bytes: bytes,
+    base_url: str,
+    trace: Trace,
+) -> None:
+    """
+    Renders, stores and records the preview (preview_url). Runs beside the
+    full job, outside the pipeline; failures only cost the preview.
+    """
+    try:
+        with trace.span("preview"):
+            data = await run_cpu(render_preview, file_bytes, request.scale)
+            storage = get_storage()
+            key = build_preview_key(processing_id)
+            await storage.put(key, data, content_type_for("webp"))
+            preview_url = await storage.presign(key, base_url)
+            await run_io(
+                update_task,
+                processing_id,
+                preview_url=preview_url,
+                preview_storage=storage.name,
+                preview_at=f"{time.time():.3f}",
+            )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning(f"Could not publish the preview of {processing_id}: {str(e)}")
+
+
+# Pipeline outputs copied onto the task hash
+RESULT_FIELDS = (
+    "filename", "file_url", "storage", "etag", "size", "assets", "dedup_of", "frames", "keyframes", "duration_ms",
+)
+
+
+async def process_job(
     processing_id: str, 
     request: ProcessingRequest, 
     file_bytes: bytes, 
-    filename: str, 
-    base_url: str
+    base_url: str,
+    attempt: int = 0,
 ):
     """
-    The core AI worker. Handles image processing, local/cloud storage, 
-    and direct URL generation for frontend previews.
+    The core AI worker, called by the queue worker for each delivered job.
+    Handles image processing, local/cloud storage, and direct URL generation
+    for frontend previews.
+
+    Runs on the event loop but never blocks it: the job is handed to the
+    staged PIPELINE (decode -> dedup -> inference -> encode -> store) and Redis writes
+    go to the I/O executor. Errors propagate so the queue can decide between
+    a retry and a final failure (see fail_task).
+
+    Every attempt leaves a span trace (and, for sampled jobs, a profile) for
+    GET /admin/traces/<id>.
     """
+    trace = Trace(processing_id, profile=should_sample())
+    try:
+        await _run_job(processing_id, request, file_bytes, base_url, attempt, trace)
+    finally:
+        try:
+            await run_io(save_trace, trace)
+        except Exception as e:
+            logger.warning(f"Could not store the trace of {processing_id}: {str(e)}")
+
+
+async def _run_job(
+    processing_id: str,
+    request: ProcessingRequest,
+    file_bytes: bytes,
+    base_url: str,
+    attempt: int,
+    trace: Trace,
+):
     public_url = None
-    
-    # 1. Initialize Task State in Redis
-    state = {
-        "status": "processing", 
-        "email": request.email,
-        "model": request.model,
-        "original_name": filename,
-        "error": None
-    }
-    redis_client.setex(
-        str(processing_id), 
-        settings.REDIS_TTL_SECONDS, 
-        json.dumps(state)
-    )
 
-    try:
-        # 2. Execute AI Background Removal
-        # Uses the U2-Net session manager defined in image_processor.py
-        result_img = process_image_bytes(file_bytes, request.model, request.scale)
-
-        # 3. Handle File Format Logic
-        ext = request.output_format.lower().strip(".")
-        filepath = build_filepath(processing_id, ext)
-        save_kwargs = {}
-        
-        if ext in ("jpg", "jpeg"):
-            # Ensure transparency is flattened to a solid color (white) for JPEGs
-            if result_img.mode in ("RGBA", "LA"):
-                result_img = result_img.convert("RGB")
-            save_kwargs["quality"] = request.quality
-            save_kwargs["optimize"] = True
-        elif ext == "webp":
-            save_kwargs["quality"] = request.quality
-            save_kwargs["lossless"] = False if request.quality < 100 else True
-
-        # 4. Storage and URL Generation
-        if settings.ENV == "production" and settings.AWS_USE_S3:
-            # --- S3 Cloud Path ---
-            s3_filename = f"processed/{processing_id}.{ext}"
-            try:
-                public_url = upload_to_s3(result_img, s3_filename, ext, save_kwargs)
-                state.update({
-                    "status": "completed",
-                    "file_url": public_url,
-                    "storage": "s3"
-                })
-            except Exception as e:
-                logger.error(f"S3 Upload failed for {processing_id}: {str(e)}")
-                raise RuntimeError(f"S3 upload failed")
-        else:
-            # --- Local Storage Path ---
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            result_img.save(filepath, **save_kwargs)
-            
-            # MODERN UPDATE: Generate a direct static URL for the frontend preview.
-            # base_url is typically 'http://localhost:8000'
-            # /processed_images/ is the static mount we added to main.py
-            clean_host = base_url.rstrip("/")
-            public_url = f"{clean_host}/processed_images/{processing_id}.{ext}"
-            
-            state.update({
-                "status": "completed",
-                "filename": f"{processing_id}.{ext}",
-                "file_url": public_url,
-                "storage": "local"
-            })
-
-        # 5. Finalize Redis State
-        redis_client.setex(
-            str(processing_id), 
-            settings.REDIS_TTL_SECONDS, 
-            json.dumps(state)
+    # 1. Mark the task as picked up
+    with trace.span("redis:processing"):
+        await run_io(
+            update_task, processing_id, status="processing", attempts=attempt + 1, started_at=f"{time.time():.3f}"
         )
 
-        # 6. Optional Email Notification
+    # 2. Fast preview first, in parallel, only on an idle CPU slot: it runs
+    # while the full job is still being decoded, and is dropped if the full
+    # result wins
+    preview = None
+    if wants_preview(request) and preview_fits_here():
+        preview = asyncio.create_task(_publish_preview(processing_id, request, file_bytes, base_url, trace))
+
+    # 3. Execute AI Background Removal, encoding and storage
+    # Uses the U2-Net session manager defined in image_processor.py
+    try:
+        result = await PIPELINE.submit({
+            "task_id": processing_id,
+            "data": file_bytes,
+            "model": request.model,
+            "scale": request.scale,
+            "ext": result_extension(request),
+            "mask_encoding": request.mask_encoding if request.output_format == "mask" else None,
+            "quality": request.quality,
+            "base_url": base_url,
+            "animated": request.animated,
+            # /render derivatives and dedup work on still images only
+            "keep_assets": settings.KEEP_RENDER_ASSETS and not request.animated,
+        }, trace=trace)
+    finally:
+        if preview is not None:
+            preview.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await preview
+    public_url = result.get("file_url")
+    if result.get("inference_seconds") is not None:
+        POLICY.observe(request.model, result["inference_seconds"])
+
+    # 4. Finalize Redis State (only the fields that changed)
+    finished_at = time.time()
+    with trace.span("redis:completed"):
+        await run_io(
+            update_task,
+            processing_id,
+            status="completed",
+            finished_at=f"{finished_at:.3f}",
+            content_type=content_type_for(result["ext"]),
+            **{k: result[k] for k in RESULT_FIELDS if k in result},
+        )
+    # Only tasks whose mask is stored can serve later near-duplicates
+    if result.get("assets") and result.get("signature") is not None:
         try:
-            if public_url is not None:
-                email_ok = False # send_notification(request.email, public_url)
-                if not email_ok:
-                    logger.warning(f"Notification failed for {request.email}")
-                    state["email_status"] = "failed"
-                    redis_client.setex(str(processing_id), settings.REDIS_TTL_SECONDS, json.dumps(state))
+            with trace.span("redis:dedup_index"):
+                await run_io(dedup.register, processing_id, request.model, result["signature"])
         except Exception as e:
-            logger.error(f"Notification service error: {str(e)}")
-
-    except Exception as exc:
-        # 7. Comprehensive Error Catching
-        logger.error(f"Task {processing_id} encountered a fatal error: {str(exc)}")
-        state.update({
-            "status": "failed", 
-            "error": "The AI model encountered an issue processing this image format."
+            logger.warning(f"Could not index {processing_id} for duplicate detection: {str(e)}")
+
+    # 5. Email notification goes through the outbox; SMTP never blocks the job
+    try:
+        if public_url is not None:
+            with trace.span("redis:email_outbox"):
+                await run_io(email_outbox.enqueue, processing_id, request.email, public_url)
+    except Exception as e:
+        logger.error(f"Could not queue notification for {processing_id}: {str(e)}")
+        await run_io(update_task, processing_id, email_status="failed")
+
+    # 6. Webhook, delivered by the WebhookSender
+    if request.callback_url:
+        payload = webhooks.completion_payload(processing_id, {
+            "file_url": public_url,
+            "filename": result.get("filename"),
+            "content_type": content_type_for(result["ext"]),
+            "size": result.get("size"),
+            "etag": result.get("etag"),
+            "model": request.model,
+            "finished_at": round(finished_at, 3),
         })
-        redis_client.setex(
-            str(processing_id), 
-            settings.REDIS_TTL_SECONDS, 
-            json.dumps(state)
-        )
\ No newline at end of file
+        try:
+            with trace.span("redis:webhook"):
+                await run_io(webhooks.enqueue, processing_id, request.callback_url, payload)
+        except Exception as e:
+            logger.error(f"Could not queue the webhook for {processing_id}: {str(e)}")
+            await run_io(update_task, processing_id, webhook_status="failed")
+
+
+async def fail_task(processing_id: str, error: Optional[str] = None) -> None:
+    """Final failure: no more attempts will be made. `error` is shown to the user."""
+    finished_at = time.time()
+    error = error or "The AI model encountered an issue processing this image format."
+    await run_io(
+        update_task,
+        processing_id,
+        status="failed",
+        finished_at=f"{finished_at:.3f}",
+        error=error,
+    )
+    try:
+        task = await run_io(get_task, processing_id, ("callback_url",))
+        if task and task.get("callback_url"):
+            payload = webhooks.failure_payload(processing_id, error, round(finished_at, 3))
+            await run_io(webhooks.enqueue, processing_id, task["callback_url"], payload)
+    except Exception as e:
+        logger.error(f"Could not queue the failure webhook for {processing_id}: {str(e)}")
@@ -0,0 +1,233 @@
+"""
+Queue worker: pulls jobs from the durable Redis stream and runs them through
+the processing pipeline.
+
+It runs inside the API process (QUEUE_WORKER_ENABLED=true, started from the
+lifespan in app/main.py) or standalone:
+
+    python -m app.worker
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from typing import Dict, Optional
+
+from app.config import settings
+from app.models import ProcessingRequest
+from app.services import job_queue
+from app.services.email_outbox import EmailSender
+from app.services.webhooks import WebhookSender
+from app.services.executors import run_io, shutdown_executors
+from app.services.storage import get_storage, shutdown_storage
+from app.services.fair_queue import SCHEDULER, job_cost, lane_for
+from app.services.job_queue import RETRYABLE, Job
+from app.services.scheduler import start_scheduler
+from app.services.memory_budget import DEFERRED, MEMORY
+from app.services.model_policy import AUTO_MODEL, POLICY
+from app.services.animation import AnimationTooLong
+from app.services.task_state import update_task
+from app.tasks import PIPELINE, fail_task, process_job
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class QueueWorker:
+    """
+    Holds up to QUEUE_WORKER_CONCURRENCY jobs, of which the fair scheduler
+    admits SCHEDULER_SLOTS into the pipeline at a time. Heartbeats all held
+    jobs, and periodically promotes due retries and reaps jobs abandoned by
+    dead workers.
+    """
+
+    def __init__(self, consumer: str = "", concurrency: int = 0, models: Optional[str] = None):
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.concurrency = concurrency or settings.QUEUE_WORKER_CONCURRENCY
+        # WORKER_MODELS: dedicated workers read only their models' streams
+        self.streams = job_queue.worker_streams(settings.WORKER_MODELS if models is None else models)
+        self._inflight: Dict[asyncio.Task, Job] = {}
+        # Undelivered jobs per stream, refreshed by the maintenance step (model=auto)
+        self._backlog: Dict[str, int] = {}
+        self._stopping = asyncio.Event()
+        self._runner: "asyncio.Task | None" = None
+
+    def start(self) -> None:
+        self._runner = asyncio.create_task(self.run(), name=f"queue-worker:{self.consumer}")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Stops consuming, gives in-flight jobs `timeout` seconds to finish and
+        puts the rest back on the queue for the next worker.
+        """
+        self._stopping.set()
+        if self._runner is not None:
+            await self._runner
+        if self._inflight:
+            await asyncio.wait(list(self._inflight), timeout=timeout)
+        for task, job in list(self._inflight.items()):
+            task.cancel()
+            try:
+                await run_io(job_queue.requeue, job)
+                logger.info(f"Re-queued interrupted job {job.task_id}")
+            except Exception as e:
+                logger.error(f"Could not re-queue {job.task_id} (reaper will): {str(e)}")
+
+    async def run(self) -> None:
+        logger.info(
+            f"Queue worker {self.consumer} started (concurrency={self.concurrency}, streams={','.join(self.streams)})."
+        )
+        last_maintenance = last_heartbeat = 0.0
+        heartbeat_every = settings.QUEUE_VISIBILITY_TIMEOUT_MS / 3000
+
+        while not self._stopping.is_set():
+            try:
+                now = time.monotonic()
+                # 1. Retries whose backoff elapsed + jobs orphaned by crashed workers
+                if now - last_maintenance >= settings.QUEUE_REAP_INTERVAL_SECONDS:
+                    await run_io(job_queue.ensure_group, self.streams)
+                    await run_io(job_queue.promote_delayed)
+                    await run_io(job_queue.reap, self.consumer, streams=self.streams)
+                    self._backlog = await run_io(job_queue.backlog, self.streams)
+                    last_maintenance = now
+
+                # 2. Keep our own in-flight entries visible as alive
+                if self._inflight and now - last_heartbeat >= heartbeat_every:
+                    await run_io(job_queue.heartbeat, self.consumer, list(self._inflight.values()))
+                    last_heartbeat = now
+
+                # 3. Near the RSS limit: leave new jobs in the stream for other workers
+                if MEMORY.under_pressure():
+                    DEFERRED.inc()
+                    await asyncio.sleep(1.0)
+                    continue
+
+                # 4. Fill free slots
+                free = self.concurrency - len(self._inflight)
+                if free <= 0:
+                    await asyncio.wait(list(self._inflight), timeout=1.0, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                jobs = await run_io(job_queue.consume, self.consumer, free, settings.QUEUE_BLOCK_MS, self.streams)
+                for job in jobs:
+                    task = asyncio.create_task(self._handle(job))
+                    self._inflight[task] = job
+                    task.add_done_callback(self._inflight.pop)
+            except Exception as e:
+                # Redis down or similar: back off instead of spinning
+                logger.error(f"Queue worker loop error: {str(e)}")
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=2.0)
+                except asyncio.TimeoutError:
+                    pass
+
+        logger.info(f"Queue worker {self.consumer} stopped consuming.")
+
+    async def _handle(self, job: Job) -> None:
+        try:
+            request = ProcessingRequest.model_validate_json(job.fields["request"])
+            lane = job.fields.get("lane")
+            if request.model == AUTO_MODEL:
+                request = await self._choose_model(job, request)
+                # Stored as "auto" at enqueue (bulk); lane by the model chosen now
+                lane = None
+            lane = lane or lane_for(request.priority, request.model, request.scale)
+            # Wait for a fairly scheduled pipeline slot; the payload is only loaded once admitted
+            async with SCHEDULER.slot(
+                lane,
+                job.fields.get("client", ""),
+                request.model,
+                job_cost(request.model, request.scale),
+                float(job.fields.get("enqueued_at") or 0) or None,
+            ), MEMORY.reserve(int(job.fields.get("mem_estimate") or 0)) as reservation:
+                # Memory is reserved after fair admission, so the scheduler's order holds
+                payload = await run_io(job.payload)
+                if payload is None:
+                    await run_io(job_queue.dead_letter, job, "upload payload expired")
+                    await fail_task(job.task_id)
+                    return
+                await process_job(job.task_id, request, payload, job.fields.get("base_url", ""), job.attempts)
+            await self._record_memory(job, reservation)
+        except asyncio.CancelledError:
+            raise
+        except RETRYABLE as exc:
+            if await run_io(job_queue.retry, job, str(exc)):
+                await run_io(update_task, job.task_id, status="queued")
+            else:
+                await fail_task(job.task_id)
+        except Exception as exc:
+            # Bad input or a bug: retrying would fail the same way
+            logger.error(f"Task {job.task_id} encountered a fatal error: {str(exc)}")
+            await run_io(job_queue.dead_letter, job, str(exc))
+            await fail_task(job.task_id, str(exc) if isinstance(exc, AnimationTooLong) else None)
+        else:
+            await run_io(job_queue.ack, job)
+            await self._drop_staged_upload(job)
+
+    async def _choose_model(self, job: Job, request: ProcessingRequest) -> ProcessingRequest:
+        """
+        model=auto: decided per attempt. The queue in front of it is what this
+        worker already holds plus the stream's undelivered backlog; the latter
+        keeps growing under load even once every slot here is taken. The job
+        is laned and costed as the chosen model.
+        """
+        enqueued_at = float(job.fields.get("enqueued_at") or 0)
+        waited = max(0.0, time.time() - enqueued_at) if enqueued_at else 0.0
+        queued = max(0, len(self._inflight) - 1) + self._backlog.get(job.stream, 0)
+        choice = POLICY.choose(queued, waited)
+        lane = lane_for(request.priority, choice.model, request.scale)
+        await run_io(update_task, job.task_id, model=choice.model, model_reason=choice.reason, lane=lane)
+        return request.model_copy(update={"model": choice.model})
+
+    async def _drop_staged_upload(self, job: Job) -> None:
+        """A direct upload is no longer needed once its job succeeded (failed ones stay until cleanup)."""
+        object_key = job.fields.get("object_key")
+        if not object_key:
+            return
+        try:
+            await get_storage(job.fields.get("storage")).delete(object_key)
+        except Exception as e:
+            logger.warning(f"Could not delete staged upload {object_key}: {str(e)}")
+
+    async def _record_memory(self, job: Job, reservation) -> None:
+        """Estimated vs observed memory on the task, for tuning the estimate."""
+        try:
+            await run_io(update_task, job.task_id, **reservation.fields())
+        except Exception as e:
+            logger.warning(f"Could not record memory usage of {job.task_id}: {str(e)}")
+
+
+async def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    worker = QueueWorker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker._stopping.set)
+
+    email_sender = EmailSender() if settings.EMAIL_SENDER_ENABLED else None
+    if email_sender is not None:
+        email_sender.start()
+    webhook_sender = WebhookSender() if settings.WEBHOOK_SENDER_ENABLED else None
+    if webhook_sender is not None:
+        webhook_sender.start()
+    # Cluster-wide cleanup is Redis-locked, so worker-only deployments run it too
+    scheduler = start_scheduler()
+
+    await worker.run()
+    await worker.stop()
+    scheduler.shutdown(wait=False)
+    if email_sender is not None:
+        await email_sender.stop()
+    if webhook_sender is not None:
+        await webhook_sender.stop()
+    await PIPELINE.stop()
+    shutdown_executors(wait=True)
+    shutdown_storage()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""
+Fairness check for the admission scheduler (app.services.fair_queue).
+
+Replays a mixed workload against simulated inference (sleep proportional to
+job cost) twice: plain FIFO admission vs. the fair scheduler. One "heavy"
+client submits a batch of scale=2.0 u2net jobs first; a few "light" clients
+then submit u2netp previews. Prints queue wait per lane and per client.
+
+Usage:
+    python scripts/bench_fairness.py --heavy-jobs 24 --light-clients 3 --unit-ms 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import settings  # noqa: E402
+from app.services.fair_queue import FairScheduler, job_cost, lane_for, parse_map  # noqa: E402
+
+
+class FifoAdmission:
+    """Baseline: first come, first served."""
+
+    def __init__(self, slots: int):
+        self._sem = asyncio.Semaphore(slots)
+
+    def slot(self, *args, **kwargs):
+        return self._sem
+
+
+def workload(heavy_jobs: int, light_clients: int, light_jobs: int) -> list:
+    jobs = [("heavy", "u2net", 2.0, 0.0) for _ in range(heavy_jobs)]
+    for c in range(light_clients):
+        jobs += [(f"light-{c}", "u2netp", 1.0, 0.05) for _ in range(light_jobs)]
+    return jobs
+
+
+async def replay(admission, jobs: list, unit_ms: float) -> dict:
+    waits = defaultdict(list)
+    start = time.perf_counter()
+
+    async def one(client: str, model: str, scale: float, delay: float) -> None:
+        await asyncio.sleep(delay)
+        lane = lane_for("auto", model, scale)
+        cost = job_cost(model, scale)
+        submitted = time.perf_counter()
+        async with admission.slot(lane, client, model, cost):
+            waits[(lane, client)].append(time.perf_counter() - submitted)
+            await asyncio.sleep(cost * unit_ms / 1000)
+
+    await asyncio.gather(*(one(*job) for job in jobs))
+    waits["_wall"] = [time.perf_counter() - start]
+    return waits
+
+
+def report(name: str, waits: dict) -> None:
+    print(f"\n{name} (wall {waits.pop('_wall')[0]:.2f}s)")
+    by_lane = defaultdict(list)
+    for (lane, client), values in sorted(waits.items()):
+        by_lane[lane] += values
+        print(f"  {lane:<12} {client:<10} n={len(values):<3} mean wait {statistics.mean(values) * 1000:7.0f}ms")
+    for lane, values in by_lane.items():
+        ordered = sorted(values)
+        p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+        print(f"  lane {lane:<12} p50 {statistics.median(ordered) * 1000:7.0f}ms   p95 {p95 * 1000:7.0f}ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--heavy-jobs", type=int, default=24)
+    parser.add_argument("--light-clients", type=int, default=3)
+    parser.add_argument("--light-jobs", type=int, default=4)
+    parser.add_argument("--slots", type=int, default=settings.SCHEDULER_SLOTS)
+    parser.add_argument("--unit-ms", type=float, default=10.0, help="Simulated inference time per cost unit")
+    args = parser.parse_args()
+
+    jobs = workload(args.heavy_jobs, args.light_clients, args.light_jobs)
+    print(f"{len(jobs)} jobs, {args.slots} slots, lane weights {settings.LANE_WEIGHTS}")
+
+    report("FIFO", asyncio.run(replay(FifoAdmission(args.slots), jobs, args.unit_ms)))
+    fair = FairScheduler(
+        args.slots,
+        parse_map(settings.LANE_WEIGHTS),
+        parse_map(settings.MODEL_CONCURRENCY),
+        settings.SCHEDULER_QUANTUM,
+    )
+    report("fair scheduler", asyncio.run(replay(fair, jobs, args.unit_ms)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Throughput benchmark: staged pipeline vs. the serial per-job path.
+
+Serial   : each job runs decode+inference+encode in one CPU-pool call, then stores.
+Pipeline : decode / inference / encode / store stages with bounded queues
+           (app.services.pipeline), as used by app.tasks.PIPELINE.
+
+By default the real rembg model is used when it is installed. Pass --simulate
+to replace inference with a GIL-releasing sleep of --infer-ms (useful on
+machines without the models); storage is always simulated with --store-ms.
+
+Usage:
+    python scripts/bench_pipeline.py --jobs 32 --size 1280x960
+    python scripts/bench_pipeline.py --simulate --infer-ms 120 --store-ms 80
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.services import image_processor  # noqa: E402
+from app.services.executors import run_codec, run_cpu, run_io, shutdown_executors  # noqa: E402
+from app.services.pipeline import Pipeline, Stage  # noqa: E402
+
+
+def make_upload(width: int, height: int, seed: int) -> bytes:
+    rng = np.random.default_rng(seed)
+    # Smooth gradient plus noise: compresses like a photo rather than pure noise
+    base = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    arr = base + rng.normal(0, 25, (height, width, 3))
+    buf = BytesIO()
+    Image.fromarray(arr.clip(0, 255).astype(np.uint8)).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def simulated_store(data: bytes, store_ms: float) -> None:
+    time.sleep(store_ms / 1000)
+
+
+def store_stage(job: dict) -> dict:
+    simulated_store(job.pop("encoded"), job["store_ms"])
+    return job
+
+
+def serial_job(job: dict) -> bytes:
+    return image_processor.render_image(job["data"], job["model"], job["scale"], job["ext"], job["quality"])
+
+
+async def run_serial(jobs: list) -> list:
+    async def one(job: dict) -> float:
+        started = time.perf_counter()
+        encoded = await run_cpu(serial_job, job)
+        await run_io(simulated_store, encoded, job["store_ms"])
+        return time.perf_counter() - started
+
+    return await asyncio.gather(*(one(dict(j)) for j in jobs))
+
+
+async def run_pipeline(jobs: list) -> list:
+    pipeline = Pipeline(
+        [
+            Stage("decode", image_processor.decode_stage, run_codec, settings.DECODE_CONCURRENCY),
+            Stage("inference", image_processor.infer_stage, run_cpu, settings.INFERENCE_CONCURRENCY),
+            Stage("encode", image_processor.encode_stage, run_codec, settings.ENCODE_CONCURRENCY),
+            Stage("store", store_stage, run_io, settings.STORE_CONCURRENCY),
+        ],
+        queue_size=settings.PIPELINE_QUEUE_SIZE,
+    )
+
+    async def one(job: dict) -> float:
+        started = time.perf_counter()
+        await pipeline.submit(job)
+        return time.perf_counter() - started
+
+    try:
+        return await asyncio.gather(*(one(dict(j)) for j in jobs))
+    finally:
+        await pipeline.stop()
+
+
+def report(name: str, latencies: list, wall: float) -> float:
+    ordered = sorted(latencies)
+    p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+    throughput = len(latencies) / wall
+    print(
+        f"{name:<9} {throughput:7.2f} jobs/s   wall {wall:6.2f}s   "
+        f"p50 {statistics.median(ordered) * 1000:7.0f}ms   p95 {p95 * 1000:7.0f}ms"
+    )
+    return throughput
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=24)
+    parser.add_argument("--size", default="1280x960", help="WIDTHxHEIGHT of the synthetic uploads")
+    parser.add_argument("--model", default=settings.DEFAULT_MODEL)
+    parser.add_argument("--ext", default="png")
+    parser.add_argument("--simulate", action="store_true", help="Replace inference with a sleep")
+    parser.add_argument("--infer-ms", type=float, default=150.0)
+    parser.add_argument("--store-ms", type=float, default=60.0)
+    args = parser.parse_args()
+
+    if args.simulate:
+        if settings.CPU_EXECUTOR_KIND != "thread":
+            parser.error("--simulate patches inference in-process and needs CPU_EXECUTOR_KIND=thread")
+
+        def fake_predict(image: Image.Image, model_name: str) -> Image.Image:
+            time.sleep(args.infer_ms / 1000)
+            return Image.new("L", image.size, 255)
+
+        image_processor.predict_mask = fake_predict
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    jobs = [
+        {
+            "task_id": f"bench-{i}",
+            "data": make_upload(width, height, i),
+            "model": args.model.strip(),
+            "scale": 1.0,
+            "ext": args.ext,
+            "quality": 95,
+            "base_url": "http://localhost:8000/",
+            "store_ms": args.store_ms,
+        }
+        for i in range(args.jobs)
+    ]
+
+    print(
+        f"{args.jobs} jobs of {width}x{height}, ext={args.ext}, "
+        f"{'simulated' if args.simulate else 'real'} inference, "
+        f"cpu={settings.CPU_WORKERS} codec={settings.CODEC_WORKERS} io={settings.IO_WORKERS}"
+    )
+
+    # Warm-up (model load, pools) so neither variant pays one-off costs
+    asyncio.run(run_serial(jobs[:1]))
+
+    started = time.perf_counter()
+    serial = asyncio.run(run_serial(jobs))
+    serial_tp = report("serial", serial, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    piped = asyncio.run(run_pipeline(jobs))
+    piped_tp = report("pipeline", piped, time.perf_counter() - started)
+
+    print(f"speed-up  {piped_tp / serial_tp:5.2f}x")
+    shutdown_executors()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Redis cost per task: legacy JSON blobs vs. hash-based task state.
+
+Replays one task lifecycle (create -> completed -> email status) plus a number
+of status polls and one download lookup against an in-memory Redis
+(fakeredis), counting commands, network round trips and response bytes.
+
+Usage:
+    pip install fakeredis
+    python scripts/bench_redis_ops.py --polls 10
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.services import task_state  # noqa: E402
+
+
+class CountingRedis(fakeredis.FakeRedis):
+    """Counts commands, round trips and reply payload size."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.commands = 0
+        self.round_trips = 0
+        self.reply_bytes = 0
+
+    def _count_reply(self, reply) -> None:
+        if isinstance(reply, (bytes, str)):
+            self.reply_bytes += len(reply)
+        elif isinstance(reply, (list, tuple)):
+            for item in reply:
+                self._count_reply(item)
+
+    def execute_command(self, *args, **options):
+        self.commands += 1
+        self.round_trips += 1
+        reply = super().execute_command(*args, **options)
+        self._count_reply(reply)
+        return reply
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super().pipeline(transaction=transaction, shard_hint=shard_hint)
+        original_execute = pipe.execute
+
+        def execute(*args, **kwargs):
+            self.commands += len(pipe.command_stack) + (2 if transaction else 0)  # MULTI/EXEC
+            self.round_trips += 1
+            reply = original_execute(*args, **kwargs)
+            self._count_reply(reply)
+            return reply
+
+        pipe.execute = execute
+        return pipe
+
+
+STATE = {
+    "status": "processing",
+    "email": "someone@example.com",
+    "model": "u2net",
+    "original_name": "holiday-photo-from-my-phone.jpg",
+    "error": None,
+}
+RESULT = {
+    "filename": "3fa85f64-5717-4562-b3fc-2c963f66afa6.png",
+    "file_url": "http://localhost:8000/processed_images/3fa85f64-5717-4562-b3fc-2c963f66afa6.png",
+    "storage": "local",
+}
+
+
+def legacy_lifecycle(r: CountingRedis, task_id: str, polls: int) -> None:
+    state = dict(STATE)
+    r.setex(task_id, settings.REDIS_TTL_SECONDS, json.dumps(state))
+    for _ in range(polls):
+        json.loads(r.get(task_id))
+    state.update(status="completed", **RESULT)
+    r.setex(task_id, settings.REDIS_TTL_SECONDS, json.dumps(state))
+    state["email_status"] = "failed"
+    r.setex(task_id, settings.REDIS_TTL_SECONDS, json.dumps(state))
+    json.loads(r.get(task_id))  # status poll that sees "completed"
+    json.loads(r.get(task_id))  # download lookup
+
+
+def hash_lifecycle(r: CountingRedis, task_id: str, polls: int) -> None:
+    task_state.init_task(task_id, **STATE)
+    status_fields = ("model", "email_status", "file_url", "filename", "storage", "s3", "error")
+    for _ in range(polls):
+        task_state.get_task(task_id, status_fields)
+    task_state.update_task(task_id, status="completed", **RESULT)
+    task_state.update_task(task_id, email_status="failed")
+    task_state.get_task(task_id, status_fields)
+    task_state.get_task(task_id, ("error", "filename", "storage", "s3"))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--polls", type=int, default=10, help="Status polls while processing")
+    args = parser.parse_args()
+
+    r = CountingRedis()
+    task_state.redis_client = r
+
+    print(f"One task, {args.polls} polls while processing + 1 final poll + 1 download\n")
+    print(f"{'layout':<8} {'commands':>9} {'round trips':>12} {'reply bytes':>12}")
+    for name, lifecycle in (("json", legacy_lifecycle), ("hash", hash_lifecycle)):
+        r.flushall()
+        r.reset_counters()
+        lifecycle(r, "3fa85f64-5717-4562-b3fc-2c963f66afa6", args.polls)
+        print(f"{name:<8} {r.commands:>9} {r.round_trips:>12} {r.reply_bytes:>12}")
+
+    # Compat path: a JSON entry left behind by an older release is read and migrated once
+    r.flushall()
+    r.setex("legacy", 60, json.dumps(dict(STATE, status="completed", **RESULT)))
+    r.reset_counters()
+    migrated = task_state.get_task("legacy", ("file_url",))
+    print(f"\nlegacy entry read via compat path: status={migrated['status']}, "
+          f"{r.round_trips} round trips once, then {r.type('legacy').decode()} reads")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
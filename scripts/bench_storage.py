@@ -0,0 +1,129 @@
+"""
+Storage backend throughput: put / get / presign / delete at a given concurrency.
+The second presign line (presign*) repeats the keys to show the presign cache.
+
+Runs against the configured STORAGE_BACKEND (local directories, AWS, or an
+S3-compatible endpoint via AWS_S3_ENDPOINT_URL), or against a throwaway
+in-process S3 stand-in with --moto. Use it to size STORAGE_*_CONCURRENCY.
+
+Usage:
+    python scripts/bench_storage.py --backend local --objects 500 --concurrency 8
+    pip install "moto[server]"
+    python scripts/bench_storage.py --moto --objects 200 --concurrency 1 4 16 --stream-mb 64
+    AWS_S3_ENDPOINT_URL=http://localhost:9000 STORAGE_BACKEND=s3 python scripts/bench_storage.py
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def start_moto() -> None:
+    """In-process S3 server; settings are read from the environment on import."""
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # one access-log line per request otherwise
+    server = ThreadedMotoServer(port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    os.environ.update(
+        STORAGE_BACKEND="s3",
+        AWS_S3_ENDPOINT_URL=f"http://{host}:{port}",
+        AWS_S3_BUCKET="bench",
+        AWS_ACCESS_KEY="bench",
+        AWS_SECRET_ACCESS_KEY="bench",
+        AWS_REGION="us-east-1",
+    )
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+async def timed(op, concurrency: int, count: int) -> str:
+    gate = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one(i: int) -> None:
+        async with gate:
+            started = time.perf_counter()
+            await op(i)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    wall = time.perf_counter() - started
+    return (f"{count / wall:9.0f} ops/s   p50 {percentile(latencies, 50) * 1000:7.1f} ms"
+            f"   p95 {percentile(latencies, 95) * 1000:7.1f} ms")
+
+
+async def bench(args) -> None:
+    from app.services.storage import ASSET_PREFIX, get_storage
+
+    storage = get_storage(args.backend)
+    if storage.name == "s3" and args.moto:
+        storage.client.create_bucket(Bucket=storage.bucket)
+    payload = os.urandom(args.size_kb * 1024)
+    run = uuid.uuid4().hex[:8]
+    keys = [f"{ASSET_PREFIX}bench-{run}-{i}.bin" for i in range(args.objects)]
+
+    print(f"backend={storage.name} objects={args.objects} size={args.size_kb} KiB")
+    for concurrency in args.concurrency:
+        print(f"\nconcurrency {concurrency}")
+        print("  put     ", await timed(lambda i: storage.put(keys[i], payload, "application/octet-stream"),
+                                        concurrency, len(keys)))
+        print("  get     ", await timed(lambda i: storage.get(keys[i]), concurrency, len(keys)))
+        print("  presign ", await timed(lambda i: storage.presign(keys[i], "http://bench"), concurrency, len(keys)))
+        # Second pass: served from the presign cache where the backend has one
+        print("  presign*", await timed(lambda i: storage.presign(keys[i], "http://bench"), concurrency, len(keys)))
+        started = time.perf_counter()
+        await storage.presign_many(keys, "http://bench", download_name="bench.bin")
+        print(f"  presign_many {len(keys) / (time.perf_counter() - started):9.0f} urls/s (one pool call)")
+        print("  delete  ", await timed(lambda i: storage.delete(keys[i]), concurrency, len(keys)))
+
+    if args.stream_mb:
+        async def chunks():
+            block = os.urandom(1024 * 1024)
+            for _ in range(args.stream_mb):
+                yield block
+
+        key = f"{ASSET_PREFIX}bench-{run}-stream.bin"
+        started = time.perf_counter()
+        await storage.put_stream(key, chunks(), "application/octet-stream")
+        wall = time.perf_counter() - started
+        print(f"\nput_stream {args.stream_mb} MiB: {args.stream_mb / wall:.0f} MiB/s")
+        await storage.delete(key)
+    storage.shutdown()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["local", "s3"], default=None, help="Default: STORAGE_BACKEND")
+    parser.add_argument("--moto", action="store_true", help="Run against an in-process S3 stand-in")
+    parser.add_argument("--objects", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--stream-mb", type=int, default=0, help="Also time a streaming upload of this size")
+    args = parser.parse_args()
+
+    if args.moto:
+        start_moto()
+        args.backend = "s3"
+    elif (args.backend or os.getenv("STORAGE_BACKEND", "local")) == "local" and not os.getenv("OUTPUT_DIR"):
+        # Keep benchmark files out of the real output directories
+        scratch = tempfile.mkdtemp(prefix="bgr-bench-")
+        os.environ.update(OUTPUT_DIR=os.path.join(scratch, "out"), ASSET_DIR=os.path.join(scratch, "assets"))
+    asyncio.run(bench(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+Worker layout benchmark: shared unpinned workers vs. per-model pinned groups.
+
+Shared      : --processes workers, unpinned, all reading one queue of mixed
+              models; each inference uses all cores' worth of threads, as an
+              unconfigured onnxruntime does.
+Partitioned : one worker per group of --groups (WORKER_GROUPS syntax, see
+              app/supervisor.py), pinned to its cores and reading only its
+              models' jobs, with OMP_NUM_THREADS = its cores.
+
+Jobs follow --mix (model=weight) and arrive all at once. Each layout runs
+--repeats times; throughput and latency percentiles are reported with their
+run-to-run standard deviation, which is where pinning shows up first.
+
+By default the real rembg model is used when it is installed. Pass
+--simulate to replace inference with a numpy matrix workload sized by
+MODEL_COSTS (BLAS threads follow OMP_NUM_THREADS like ONNX does).
+
+Usage:
+    python scripts/bench_worker_layout.py --groups "u2net@0-5;u2netp,*@6-7" --jobs 64
+    python scripts/bench_worker_layout.py --simulate --groups "u2net@0-2;u2netp,*@3" --repeats 5
+"""
+import argparse
+import multiprocessing as mp
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.fair_queue import MODEL_COSTS, parse_map  # noqa: E402
+from app.supervisor import format_cpus, parse_groups  # noqa: E402
+
+SIMULATED_MATRIX = 384
+
+
+def worker(jobs: "mp.Queue", results: "mp.Queue", cpus, simulate: bool, size: int, runs: int) -> None:
+    """Runs in a spawned child, after OMP_NUM_THREADS was set for it."""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    import threading
+
+    import numpy as np
+
+    if simulate:
+        rng = np.random.default_rng(os.getpid())
+        matrix = rng.random((SIMULATED_MATRIX, SIMULATED_MATRIX), dtype=np.float32)
+
+        def infer(model: str) -> None:
+            for _ in range(int(MODEL_COSTS.get(model, 1.0) * 8)):
+                matrix @ matrix
+    else:
+        from PIL import Image
+
+        from app.services import image_processor
+
+        image = Image.fromarray(np.random.default_rng(0).integers(0, 255, (size, size, 3), dtype=np.uint8))
+
+        def infer(model: str) -> None:
+            image_processor.predict_mask(image, model)
+
+    def loop() -> None:
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            model, enqueued = job
+            infer(model)
+            results.put((model, time.time() - enqueued))
+
+    threads = [threading.Thread(target=loop) for _ in range(runs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def start_worker(ctx, jobs, results, cpus, threads: int, runs: int, args) -> "mp.Process":
+    # Spawned children read OMP_NUM_THREADS when numpy / onnxruntime load
+    previous = os.environ.get("OMP_NUM_THREADS")
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    try:
+        process = ctx.Process(target=worker, args=(jobs, results, cpus, args.simulate, args.size, runs))
+        process.start()
+    finally:
+        if previous is None:
+            os.environ.pop("OMP_NUM_THREADS", None)
+        else:
+            os.environ["OMP_NUM_THREADS"] = previous
+    return process
+
+
+def warm_up(ctx, queues: Dict[str, "mp.Queue"], results: "mp.Queue", models: List[str], workers: int) -> None:
+    """One job per model and worker, so session loading is not measured."""
+    sent = 0
+    for model in models:
+        for _ in range(workers):
+            queues[model].put((model, time.time()))
+            sent += 1
+    for _ in range(sent):
+        results.get()
+
+
+def run_layout(name: str, args, models: List[str], weights: List[float]) -> dict:
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    processes = []
+    queues: Dict[str, "mp.Queue"] = {}
+    all_cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+
+    if name == "shared":
+        shared = ctx.Queue()
+        queues = {model: shared for model in models}
+        for _ in range(args.processes):
+            processes.append(start_worker(ctx, shared, results, None, len(all_cpus), 1, args))
+        consumers = readers = args.processes
+    else:
+        groups = parse_groups(args.groups)
+        fallback = None
+        for group in groups:
+            group_queue = ctx.Queue()
+            served = [m.strip() for m in group.models.split(",")]
+            for model in served:
+                if model == "*":
+                    fallback = group_queue
+                else:
+                    queues[model] = group_queue
+            processes.append(start_worker(ctx, group_queue, results, group.cpus, group.threads, group.runs, args))
+            print(f"  {group.models:<16} CPUs {format_cpus(group.cpus):<10} {group.runs} run(s), {group.threads} thread(s)")
+        for model in models:
+            if model not in queues:
+                if fallback is None:
+                    raise SystemExit(f"No group serves {model}; add it or a '*' group")
+                queues[model] = fallback
+        consumers = len(groups)
+        readers = sum(group.runs for group in groups)
+
+    runs = []
+    try:
+        warm_up(ctx, queues, results, models, consumers)
+        for _ in range(args.repeats):
+            rng = random.Random(args.seed)
+            started = time.time()
+            for _ in range(args.jobs):
+                model = rng.choices(models, weights)[0]
+                queues[model].put((model, time.time()))
+            latencies = [results.get()[1] for _ in range(args.jobs)]
+            elapsed = time.time() - started
+            latencies.sort()
+            runs.append({
+                "throughput": args.jobs / elapsed,
+                "p50": latencies[len(latencies) // 2],
+                "p95": latencies[int(len(latencies) * 0.95) - 1],
+                "p99": latencies[int(len(latencies) * 0.99) - 1],
+            })
+    finally:
+        # One stop marker per consumer thread that may read the queue
+        for q in set(queues.values()):
+            for _ in range(readers):
+                q.put(None)
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+    return {key: [run[key] for run in runs] for key in ("throughput", "p50", "p95", "p99")}
+
+
+def summarize(name: str, stats: dict) -> None:
+    def cell(values: List[float], unit: str) -> str:
+        spread = statistics.stdev(values) if len(values) > 1 else 0.0
+        return f"{statistics.mean(values):7.2f}{unit} ±{spread:5.2f}"
+
+    print(
+        f"{name:<12} {cell(stats['throughput'], '/s')}  p50 {cell(stats['p50'], 's')}  "
+        f"p95 {cell(stats['p95'], 's')}  p99 {cell(stats['p99'], 's')}"
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", required=True, help="partitioned layout, WORKER_GROUPS syntax")
+    parser.add_argument("--processes", type=int, default=2, help="workers in the shared layout")
+    parser.add_argument("--mix", default="u2net=1,u2netp=3", help="model=weight of the generated jobs")
+    parser.add_argument("--jobs", type=int, default=48)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--size", type=int, default=640, help="square image side for real inference")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--simulate", action="store_true", help="numpy workload instead of rembg")
+    args = parser.parse_args()
+
+    if not args.simulate:
+        try:
+            import rembg  # noqa: F401
+        except ImportError:
+            print("rembg is not installed; running with --simulate", file=sys.stderr)
+            args.simulate = True
+
+    mix = parse_map(args.mix)
+    models, weights = list(mix), list(mix.values())
+    print(f"{args.jobs} jobs x {args.repeats} runs, mix {args.mix}, {'simulated' if args.simulate else 'rembg'} inference")
+    results = {}
+    for name in ("shared", "partitioned"):
+        print(f"{name}:")
+        results[name] = run_layout(name, args, models, weights)
+    print()
+    for name, stats in results.items():
+        summarize(name, stats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Startup regression check.
+
+Imports the ASGI app in a fresh interpreter and fails (exit code 1) when:
+  - a heavy module (torch, rembg, onnxruntime, boto3, ...) is loaded at import time
+  - the import takes longer than --max-seconds
+  - the peak RSS of the interpreter grows beyond --max-rss-mb
+
+Usage:
+    python scripts/check_startup.py
+    python scripts/check_startup.py --module app.main --max-seconds 3 --max-rss-mb 150
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Modules that must never be imported just by loading the web app.
+FORBIDDEN_MODULES = [
+    "torch",
+    "rembg",
+    "onnxruntime",
+    "pymatting",
+    "numba",
+    "scipy",
+    "boto3",
+    "botocore",
+]
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import importlib
+importlib.import_module({module!r})
+elapsed = time.perf_counter() - start
+# ru_maxrss is reported in KiB on Linux and bytes on macOS
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+rss_mb = rss / 1024 if sys.platform != "darwin" else rss / (1024 * 1024)
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": rss_mb,
+    "loaded": sorted(m for m in {forbidden!r} if m in sys.modules),
+}}))
+"""
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="app.main", help="Module to import (default: app.main)")
+    parser.add_argument("--max-seconds", type=float, default=3.0, help="Import time budget")
+    parser.add_argument("--max-rss-mb", type=float, default=150.0, help="Peak RSS budget after import")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = PROBE.format(module=args.module, forbidden=FORBIDDEN_MODULES)
+    proc = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=root,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr, file=sys.stderr)
+        print(f"FAIL: importing {args.module} raised an error")
+        return 1
+
+    report = json.loads(proc.stdout.strip().splitlines()[-1])
+    print(f"import {args.module}: {report['seconds']:.2f}s, peak RSS {report['rss_mb']:.1f} MiB")
+
+    failures = []
+    if report["loaded"]:
+        failures.append(f"heavy modules loaded at import time: {', '.join(report['loaded'])}")
+    if report["seconds"] > args.max_seconds:
+        failures.append(f"import took {report['seconds']:.2f}s (budget {args.max_seconds:.2f}s)")
+    if report["rss_mb"] > args.max_rss_mb:
+        failures.append(f"peak RSS {report['rss_mb']:.1f} MiB (budget {args.max_rss_mb:.1f} MiB)")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if not failures:
+        print("OK")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,45 @@
+"""
+How often near-duplicate detection avoided inference, per day.
+
+Reads the daily counters written by app.services.dedup
+(bgr:dedup:stats:<YYYY-MM-DD>, kept for 90 days) from the configured Redis.
+
+Usage:
+    python scripts/dedup_report.py --days 14
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.redis_client import redis_client  # noqa: E402
+from app.services.dedup import STATS_KEY  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args()
+
+    days = [time.strftime("%Y-%m-%d", time.gmtime(time.time() - 86400 * n)) for n in range(args.days)]
+    pipe = redis_client.pipeline(transaction=False)
+    for day in days:
+        pipe.hmget(STATS_KEY.format(day=day), ["lookups", "hits"])
+
+    total_lookups = total_hits = 0
+    print(f"{'day':<12} {'lookups':>9} {'reused':>8} {'avoided':>8}")
+    for day, (lookups, hits) in zip(days, pipe.execute()):
+        lookups, hits = int(lookups or 0), int(hits or 0)
+        total_lookups += lookups
+        total_hits += hits
+        ratio = f"{hits / lookups:7.1%}" if lookups else "      -"
+        print(f"{day:<12} {lookups:>9} {hits:>8} {ratio:>8}")
+    if total_lookups:
+        print(f"\n{total_hits} of {total_lookups} jobs ({total_hits / total_lookups:.1%}) reused a stored mask")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
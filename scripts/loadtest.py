@@ -0,0 +1,305 @@
+"""
+Load generator for the HTTP API: upload -> poll /status -> /download.
+
+Uploads images from a corpus directory (or synthetic ones) to POST /process/
+either open-loop at a target arrival rate (Poisson arrivals, --rate) or
+closed-loop with a fixed number of concurrent clients (--concurrency). A
+recorded trace can be replayed with --trace (JSONL lines of
+{"t": seconds since start, "file": path, "model": ..., "scale": ...}).
+
+Every task is followed until it completes, fails or times out. The report
+covers end-to-end latency percentiles, the server-side split between queue
+wait and processing (from the /status timings), download latency, and error
+rates per step.
+
+The API's rate limits are skipped when the server runs with LOAD_TEST_TOKEN
+set and the same token is passed here. For a fully local run:
+
+    REDIS_URL=fakeredis:// LOAD_TEST_TOKEN=secret uvicorn app.main:app
+    python scripts/loadtest.py --token secret --rate 2 --duration 60 --corpus ./photos
+
+Requires httpx (pip install httpx).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from io import BytesIO
+from typing import List, Optional
+
+import httpx
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+LOAD_TEST_HEADER = "X-Load-Test-Token"
+
+
+@dataclass
+class Spec:
+    name: str
+    data: bytes
+    model: str = "u2net"
+    scale: float = 1.0
+    priority: str = "auto"
+    at: Optional[float] = None  # trace offset
+
+
+@dataclass
+class Result:
+    name: str
+    outcome: str = "ok"  # ok | submit_error | failed | timeout | status_error | download_error
+    http_codes: List[int] = field(default_factory=list)
+    submit_s: Optional[float] = None
+    e2e_s: Optional[float] = None
+    queue_s: Optional[float] = None
+    processing_s: Optional[float] = None
+    download_s: Optional[float] = None
+    polls: int = 0
+
+
+def synthetic_corpus(count: int, size: str) -> List[Spec]:
+    width, height = (int(v) for v in size.lower().split("x"))
+    specs = []
+    for i in range(count):
+        rng = np.random.default_rng(i)
+        base = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        arr = base + rng.normal(0, 25, (height, width, 3))
+        buf = BytesIO()
+        Image.fromarray(arr.clip(0, 255).astype(np.uint8)).save(buf, format="JPEG", quality=90)
+        specs.append(Spec(name=f"synthetic-{i}.jpg", data=buf.getvalue()))
+    return specs
+
+
+def load_corpus(directory: str) -> List[Spec]:
+    specs = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), "rb") as fh:
+                specs.append(Spec(name=name, data=fh.read()))
+    if not specs:
+        raise SystemExit(f"No images found in {directory}")
+    return specs
+
+
+def load_trace(path: str) -> List[Spec]:
+    specs = []
+    with open(path) as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            with open(item["file"], "rb") as img:
+                data = img.read()
+            specs.append(Spec(
+                name=os.path.basename(item["file"]),
+                data=data,
+                model=item.get("model", "u2net"),
+                scale=float(item.get("scale", 1.0)),
+                priority=item.get("priority", "auto"),
+                at=float(item["t"]),
+            ))
+    return sorted(specs, key=lambda s: s.at or 0.0)
+
+
+async def run_one(client: httpx.AsyncClient, spec: Spec, args) -> Result:
+    result = Result(name=spec.name)
+    started = time.perf_counter()
+
+    # 1. Submit
+    try:
+        response = await client.post(
+            "/process/",
+            files={"file": (spec.name, spec.data)},
+            data={
+                "email": args.email,
+                "model": args.model or spec.model,
+                "scale": str(args.scale or spec.scale),
+                "output_format": args.output_format,
+                "priority": spec.priority,
+            },
+        )
+    except httpx.HTTPError:
+        result.outcome = "submit_error"
+        result.http_codes.append(0)
+        return result
+    result.http_codes.append(response.status_code)
+    result.submit_s = time.perf_counter() - started
+    if response.status_code != 202:
+        result.outcome = "submit_error"
+        return result
+    task_id = response.json()["processing_id"]
+
+    # 2. Poll until a terminal state
+    deadline = started + args.timeout
+    status = {}
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(args.poll_interval)
+        result.polls += 1
+        try:
+            response = await client.get(f"/status/{task_id}")
+        except httpx.HTTPError:
+            result.http_codes.append(0)
+            continue
+        result.http_codes.append(response.status_code)
+        if response.status_code != 200:
+            result.outcome = "status_error"
+            return result
+        status = response.json()
+        if status["status"] in ("completed", "failed"):
+            break
+    else:
+        result.outcome = "timeout"
+        return result
+
+    timings = status.get("timings") or {}
+    if timings.get("queued_at") and timings.get("started_at"):
+        result.queue_s = timings["started_at"] - timings["queued_at"]
+    if timings.get("started_at") and timings.get("finished_at"):
+        result.processing_s = timings["finished_at"] - timings["started_at"]
+    if status["status"] == "failed":
+        result.outcome = "failed"
+        result.e2e_s = time.perf_counter() - started
+        return result
+
+    # 3. Download
+    download_started = time.perf_counter()
+    try:
+        response = await client.get(f"/download/{task_id}", follow_redirects=True)
+        result.http_codes.append(response.status_code)
+        if response.status_code != 200:
+            result.outcome = "download_error"
+    except httpx.HTTPError:
+        result.http_codes.append(0)
+        result.outcome = "download_error"
+    result.download_s = time.perf_counter() - download_started
+    result.e2e_s = time.perf_counter() - started
+    return result
+
+
+async def open_loop(client, specs: List[Spec], args) -> List[Result]:
+    """Arrivals independent of completions: Poisson at --rate, or the trace's offsets."""
+    tasks = []
+    t0 = time.perf_counter()
+    if args.trace:
+        for spec in specs:
+            await asyncio.sleep(max(0.0, t0 + (spec.at or 0.0) - time.perf_counter()))
+            tasks.append(asyncio.create_task(run_one(client, spec, args)))
+    else:
+        next_arrival = t0
+        i = 0
+        while next_arrival - t0 < args.duration:
+            await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+            tasks.append(asyncio.create_task(run_one(client, specs[i % len(specs)], args)))
+            i += 1
+            next_arrival += random.expovariate(args.rate)
+    return await asyncio.gather(*tasks)
+
+
+async def closed_loop(client, specs: List[Spec], args) -> List[Result]:
+    """--concurrency clients, each submitting its next job once the last one finished."""
+    results: List[Result] = []
+    counter = iter(range(args.requests))
+
+    async def client_loop() -> None:
+        for i in counter:
+            results.append(await run_one(client, specs[i % len(specs)], args))
+
+    await asyncio.gather(*(client_loop() for _ in range(args.concurrency)))
+    return results
+
+
+def percentiles(values: List[float]) -> str:
+    if not values:
+        return "      -"
+    ordered = sorted(values)
+
+    def pct(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return (f"p50 {pct(50):8.0f}  p90 {pct(90):8.0f}  p99 {pct(99):8.0f}  "
+            f"max {ordered[-1] * 1000:8.0f}  (ms, n={len(ordered)})")
+
+
+def report(results: List[Result], wall: float) -> dict:
+    outcomes = Counter(r.outcome for r in results)
+    codes = Counter(code for r in results for code in r.http_codes)
+    ok = [r for r in results if r.outcome == "ok"]
+
+    print(f"\n{len(results)} tasks in {wall:.1f}s ({len(results) / wall:.2f}/s offered, "
+          f"{len(ok) / wall:.2f}/s completed)")
+    print("outcomes  " + "  ".join(f"{k}={v} ({v / len(results):.1%})" for k, v in sorted(outcomes.items())))
+    print("http      " + "  ".join(f"{k}={v}" for k, v in sorted(codes.items())))
+    rows = (
+        ("end-to-end", [r.e2e_s for r in ok]),
+        ("submit", [r.submit_s for r in results if r.submit_s is not None]),
+        ("queue wait", [r.queue_s for r in results if r.queue_s is not None]),
+        ("processing", [r.processing_s for r in results if r.processing_s is not None]),
+        ("download", [r.download_s for r in ok]),
+    )
+    for label, values in rows:
+        print(f"{label:<11} {percentiles(values)}")
+    return {"wall_s": wall, "outcomes": dict(outcomes), "http_codes": dict(codes),
+            "results": [asdict(r) for r in results]}
+
+
+async def main_async(args) -> int:
+    if args.trace:
+        specs = load_trace(args.trace)
+    elif args.corpus:
+        specs = load_corpus(args.corpus)
+    else:
+        specs = synthetic_corpus(args.synthetic, args.size)
+    for spec in specs:
+        spec.priority = args.priority if spec.at is None else spec.priority
+
+    headers = {LOAD_TEST_HEADER: args.token} if args.token else {}
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits, timeout=30.0) as client:
+        started = time.perf_counter()
+        if args.concurrency:
+            results = await closed_loop(client, specs, args)
+        else:
+            results = await open_loop(client, specs, args)
+        summary = report(results, time.perf_counter() - started)
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(summary, fh, indent=2)
+        print(f"\nRaw results written to {args.json}")
+    return 0 if summary["outcomes"].get("ok", 0) == len(results) else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", default=os.getenv("LOAD_TEST_TOKEN", ""), help="Rate-limit bypass token")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--corpus", help="Directory of images to upload (round robin)")
+    source.add_argument("--trace", help="JSONL trace to replay with its original timing")
+    parser.add_argument("--synthetic", type=int, default=8, help="Synthetic images when no corpus is given")
+    parser.add_argument("--size", default="1280x960", help="WIDTHxHEIGHT of synthetic images")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--rate", type=float, default=1.0, help="Open loop: mean arrivals per second")
+    mode.add_argument("--concurrency", type=int, default=0, help="Closed loop: concurrent clients")
+    parser.add_argument("--duration", type=float, default=30.0, help="Open loop: seconds of arrivals")
+    parser.add_argument("--requests", type=int, default=50, help="Closed loop: total tasks")
+    parser.add_argument("--model", default="", help="Override the model of every upload")
+    parser.add_argument("--scale", type=float, default=0.0, help="Override the scale of every upload")
+    parser.add_argument("--priority", default="auto")
+    parser.add_argument("--output-format", default="png")
+    parser.add_argument("--email", default="loadtest@example.com")
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-task limit (seconds)")
+    parser.add_argument("--max-connections", type=int, default=100)
+    parser.add_argument("--json", help="Write raw per-task results here")
+    return asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
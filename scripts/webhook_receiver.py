@@ -0,0 +1,104 @@
+"""
+Local stand-in for a webhook integrator (see app/services/webhooks.py).
+
+Listens for completion callbacks, checks X-Webhook-Signature against the
+shared secret and prints one JSON line per request. --fail-first answers the
+first N requests with 503 to exercise the retry path.
+
+Usage:
+    python scripts/webhook_receiver.py --secret "$WEBHOOK_SECRET" --port 9000
+    python scripts/webhook_receiver.py --secret s3cret --fail-first 2
+
+Point a task at it (loopback needs WEBHOOK_ALLOW_PRIVATE=true):
+    curl -F file=@photo.jpg -F email=me@example.com \
+         -F callback_url=http://127.0.0.1:9000/hook http://localhost:8000/process/
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def verify(secret: str, timestamp: str, body: bytes, signature: str, max_skew: float) -> str:
+    """Returns "ok" or why the request must be rejected."""
+    if not timestamp or not signature:
+        return "missing signature headers"
+    try:
+        if abs(time.time() - int(timestamp)) > max_skew:
+            return "timestamp outside the allowed skew"
+    except ValueError:
+        return "bad timestamp"
+    expected = "sha256=" + hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+    return "ok" if hmac.compare_digest(expected, signature) else "signature mismatch"
+
+
+def make_handler(args):
+    lock = threading.Lock()
+    state = {"requests": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            with lock:
+                state["requests"] += 1
+                number = state["requests"]
+            check = verify(
+                args.secret,
+                self.headers.get("X-Webhook-Timestamp", ""),
+                body,
+                self.headers.get("X-Webhook-Signature", ""),
+                args.max_skew,
+            )
+            if check != "ok":
+                code = 401
+            elif number <= args.fail_first:
+                code = 503
+            else:
+                code = 200
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                payload = None
+            print(json.dumps({
+                "request": number,
+                "delivery": self.headers.get("X-Webhook-Id"),
+                "signature": check,
+                "answered": code,
+                "payload": payload,
+            }), flush=True)
+            self.send_response(code)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--secret", required=True, help="WEBHOOK_SECRET of the service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--fail-first", type=int, default=0, help="answer the first N requests with 503")
+    parser.add_argument("--max-skew", type=float, default=300.0, help="accepted timestamp age in seconds")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args))
+    print(f"Listening on http://{args.host}:{args.port}/", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Test setup: everything runs against the in-process fake Redis
+(REDIS_URL=fakeredis://), which must be chosen before `app` is imported,
+and S3 tests against an in-process moto server.
+"""
+import logging
+import os
+import tempfile
+import uuid
+
+os.environ["REDIS_URL"] = "fakeredis://"
+_local_root = tempfile.mkdtemp(prefix="bgr-tests-")
+os.environ["OUTPUT_DIR"] = os.path.join(_local_root, "processed_images")
+os.environ["ASSET_DIR"] = os.path.join(_local_root, "processed_assets")
+os.environ.setdefault("SERVICE_ROLE", "web")
+os.environ.setdefault("WEBHOOK_SECRET", "test-secret")
+os.environ.setdefault("WEBHOOK_ALLOW_PRIVATE", "true")
+
+import pytest  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.redis_client import redis_client  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def redis():
+    """A clean fake Redis for every test."""
+    redis_client.flushall()
+    yield redis_client
+    redis_client.flushall()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """The full app, past the rate limits (tested in test_rate_limit.py)."""
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+    from app.services.rate_limit import LOAD_TEST_HEADER
+
+    monkeypatch.setattr(settings, "LOAD_TEST_TOKEN", "test-token")
+    with TestClient(app, headers={LOAD_TEST_HEADER: "test-token"}) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def moto_endpoint():
+    """An in-process S3 stand-in, shared by the session."""
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3(moto_endpoint, monkeypatch):
+    """The "s3" storage backend on a fresh moto bucket."""
+    from app.services import storage
+    from app.services.s3_storage import S3Storage, get_s3_client
+
+    monkeypatch.setattr(settings, "AWS_S3_ENDPOINT_URL", moto_endpoint)
+    monkeypatch.setattr(settings, "AWS_ACCESS_KEY", "test")
+    monkeypatch.setattr(settings, "AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setattr(settings, "AWS_REGION", "us-east-1")
+    get_s3_client.cache_clear()
+    backend = S3Storage(f"test-{uuid.uuid4().hex[:12]}", concurrency=4)
+    backend.client.create_bucket(Bucket=backend.bucket)
+    monkeypatch.setitem(storage._BACKENDS, "s3", backend)
+    yield backend
+    backend.shutdown()
+    get_s3_client.cache_clear()
@@ -0,0 +1,173 @@
+import io
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image, ImageSequence
+from starlette.datastructures import UploadFile
+
+from app.config import settings
+from app.routers import process
+from app.services import animation
+from app.services.direct_upload import PROBE_BYTES
+
+COLORS = [(220, 40, 40), (40, 220, 40), (40, 40, 220)]
+
+
+def animated(fmt: str, frames: int = 3, size=(32, 24), noise: bool = False, **options) -> bytes:
+    """`frames` frames cycling through COLORS (or random pixels), 100 ms each."""
+    if noise:
+        images = [Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)) for _ in range(frames)]
+    else:
+        images = [Image.new("RGB", size, COLORS[i % len(COLORS)]) for i in range(frames)]
+    buffer = io.BytesIO()
+    images[0].save(buffer, fmt, save_all=frames > 1, append_images=images[1:], duration=100, **options)
+    return buffer.getvalue()
+
+
+def still(fmt: str, size=(32, 24), noise: bool = False) -> bytes:
+    return animated(fmt, frames=1, size=size, noise=noise)
+
+
+def left_half_masks(images, model_name):
+    """
+    Stand-in for the model: the left half of every frame is foreground, but
+    for a notch (libwebp drops the alpha flag of frames cropped to an opaque
+    rectangle).
+    """
+    masks = []
+    for image in images:
+        mask = Image.new("L", image.size, 0)
+        mask.paste(255, (0, 0, image.width // 2, image.height))
+        mask.paste(0, (0, 0, 2, 2))
+        masks.append(mask)
+    return masks
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    seen = []
+
+    def predict(images, model_name):
+        seen.append(len(images))
+        return left_half_masks(images, model_name)
+
+    monkeypatch.setattr(animation, "predict_masks", predict)
+    return seen
+
+
+def test_sniff_animated():
+    assert animation.sniff_animated(animated("GIF", loop=0)) is True
+    assert animation.sniff_animated(still("GIF")) is False
+    assert animation.sniff_animated(animated("PNG")) is True
+    assert animation.sniff_animated(still("PNG")) is False
+    assert animation.sniff_animated(animated("WEBP")[:64]) is True
+    assert animation.sniff_animated(still("WEBP")) is False
+    assert animation.sniff_animated(still("JPEG")) is False
+    assert animation.sniff_animated(b"\x00\x00\x00\x18ftypmp42") is None
+
+
+@pytest.mark.parametrize("fmt", ["GIF", "WEBP", "PNG"])
+def test_cut_off_header_keeps_animation(fmt):
+    data = animated(fmt, frames=4, size=(300, 300), noise=True, loop=0)
+    header = data[: len(data) // 4]
+    assert animation.sniff_animated(header) is True
+
+
+@pytest.mark.parametrize("encoder", ["incremental", "public"])
+def test_process_animation(calls, monkeypatch, encoder):
+    if encoder == "public":
+        monkeypatch.setattr(animation, "_WebPAnimEncoder", None)
+    elif animation._WebPAnimEncoder is None:
+        pytest.skip("This Pillow build has no incremental WebP encoder")
+    monkeypatch.setattr(settings, "ANIMATION_BATCH_SIZE", 2)
+    monkeypatch.setattr(settings, "ANIMATION_KEYFRAME_INTERVAL", 10)
+    # Pairs of near-identical frames (GIF merges identical ones): A A' B B' C C' A A'
+    expected = [tuple(c + i % 2 for c in COLORS[(i // 2) % len(COLORS)]) for i in range(8)]
+    frames = [Image.new("RGB", (32, 24), color) for color in expected]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, "GIF", save_all=True, append_images=frames[1:], duration=100, loop=0)
+
+    data, stats = animation.process_animation(buffer.getvalue(), "u2net", 1.0, 100)
+
+    # 1. Only color changes go to the model, in batches of ANIMATION_BATCH_SIZE
+    assert stats.frames == 8
+    assert stats.keyframes == 4
+    assert calls == [2, 2]
+    assert stats.duration_ms == 800
+
+    # 2. An animated WebP with every frame cut out by its keyframe's mask
+    with Image.open(io.BytesIO(data)) as output:
+        assert output.format == "WEBP"
+        assert output.n_frames == 8
+        for index, frame in enumerate(ImageSequence.Iterator(output)):
+            rgba = frame.convert("RGBA")
+            assert rgba.getpixel((4, 12)) == expected[index] + (255,)
+            assert rgba.getpixel((28, 12))[3] == 0
+
+
+def test_process_animation_scales(calls):
+    data, stats = animation.process_animation(animated("PNG", frames=3), "u2net", 0.5, 90)
+    with Image.open(io.BytesIO(data)) as output:
+        assert output.size == (16, 12)
+        assert output.n_frames == 3
+    assert stats.keyframes == 3
+
+
+def test_process_animation_empty_mask_is_transparent(monkeypatch):
+    monkeypatch.setattr(
+        animation, "predict_masks", lambda images, model_name: [Image.new("L", i.size, 0) for i in images]
+    )
+    data, _ = animation.process_animation(animated("GIF"), "u2net", 1.0, 100)
+    with Image.open(io.BytesIO(data)) as output:
+        assert all(frame.convert("RGBA").getextrema()[3] == (0, 0) for frame in ImageSequence.Iterator(output))
+
+
+def reads(monkeypatch) -> list:
+    """Sizes requested from the uploaded file, in order."""
+    seen = []
+    original = UploadFile.read
+
+    async def read(self, size: int = -1):
+        seen.append(size)
+        return await original(self, size)
+
+    monkeypatch.setattr(UploadFile, "read", read)
+    return seen
+
+
+def post(client: TestClient, filename: str, data: bytes):
+    return client.post("/process/", data={"email": "user@example.com"}, files={"file": (filename, data)})
+
+
+def test_large_still_refused_from_header(client, monkeypatch):
+    seen = reads(monkeypatch)
+    data = still("PNG", size=(1400, 1400), noise=True)
+    assert len(data) > process.MAX_FILE_SIZE
+
+    response = post(client, "big.png", data)
+    assert response.status_code == 413
+    assert "still images" in response.json()["detail"]
+    assert seen == [PROBE_BYTES]
+
+
+def test_large_animation_read_whole(client, monkeypatch):
+    seen = reads(monkeypatch)
+    data = animated("GIF", frames=16, size=(500, 500), noise=True, loop=0)
+    assert len(data) > process.MAX_FILE_SIZE
+    # Pillow alone takes the cut-off GIF for a still
+    assert animation.probe_media(data[:PROBE_BYTES])[2] is False
+
+    response = post(client, "big.gif", data)
+    assert response.status_code == 202, response.text
+    assert response.json()["output_format"] == "webp"
+    assert seen[0] == PROBE_BYTES
+
+
+def test_cut_off_webp_read_whole(client):
+    data = animated("WEBP", frames=3, size=(600, 600), noise=True, lossless=True)
+    assert len(data) > PROBE_BYTES
+
+    response = post(client, "clip.webp", data)
+    assert response.status_code == 202, response.text
+    assert response.json()["output_format"] == "webp"
@@ -0,0 +1,164 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.config import settings
+from app.services import dedup, image_processor
+from app.services.storage import ASSET_MASK, build_asset_key, get_storage
+from app.services.task_state import init_task
+
+
+def photo(seed: int, size=(320, 240)) -> Image.Image:
+    """Smooth color blobs: structure a perceptual hash can latch on to."""
+    cells = np.random.default_rng(seed).integers(0, 256, (6, 8, 3), dtype=np.uint8)
+    return Image.fromarray(cells).resize(size, Image.Resampling.BICUBIC)
+
+
+def jpeg(image: Image.Image, quality: int) -> Image.Image:
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return Image.open(io.BytesIO(buffer.getvalue())).convert("RGB")
+
+
+def stored_mask(image: Image.Image) -> Image.Image:
+    mask = Image.new("L", image.size, 0)
+    mask.paste(255, (image.width // 4, image.height // 4, image.width * 3 // 4, image.height * 3 // 4))
+    return mask
+
+
+def index(task_id: str, image: Image.Image, model: str = "u2net", with_asset: bool = True) -> None:
+    """What a completed job with stored assets leaves behind."""
+    init_task(task_id, status="completed", assets="local")
+    if with_asset:
+        buffer = io.BytesIO()
+        stored_mask(image).save(buffer, "PNG")
+        get_storage("local").put_sync(build_asset_key(task_id, ASSET_MASK), buffer.getvalue(), "image/png")
+    dedup.register(task_id, model, dedup.signature(image))
+
+
+@pytest.fixture
+def no_model(monkeypatch):
+    def predict_mask(image, model_name):
+        raise AssertionError("the model should not run on a near-duplicate")
+
+    monkeypatch.setattr(image_processor, "predict_mask", predict_mask)
+
+
+def test_signature_is_stable_under_resize_and_recompression():
+    original = dedup.signature(photo(1))
+    for variant in (photo(1).resize((160, 120), Image.Resampling.LANCZOS), jpeg(photo(1), 60)):
+        sig = dedup.signature(variant)
+        assert dedup.hamming(original.phash, sig.phash) <= settings.DEDUP_PHASH_MAX_DISTANCE
+        assert dedup.hamming(original.dhash, sig.dhash) <= settings.DEDUP_DHASH_MAX_DISTANCE
+        assert sig.aspect == pytest.approx(original.aspect)
+
+    other = dedup.signature(photo(2))
+    assert dedup.hamming(original.phash, other.phash) > settings.DEDUP_PHASH_MAX_DISTANCE
+
+
+def test_register_fills_every_band(redis, monkeypatch):
+    monkeypatch.setattr(settings, "DEDUP_BUCKET_SIZE", 2)
+    sig = dedup.signature(photo(1))
+    for task_id in ("t1", "t2", "t3"):
+        init_task(task_id, status="completed", assets="local")
+        dedup.register(task_id, "u2net", sig)
+
+    keys = dedup._band_keys("u2net", sig.phash)
+    assert len(set(keys)) == dedup.BANDS
+    for key in keys:
+        # Capped to the most recent DEDUP_BUCKET_SIZE uploads
+        assert redis.zrange(key, 0, -1) == [f"t2:{sig.phash:016x}".encode(), f"t3:{sig.phash:016x}".encode()]
+        assert redis.ttl(key) > 0
+    assert redis.hget("t3", "phash") == f"{sig.phash:016x}".encode()
+
+
+def test_one_band_is_enough(redis, monkeypatch):
+    monkeypatch.setattr(settings, "DEDUP_PHASH_MAX_DISTANCE", 7)
+    index("t1", photo(1))
+    sig = dedup.signature(photo(1))
+    # Flip one bit in all bands but the first: only band 0 still matches
+    near = dedup.Signature(sig.phash ^ 0x0101010101010100, sig.dhash, sig.thumb, sig.aspect)
+    assert dedup._candidates("u2net", near) == [(7, "t1")]
+    assert dedup._candidates("u2net_human", sig) == []
+
+
+@pytest.mark.parametrize("variant", ["resized", "recompressed"])
+def test_near_duplicate_hits(redis, variant):
+    index("t1", photo(1))
+    if variant == "resized":
+        query = photo(1).resize((160, 120), Image.Resampling.LANCZOS)
+    else:
+        query = jpeg(photo(1), 60)
+
+    mask, source = dedup.find_mask(query, "u2net")
+    assert source == "t1"
+    # Rescaled to the query
+    assert mask.size == query.size
+    assert mask.getpixel((query.width // 2, query.height // 2)) == 255
+    assert mask.getpixel((2, 2)) == 0
+    stats = redis.hgetall(next(iter(redis.scan_iter("bgr:dedup:stats:*"))))
+    assert stats == {b"lookups": b"1", b"hits": b"1"}
+
+
+def test_unrelated_image_misses(redis):
+    index("t1", photo(1))
+    assert dedup.find_mask(photo(2), "u2net") is None
+    # Same image, other model
+    assert dedup.find_mask(photo(1), "u2netp") is None
+
+
+def test_other_aspect_ratio_misses(redis):
+    index("t1", photo(1))
+    assert dedup.find_mask(photo(1, size=(320, 200)), "u2net") is None
+
+
+def test_missing_mask_asset_is_a_miss(redis):
+    # Asset files outlive the flushed Redis between tests: a fresh id
+    index("t-cleaned", photo(1), with_asset=False)
+    assert dedup.find_mask(photo(1), "u2net") is None
+
+
+def test_expired_task_is_a_miss(redis):
+    index("t1", photo(1))
+    redis.delete("t1")
+    assert dedup.find_mask(photo(1), "u2net") is None
+
+
+def test_redis_errors_are_a_miss(redis, monkeypatch):
+    def broken(*args, **kwargs):
+        raise ConnectionError("redis is down")
+
+    monkeypatch.setattr(dedup.redis_client, "pipeline", broken)
+    assert dedup.find_mask(photo(1), "u2net") is None
+
+
+def test_stages_skip_the_model_on_a_hit(redis, no_model):
+    index("t1", photo(1))
+    job = {"image": jpeg(photo(1), 60), "model": "u2net"}
+
+    job = image_processor.infer_stage(image_processor.dedup_stage(job))
+    assert job["dedup_of"] == "t1"
+    assert job["mask"].size == job["image"].size
+    assert "inference_seconds" not in job
+    # Registered again once the job completes
+    assert isinstance(job["signature"], dedup.Signature)
+
+
+def test_stages_run_the_model_on_a_miss(redis, monkeypatch):
+    index("t1", photo(1))
+    monkeypatch.setattr(image_processor, "predict_mask", lambda image, model_name: stored_mask(image))
+    job = {"image": photo(2), "model": "u2net"}
+
+    job = image_processor.infer_stage(image_processor.dedup_stage(job))
+    assert "dedup_of" not in job
+    assert job["mask"].size == (320, 240)
+    assert job["inference_seconds"] >= 0
+
+
+def test_dedup_disabled(redis, monkeypatch, no_model):
+    monkeypatch.setattr(settings, "DEDUP_ENABLED", False)
+    index("t1", photo(1))
+    job = image_processor.dedup_stage({"image": photo(1), "model": "u2net"})
+    assert "mask" not in job and "signature" not in job
@@ -0,0 +1,172 @@
+import asyncio
+import email
+import json
+import socket
+import time
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from app.config import settings
+from app.services import email_outbox
+from app.services.email_notifier import SMTPConnection
+from app.services.email_outbox import CLAIMS_KEY, DELAYED_KEY, OUTBOX_KEY, SENDING_KEY
+from app.services.task_state import get_task, init_task
+
+
+class Inbox:
+    """aiosmtpd handler that keeps what it receives and refuses `refused@`."""
+
+    def __init__(self):
+        self.messages = []
+        self.peers = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("refused@"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.peers.add(session.peer)
+        self.messages.append((envelope.rcpt_tos, email.message_from_bytes(envelope.content)))
+        return "250 Message accepted"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    monkeypatch.setattr(settings, "SMTP_USE_TLS", False)
+    monkeypatch.setattr(settings, "SMTP_USER", "")
+    monkeypatch.setattr(settings, "EMAIL_FROM", "noreply@example.com")
+    inbox = Inbox()
+    controller = Controller(inbox, hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    connection = SMTPConnection(controller.hostname, controller.port)
+    yield inbox, connection
+    connection.close()
+    controller.stop()
+
+
+def _queue(task_id: str, recipient: str) -> None:
+    init_task(task_id, status="completed")
+    email_outbox.enqueue(task_id, recipient, f"https://example.com/{task_id}.png")
+
+
+def test_claim_moves_entries_to_sending(redis):
+    for i in range(3):
+        _queue(f"t{i}", f"user{i}@example.com")
+    assert get_task("t0", ["email_status"])["email_status"] == "queued"
+
+    batch = email_outbox.claim_batch(limit=2, block_seconds=0.1)
+    # Oldest first, recorded as in flight
+    assert [json.loads(raw)["task_id"] for raw in batch] == ["t0", "t1"]
+    assert redis.llen(OUTBOX_KEY) == 1
+    assert redis.llen(SENDING_KEY) == 2
+    assert redis.zcard(CLAIMS_KEY) == 2
+    assert email_outbox.claim_batch(limit=5, block_seconds=0.1) != []
+    assert email_outbox.claim_batch(limit=5, block_seconds=0.1) == []
+
+
+def test_send_batch_delivers_over_one_session(redis, smtp):
+    inbox, connection = smtp
+    for i in range(3):
+        _queue(f"t{i}", f"user{i}@example.com")
+
+    batch = email_outbox.claim_batch(limit=10, block_seconds=0.1)
+    assert email_outbox.send_batch(connection, batch) == 3
+
+    assert sorted(to for (to,), _ in inbox.messages) == [f"user{i}@example.com" for i in range(3)]
+    [html] = inbox.messages[0][1].get_payload()
+    assert "https://example.com/t0.png" in html.get_payload(decode=True).decode()
+    assert len(inbox.peers) == 1
+    task = get_task("t0", ["email_status", "email_attempts"])
+    assert (task["email_status"], task["email_attempts"]) == ("sent", "1")
+    assert redis.llen(SENDING_KEY) == 0
+    assert redis.zcard(CLAIMS_KEY) == 0
+
+
+def test_refused_recipient_fails_without_retry(redis, smtp):
+    inbox, connection = smtp
+    _queue("t1", "refused@example.com")
+
+    assert email_outbox.send_batch(connection, email_outbox.claim_batch(10, 0.1)) == 0
+    assert get_task("t1", ["email_status"])["email_status"] == "failed"
+    assert redis.zcard(DELAYED_KEY) == 0
+    assert redis.llen(SENDING_KEY) == 0
+
+
+def test_unreachable_server_backs_off_then_requeues(redis, monkeypatch):
+    monkeypatch.setattr(settings, "SMTP_USE_TLS", False)
+    monkeypatch.setattr(settings, "EMAIL_SMTP_TIMEOUT", 1.0)
+    _queue("t1", "user@example.com")
+    _queue("t2", "user@example.com")
+
+    batch = email_outbox.claim_batch(10, 0.1)
+    assert email_outbox.send_batch(SMTPConnection("127.0.0.1", _free_port()), batch) == 0
+    for task_id in ("t1", "t2"):
+        task = get_task(task_id, ["email_status", "email_attempts"])
+        assert (task["email_status"], task["email_attempts"]) == ("retrying", "1")
+    assert redis.zcard(DELAYED_KEY) == 2
+    assert redis.llen(SENDING_KEY) == 0
+
+    # Not due yet
+    email_outbox.maintain()
+    assert redis.llen(OUTBOX_KEY) == 0
+    for member in redis.zrange(DELAYED_KEY, 0, -1):
+        redis.zadd(DELAYED_KEY, {member: time.time() - 1})
+    email_outbox.maintain()
+    assert sorted(json.loads(raw)["attempts"] for raw in redis.lrange(OUTBOX_KEY, 0, -1)) == [1, 1]
+
+
+def test_gives_up_after_max_attempts(redis, monkeypatch):
+    monkeypatch.setattr(settings, "SMTP_USE_TLS", False)
+    monkeypatch.setattr(settings, "EMAIL_MAX_ATTEMPTS", 2)
+    init_task("t1", status="completed")
+    redis.lpush(OUTBOX_KEY, json.dumps({"task_id": "t1", "to": "u@example.com", "url": "x", "attempts": 1}))
+
+    email_outbox.send_batch(SMTPConnection("127.0.0.1", _free_port()), email_outbox.claim_batch(10, 0.1))
+    task = get_task("t1", ["email_status", "email_attempts"])
+    assert (task["email_status"], task["email_attempts"]) == ("failed", "2")
+    assert redis.zcard(DELAYED_KEY) == 0
+
+
+def test_abandoned_claims_go_back_to_the_outbox(redis, monkeypatch):
+    monkeypatch.setattr(settings, "EMAIL_VISIBILITY_SECONDS", 60.0)
+    _queue("t1", "user@example.com")
+    [raw] = email_outbox.claim_batch(10, 0.1)
+
+    # The sender that claimed it stops; still within the visibility timeout
+    email_outbox.maintain()
+    assert redis.llen(SENDING_KEY) == 1
+
+    redis.zadd(CLAIMS_KEY, {raw: time.time() - 61})
+    email_outbox.maintain()
+    assert redis.llen(SENDING_KEY) == 0
+    assert redis.zcard(CLAIMS_KEY) == 0
+    assert redis.lrange(OUTBOX_KEY, 0, -1) == [raw.encode()]
+
+
+def test_sender_drains_the_outbox(redis, smtp, monkeypatch):
+    inbox, connection = smtp
+    monkeypatch.setattr(settings, "EMAIL_BLOCK_SECONDS", 0.1)
+    for i in range(3):
+        _queue(f"t{i}", f"user{i}@example.com")
+
+    async def run():
+        sender = email_outbox.EmailSender(connection)
+        sender.start()
+        deadline = time.monotonic() + 5
+        while len(inbox.messages) < 3 and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await sender.stop()
+
+    asyncio.run(run())
+    assert len(inbox.messages) == 3
+    assert redis.llen(OUTBOX_KEY) == 0
+    assert all(get_task(f"t{i}", ["email_status"])["email_status"] == "sent" for i in range(3))
@@ -0,0 +1,133 @@
+import asyncio
+from typing import List, Tuple
+
+from app.services.fair_queue import LANE_BULK, LANE_INTERACTIVE, FairScheduler, job_cost, lane_for
+
+# (name, lane, client, model, cost)
+Job = Tuple[str, str, str, str, float]
+
+
+def admission_order(scheduler: FairScheduler, jobs: List[Job], first: Job) -> List[str]:
+    """
+    Holds every slot with `first`-like jobs, queues `jobs`, then lets them
+    through one slot at a time and returns the order they were admitted in.
+    """
+    order: List[str] = []
+
+    async def run_job(job: Job, hold: "asyncio.Event | None" = None) -> None:
+        name, lane, client, model, cost = job
+        async with scheduler.slot(lane, client, model, cost):
+            order.append(name)
+            if hold is not None:
+                await hold.wait()
+
+    async def main() -> None:
+        hold = asyncio.Event()
+        blockers = [asyncio.create_task(run_job(first, hold)) for _ in range(scheduler.slots)]
+        await asyncio.sleep(0)
+        waiting = []
+        for job in jobs:
+            waiting.append(asyncio.create_task(run_job(job)))
+            await asyncio.sleep(0)  # enqueue in this order
+        hold.set()
+        await asyncio.gather(*blockers, *waiting)
+
+    asyncio.run(main())
+    return order[scheduler.slots:]
+
+
+def test_lanes_share_slots_by_weight():
+    scheduler = FairScheduler(slots=1, lane_weights={LANE_INTERACTIVE: 4, LANE_BULK: 1})
+    jobs = [(f"b{i}", LANE_BULK, "c", "u2net", 1.0) for i in range(4)]
+    jobs += [(f"i{i}", LANE_INTERACTIVE, "c", "u2netp", 1.0) for i in range(12)]
+
+    lanes = "".join(name[0] for name in admission_order(scheduler, jobs, ("x", LANE_BULK, "c", "u2net", 1.0)))
+    # Previews overtake bulk 4:1, but bulk keeps moving
+    assert lanes == "iiii" + "iiiib" + "iiiib" + "bb"
+
+
+def test_idle_lane_does_not_hold_back_the_other():
+    scheduler = FairScheduler(slots=1, lane_weights={LANE_INTERACTIVE: 4, LANE_BULK: 1})
+    jobs = [(f"b{i}", LANE_BULK, "c", "u2net", 1.0) for i in range(5)]
+    assert admission_order(scheduler, jobs, ("x", LANE_BULK, "c", "u2net", 1.0)) == [f"b{i}" for i in range(5)]
+
+
+def test_clients_take_turns_within_a_lane():
+    scheduler = FairScheduler(slots=1, lane_weights={})
+    # A floods the lane before B shows up
+    jobs = [(f"a{i}", LANE_BULK, "A", "u2net", 1.0) for i in range(6)]
+    jobs += [(f"b{i}", LANE_BULK, "B", "u2net", 1.0) for i in range(2)]
+
+    order = admission_order(scheduler, jobs, ("x", LANE_BULK, "X", "u2net", 1.0))
+    assert order == ["a0", "b0", "a1", "b1", "a2", "a3", "a4", "a5"]
+
+
+def test_expensive_jobs_count_against_their_client():
+    scheduler = FairScheduler(slots=1, lane_weights={}, quantum=1.0)
+    jobs = [(f"a{i}", LANE_BULK, "A", "u2net", 4.0) for i in range(2)]
+    jobs += [(f"b{i}", LANE_BULK, "B", "u2net", 1.0) for i in range(8)]
+
+    order = admission_order(scheduler, jobs, ("x", LANE_BULK, "X", "u2net", 1.0))
+    # Each cost-4 job of A is matched by about four cheap jobs of B
+    assert order.index("a1") - order.index("a0") == 5
+    assert order[-1] == "b7"
+
+
+def test_model_cap_skips_without_blocking_the_line():
+    capped = FairScheduler(slots=2, lane_weights={}, model_caps={"u2net": 1})
+
+    async def main() -> List[str]:
+        admitted: List[str] = []
+        hold = asyncio.Event()
+
+        async def run(name: str, model: str) -> None:
+            async with capped.slot(LANE_BULK, "A", model, 1.0):
+                admitted.append(name)
+                await hold.wait()
+
+        tasks = [asyncio.create_task(run(name, model)) for name, model in
+                 (("u1", "u2net"), ("u2", "u2net"), ("p1", "u2netp"))]
+        await asyncio.sleep(0.01)
+        snapshot = list(admitted)
+        hold.set()
+        await asyncio.gather(*tasks)
+        return snapshot
+
+    # u2 waits for the u2net cap, p1 takes the second slot ahead of it
+    assert asyncio.run(main()) == ["u1", "p1"]
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    scheduler = FairScheduler(slots=1, lane_weights={})
+
+    async def main() -> List[str]:
+        admitted: List[str] = []
+        hold = asyncio.Event()
+
+        async def run(name: str) -> None:
+            async with scheduler.slot(LANE_BULK, name, "u2net", 1.0):
+                admitted.append(name)
+                await hold.wait()
+
+        first = asyncio.create_task(run("first"))
+        await asyncio.sleep(0)
+        gone = asyncio.create_task(run("gone"))
+        last = asyncio.create_task(run("last"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        hold.set()
+        await asyncio.gather(first, last)
+        assert gone.cancelled()
+        return admitted
+
+    assert asyncio.run(main()) == ["first", "last"]
+    assert scheduler.waiting(LANE_BULK) == 0
+
+
+def test_lane_and_cost_rules():
+    assert lane_for("", "u2netp", 1.0) == LANE_INTERACTIVE
+    assert lane_for("", "u2netp", 2.0) == LANE_BULK
+    assert lane_for("", "u2net", 1.0) == LANE_BULK
+    assert lane_for(LANE_BULK, "u2netp", 0.5) == LANE_BULK
+    assert job_cost("u2net", 2.0) == 16.0
+    assert job_cost("unknown-model", 1.0) == 1.0
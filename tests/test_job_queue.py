@@ -0,0 +1,113 @@
+import json
+import time
+
+from app.config import settings
+from app.services import job_queue
+from app.services.job_queue import DEAD_KEY, DELAYED_KEY, GROUP, PAYLOAD_KEY, STREAM_KEY
+
+
+def _consume_one(consumer: str = "w1") -> job_queue.Job:
+    jobs = job_queue.consume(consumer, count=10, block_ms=0)
+    assert len(jobs) == 1
+    return jobs[0]
+
+
+def test_enqueue_consume_ack(redis):
+    job_queue.ensure_group()
+    job_queue.enqueue("t1", b"bytes", model="u2net")
+
+    job = _consume_one()
+    assert (job.task_id, job.attempts, job.fields["model"]) == ("t1", 0, "u2net")
+    assert job.payload() == b"bytes"
+
+    job_queue.ack(job)
+    assert redis.xlen(STREAM_KEY) == 0
+    assert redis.xpending(STREAM_KEY, GROUP)["pending"] == 0
+    assert not redis.exists(PAYLOAD_KEY.format("t1"))
+
+
+def test_retry_waits_for_backoff_then_promotes(redis, monkeypatch):
+    monkeypatch.setattr(settings, "QUEUE_RETRY_BASE_DELAY", 10.0)
+    job_queue.ensure_group()
+    job_queue.enqueue("t1", b"bytes", model="u2net")
+    job = _consume_one()
+
+    assert job_queue.retry(job, "boom") is True
+    # Off the stream and parked in the delayed set, due after the backoff
+    assert redis.xlen(STREAM_KEY) == 0
+    assert redis.xpending(STREAM_KEY, GROUP)["pending"] == 0
+    [(member, due)] = redis.zrange(DELAYED_KEY, 0, -1, withscores=True)
+    assert 5 <= due - time.time() <= 10
+    assert json.loads(member)["attempts"] == "1"
+    assert redis.exists(PAYLOAD_KEY.format("t1"))
+
+    assert job_queue.promote_delayed() == 0
+
+    # Once due, it is promoted exactly once with the attempt counted
+    redis.zadd(DELAYED_KEY, {member: time.time() - 1})
+    assert job_queue.promote_delayed() == 1
+    assert job_queue.promote_delayed() == 0
+    assert redis.zcard(DELAYED_KEY) == 0
+    again = _consume_one()
+    assert (again.task_id, again.attempts, again.fields["model"]) == ("t1", 1, "u2net")
+
+
+def test_backoff_is_capped(monkeypatch):
+    monkeypatch.setattr(settings, "QUEUE_RETRY_BASE_DELAY", 2.0)
+    monkeypatch.setattr(settings, "QUEUE_RETRY_MAX_DELAY", 60.0)
+    assert 1.0 <= job_queue.backoff_seconds(0) <= 2.0
+    assert 8.0 <= job_queue.backoff_seconds(3) <= 16.0
+    assert 30.0 <= job_queue.backoff_seconds(20) <= 60.0
+
+
+def test_retry_dead_letters_after_max_attempts(redis, monkeypatch):
+    monkeypatch.setattr(settings, "QUEUE_MAX_ATTEMPTS", 2)
+    job_queue.ensure_group()
+    job_queue.enqueue("t1", b"bytes", model="u2net")
+    job = _consume_one()
+    job.attempts = 1
+
+    assert job_queue.retry(job, "still broken") is False
+    assert redis.zcard(DELAYED_KEY) == 0
+    assert redis.xlen(STREAM_KEY) == 0
+    assert not redis.exists(PAYLOAD_KEY.format("t1"))
+    [entry] = job_queue.dead_letters()
+    assert (entry["task_id"], entry["attempts"], entry["error"]) == ("t1", 2, "still broken")
+    assert redis.llen(DEAD_KEY) == 1
+
+
+def test_reaper_reclaims_after_visibility_timeout(redis, monkeypatch):
+    monkeypatch.setattr(settings, "QUEUE_VISIBILITY_TIMEOUT_MS", 50)
+    job_queue.ensure_group()
+    job_queue.enqueue("t1", b"bytes", model="u2net")
+    job = _consume_one("crashed")
+
+    # Still within the visibility timeout: left alone
+    assert job_queue.reap("reaper") == 0
+    time.sleep(0.1)
+    # A heartbeat resets the idle time
+    job_queue.heartbeat("crashed", [job])
+    assert job_queue.reap("reaper") == 0
+
+    time.sleep(0.1)
+    assert job_queue.reap("reaper") == 1
+    assert redis.xpending(STREAM_KEY, GROUP)["pending"] == 0
+    [member] = redis.zrange(DELAYED_KEY, 0, -1)
+    assert json.loads(member)["attempts"] == "1"
+
+
+def test_requeue_does_not_count_an_attempt(redis):
+    job_queue.ensure_group()
+    job_queue.enqueue("t1", b"bytes")
+    job_queue.requeue(_consume_one())
+    again = _consume_one()
+    assert (again.task_id, again.attempts) == ("t1", 0)
+
+
+def test_backlog_counts_undelivered_entries(redis):
+    job_queue.ensure_group()
+    for i in range(3):
+        job_queue.enqueue(f"t{i}", b"bytes")
+    assert job_queue.backlog() == {STREAM_KEY: 3}
+    job_queue.consume("w1", count=1, block_ms=0)
+    assert job_queue.backlog() == {STREAM_KEY: 2}
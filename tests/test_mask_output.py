@@ -0,0 +1,107 @@
+import io
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.config import settings
+from app.models import ProcessingRequest
+from app.services.image_processor import MASK_ENCODINGS, encode_mask_output, encode_stage, mask_runs
+from app.tasks import result_extension
+
+
+def soft_mask(width: int = 40, height: int = 30) -> Image.Image:
+    """A soft-edged matte: every gray level, including both sides of MASK_THRESHOLD."""
+    values = np.random.default_rng(7).integers(0, 256, (height, width), dtype=np.uint8)
+    values[:, :5] = 255
+    values[:, -5:] = 0
+    return Image.fromarray(values, mode="L")
+
+
+def decode_rle(payload: dict) -> np.ndarray:
+    """What a client does with the rle encoding: expand the runs, background first."""
+    flat = np.concatenate(
+        [np.full(count, index % 2 == 1, dtype=bool) for index, count in enumerate(payload["counts"])]
+    )
+    assert payload["order"] == "row-major"
+    return flat.reshape(payload["height"], payload["width"])
+
+
+def binary(mask: Image.Image) -> np.ndarray:
+    return np.asarray(mask) >= settings.MASK_THRESHOLD
+
+
+@pytest.mark.parametrize(
+    "mask",
+    [
+        soft_mask(),
+        Image.new("L", (7, 3), 255),  # foreground from the first pixel: counts start with 0
+        Image.new("L", (7, 3), 0),
+        Image.new("L", (1, 1), 200),
+    ],
+    ids=["soft", "foreground", "background", "one-pixel"],
+)
+def test_rle_round_trip(mask):
+    payload = json.loads(encode_mask_output(mask, "rle"))
+    assert (payload["width"], payload["height"]) == mask.size
+    assert sum(payload["counts"]) == mask.width * mask.height
+    # Only the first run may be empty
+    assert all(count > 0 for count in payload["counts"][1:])
+    np.testing.assert_array_equal(decode_rle(payload), binary(mask))
+
+
+def test_rle_threshold_is_inclusive(monkeypatch):
+    monkeypatch.setattr(settings, "MASK_THRESHOLD", 128)
+    mask = Image.fromarray(np.array([[127, 128, 129, 0]], dtype=np.uint8), mode="L")
+    assert mask_runs(mask, 128) == [1, 2, 1]
+    assert json.loads(encode_mask_output(mask, "rle"))["counts"] == [1, 2, 1]
+
+
+def test_gray_png_keeps_every_level():
+    mask = soft_mask()
+    with Image.open(io.BytesIO(encode_mask_output(mask, "gray"))) as decoded:
+        assert decoded.format == "PNG"
+        assert decoded.mode == "L"
+        np.testing.assert_array_equal(np.asarray(decoded), np.asarray(mask))
+
+
+def test_binary_png_is_one_bit():
+    mask = soft_mask()
+    with Image.open(io.BytesIO(encode_mask_output(mask, "binary"))) as decoded:
+        assert decoded.format == "PNG"
+        assert decoded.mode == "1"
+        np.testing.assert_array_equal(np.asarray(decoded), binary(mask))
+
+
+def test_encodings_and_extensions():
+    assert set(MASK_ENCODINGS) == {"gray", "binary", "rle"}
+    for encoding, ext in MASK_ENCODINGS.items():
+        request = ProcessingRequest(email="user@example.com", output_format="mask", mask_encoding=encoding)
+        assert result_extension(request) == ext
+    assert result_extension(ProcessingRequest(email="user@example.com", output_format="webp")) == "webp"
+
+
+def test_encode_stage_skips_the_cutout():
+    mask = soft_mask()
+    image = Image.new("RGB", mask.size, (10, 20, 30))
+    job = encode_stage({"image": image, "mask": mask, "mask_encoding": "rle", "ext": "json", "quality": 95})
+    np.testing.assert_array_equal(decode_rle(json.loads(job["encoded"])), binary(mask))
+    assert job["size"] == len(job["encoded"])
+    assert "image" not in job and "mask" not in job
+
+
+def test_process_validates_the_encoding(client):
+    def post(**form):
+        buffer = io.BytesIO()
+        Image.new("RGB", (8, 8)).save(buffer, "PNG")
+        return client.post(
+            "/process/",
+            data={"email": "user@example.com", "output_format": "mask", **form},
+            files={"file": ("photo.png", buffer.getvalue())},
+        )
+
+    assert post(mask_encoding="jpeg").status_code == 400
+    response = post(mask_encoding="rle")
+    assert response.status_code == 202
+    assert response.json()["output_format"] == "mask"
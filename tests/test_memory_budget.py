@@ -0,0 +1,176 @@
+import asyncio
+import io
+import struct
+import zlib
+
+import pytest
+from PIL import Image
+
+from app.config import settings
+from app.services import memory_budget
+from app.services.memory_budget import (
+    ImageTooLarge,
+    MemoryBudget,
+    check_pixel_budget,
+    estimate_animation_bytes,
+    estimate_job_bytes,
+    probe_dimensions,
+)
+
+MB = 1024 * 1024
+
+
+def chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def png_header(width: int, height: int) -> bytes:
+    """A PNG claiming `width` x `height` with no pixel data at all."""
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", b"")
+
+
+def png(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_pixel_budget(monkeypatch):
+    monkeypatch.setattr(settings, "MAX_IMAGE_PIXELS", 10_000)
+    check_pixel_budget(100, 100, 1.0)
+    check_pixel_budget(200, 50, 0.5)
+    with pytest.raises(ImageTooLarge, match="101x100 at scale 1.0 needs 10,100 pixels"):
+        check_pixel_budget(101, 100, 1.0)
+    # The scaled canvas counts as well as the source
+    with pytest.raises(ImageTooLarge):
+        check_pixel_budget(60, 60, 2.0)
+
+
+def test_probe_reads_the_header_only():
+    assert probe_dimensions(png_header(6000, 4000)) == (6000, 4000)
+
+
+def test_probe_refuses_decompression_bombs():
+    side = int((2 * Image.MAX_IMAGE_PIXELS) ** 0.5) + 1
+    with pytest.raises(ImageTooLarge):
+        probe_dimensions(png_header(side, side))
+
+
+def test_job_estimate():
+    base = estimate_job_bytes(1000, 1000, 1.0)
+    assert base == 1_000_000 * (memory_budget.SOURCE_BYTES_PER_PIXEL + memory_budget.SCALED_BYTES_PER_PIXEL)
+    # The upload is held too; scale=2 quadruples the scaled copies only
+    assert estimate_job_bytes(1000, 1000, 1.0, upload_bytes=5 * MB) == base + 5 * MB
+    assert estimate_job_bytes(1000, 1000, 2.0) == 1_000_000 * (
+        memory_budget.SOURCE_BYTES_PER_PIXEL + 4 * memory_budget.SCALED_BYTES_PER_PIXEL
+    )
+
+
+def test_animation_estimate_grows_with_the_keyframe_batch(monkeypatch):
+    monkeypatch.setattr(settings, "ANIMATION_BATCH_SIZE", 1)
+    monkeypatch.setattr(settings, "ANIMATION_KEYFRAME_INTERVAL", 0)
+    one = estimate_animation_bytes(100, 100, 1.0)
+    assert one == 100 * 100 * memory_budget.FRAME_BYTES_PER_PIXEL + estimate_job_bytes(100, 100, 1.0)
+
+    monkeypatch.setattr(settings, "ANIMATION_BATCH_SIZE", 4)
+    monkeypatch.setattr(settings, "ANIMATION_KEYFRAME_INTERVAL", 9)
+    frame = one - estimate_job_bytes(100, 100, 1.0)
+    assert estimate_animation_bytes(100, 100, 1.0) == estimate_job_bytes(100, 100, 1.0) + 40 * frame
+    assert estimate_animation_bytes(100, 100, 1.0, upload_bytes=MB) == estimate_animation_bytes(100, 100, 1.0) + 2 * MB
+
+
+def test_reserve_waits_for_the_budget():
+    async def scenario():
+        budget = MemoryBudget(100, None, sample_interval=0.01)
+        order = []
+
+        async def job(name: str, estimate: int, hold: float):
+            async with budget.reserve(estimate) as reservation:
+                order.append(f"{name}+")
+                await asyncio.sleep(hold)
+                order.append(f"{name}-")
+                return reservation
+
+        first = asyncio.create_task(job("a", 60, 0.1))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(job("b", 30, 0.01))
+        third = asyncio.create_task(job("c", 60, 0))
+        await asyncio.sleep(0.05)
+        # b fits next to a; c does not until a is done
+        assert order == ["a+", "b+", "b-"]
+        assert budget.reserved == 60
+        a, b, c = await asyncio.gather(first, second, third)
+        assert order == ["a+", "b+", "b-", "a-", "c+", "c-"]
+        assert budget.reserved == 0
+        assert (a.overlap, b.overlap, c.overlap) == (2, 2, 1)
+        assert c.fields()["mem_estimate"] == 60
+
+    asyncio.run(scenario())
+
+
+def test_reserve_admits_an_oversized_job_alone():
+    async def scenario():
+        budget = MemoryBudget(100, None)
+        async with budget.reserve(500):
+            assert budget.reserved == 500
+
+    asyncio.run(scenario())
+
+
+def test_reserve_releases_on_error():
+    async def scenario():
+        budget = MemoryBudget(100, None)
+        with pytest.raises(RuntimeError):
+            async with budget.reserve(80):
+                raise RuntimeError("inference failed")
+        assert budget.reserved == 0
+        # The next job gets the whole budget straight away
+        async with budget.reserve(100):
+            assert budget.reserved == 100
+
+    asyncio.run(scenario())
+
+
+def test_reserve_waits_while_rss_is_over_the_limit(monkeypatch):
+    async def scenario():
+        rss = {"value": 900}
+        monkeypatch.setattr(memory_budget, "current_rss", lambda: rss["value"])
+        budget = MemoryBudget(1000, 500, sample_interval=0.01)
+        admitted = asyncio.Event()
+
+        async def second():
+            async with budget.reserve(1):
+                admitted.set()
+
+        async with budget.reserve(1) as first:
+            waiting = asyncio.create_task(second())
+            await asyncio.sleep(0.05)
+            assert not admitted.is_set()
+            # RSS is re-checked on a timer, not only when a job is released
+            rss["value"] = 400
+            await asyncio.wait_for(admitted.wait(), timeout=2)
+        await waiting
+        assert first.fields()["mem_peak_rss"] == 900
+
+    asyncio.run(scenario())
+
+
+def test_process_rejects_over_the_pixel_budget(client, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_IMAGE_PIXELS", 10_000)
+
+    def post(data: bytes, **form):
+        return client.post(
+            "/process/",
+            data={"email": "user@example.com", **form},
+            files={"file": ("photo.png", data)},
+        )
+
+    assert post(png(100, 100)).status_code == 202
+    response = post(png(101, 100))
+    assert response.status_code == 413
+    assert "the limit is 10,000" in response.json()["detail"]
+    # Within budget at scale 1, over it once doubled
+    assert post(png(60, 60), scale="2.0").status_code == 413
+    # Canvases Pillow refuses to open are 413 too, not 400
+    assert post(png_header(50_000, 50_000)).status_code == 413
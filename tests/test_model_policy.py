@@ -0,0 +1,124 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app import worker as worker_module
+from app.config import settings
+from app.models import ProcessingRequest
+from app.services import job_queue
+from app.services.fair_queue import LANE_BULK, LANE_INTERACTIVE
+from app.services.model_policy import EWMA_ALPHA, ModelPolicy
+from app.services.task_state import get_task
+from app.tasks import enqueue_image_processing
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    monkeypatch.setattr(settings, "INFERENCE_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "AUTO_LATENCY_SLO_SECONDS", 30.0)
+    monkeypatch.setattr(settings, "AUTO_RECOVER_RATIO", 0.7)
+    monkeypatch.setattr(settings, "AUTO_SECONDS_PER_COST", 0.5)
+    return ModelPolicy(["u2net", "u2netp"])
+
+
+def test_ewma(policy):
+    policy.observe("u2net", 2.0)
+    assert policy.inference_seconds("u2net") == 2.0
+    policy.observe("u2net", 12.0)
+    assert policy.inference_seconds("u2net") == pytest.approx(2.0 + EWMA_ALPHA * 10.0)
+
+
+def test_unobserved_models_are_estimated_from_costs(policy):
+    # MODEL_COSTS: u2net=4, u2netp=1
+    assert policy.inference_seconds("u2net") == 4 * 0.5
+    policy.observe("u2net", 8.0)
+    assert policy.inference_seconds("u2netp") == 2.0
+
+
+def test_best_model_while_it_fits(policy):
+    policy.observe("u2net", 2.0)
+    choice = policy.choose(queued=0, waited=0.0)
+    assert choice.model == "u2net"
+    assert "with 0 queued" in choice.reason
+
+
+def test_steps_down_under_load(policy):
+    policy.observe("u2net", 2.0)
+    policy.observe("u2netp", 0.5)
+    # 20 rounds x 2 s = 40 s > 30 s; 20 x 0.5 s fits
+    assert policy.choose(queued=19, waited=0.0).model == "u2netp"
+
+
+def test_time_already_waited_counts(policy):
+    policy.observe("u2net", 2.0)
+    assert policy.choose(queued=0, waited=27.0).model == "u2net"
+    assert policy.choose(queued=0, waited=29.0).model == "u2netp"
+
+
+def test_slow_observations_switch_the_choice(policy):
+    policy.observe("u2net", 2.0)
+    assert policy.choose(queued=3, waited=0.0).model == "u2net"
+    # The average catches up with a slowdown within a few jobs
+    for _ in range(10):
+        policy.observe("u2net", 20.0)
+    assert policy.choose(queued=3, waited=0.0).model == "u2netp"
+
+
+def test_recovery_needs_the_lower_bar(policy):
+    policy.observe("u2net", 2.0)
+    policy.observe("u2netp", 0.5)
+    assert policy.choose(queued=19, waited=0.0).model == "u2netp"
+
+    # 12 x 2 s = 24 s: under the SLO, not under 30 x 0.7 = 21 s
+    assert policy.choose(queued=11, waited=0.0).model == "u2netp"
+    choice = policy.choose(queued=9, waited=0.0)
+    assert choice.model == "u2net"
+    assert "<= 21.0s" in choice.reason
+
+    # Back on u2net, the ordinary SLO applies again
+    assert policy.choose(queued=11, waited=0.0).model == "u2net"
+
+
+def test_lightest_model_when_nothing_fits(policy):
+    policy.observe("u2net", 2.0)
+    policy.observe("u2netp", 0.5)
+    choice = policy.choose(queued=100, waited=0.0)
+    assert choice.model == "u2netp"
+    assert choice.reason.startswith("over SLO")
+
+
+@pytest.mark.parametrize(("slow", "model", "lane"), [(False, "u2net", LANE_BULK), (True, "u2netp", LANE_INTERACTIVE)])
+def test_auto_jobs_are_laned_by_the_chosen_model(policy, monkeypatch, slow, model, lane):
+    policy.observe("u2net", 100.0 if slow else 1.0)
+    monkeypatch.setattr(worker_module, "POLICY", policy)
+    admitted, processed = [], []
+
+    @asynccontextmanager
+    async def slot(lane, client, model, cost, enqueued_at=None):
+        admitted.append((lane, model, cost))
+        yield
+
+    async def process_job(task_id, request, payload, base_url, attempts):
+        processed.append(request.model)
+
+    monkeypatch.setattr(worker_module.SCHEDULER, "slot", slot)
+    monkeypatch.setattr(worker_module, "process_job", process_job)
+
+    async def scenario():
+        request = ProcessingRequest(email="user@example.com", model="auto")
+        await enqueue_image_processing(request, b"image", "photo.png", task_id="t1", base_url="http://test/")
+        # Not chosen yet: shared stream, bulk lane
+        assert get_task("t1", ["lane"])["lane"] == LANE_BULK
+        job_queue.ensure_group([job_queue.STREAM_KEY])
+        (job,) = job_queue.consume("test", 1, 0)
+        assert job.fields["queue"] == job_queue.SHARED_QUEUE
+
+        await worker_module.QueueWorker(consumer="test", models="*")._handle(job)
+
+    asyncio.run(scenario())
+    cost = {"u2net": 4.0, "u2netp": 1.0}[model]
+    assert admitted == [(lane, model, cost)]
+    assert processed == [model]
+    task = get_task("t1", ["model", "lane"])
+    assert (task["model"], task["lane"]) == (model, lane)
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from app import tasks
+from app.config import settings
+from app.models import ProcessingRequest
+from app.services.executors import cpu_executor
+from app.services.memory_budget import estimate_job_bytes
+from app.services.task_state import get_task, init_task
+
+
+def request(**fields) -> ProcessingRequest:
+    return ProcessingRequest(email="user@example.com", **fields)
+
+
+@pytest.fixture
+def previews(monkeypatch):
+    monkeypatch.setattr(settings, "PREVIEW_ENABLED", True)
+    monkeypatch.setattr(settings, "PREVIEW_MODEL", "u2netp")
+    monkeypatch.setattr(settings, "WORKER_MODELS", "")
+
+
+def test_previews_are_opt_in(monkeypatch):
+    monkeypatch.setattr(settings, "PREVIEW_ENABLED", False)
+    assert not tasks.wants_preview(request(model="u2net"))
+
+
+def test_wants_preview(previews):
+    assert tasks.wants_preview(request(model="u2net"))
+    assert tasks.wants_preview(request(model="auto"))
+    # Already as fast as the preview, or nothing to preview
+    assert not tasks.wants_preview(request(model="u2netp"))
+    assert not tasks.wants_preview(request(model="u2net", output_format="mask"))
+    assert not tasks.wants_preview(request(model="u2net", animated=True))
+
+
+def test_preview_needs_a_free_cpu_slot(previews, monkeypatch):
+    assert tasks.preview_fits_here()
+    monkeypatch.setattr(cpu_executor, "_active", cpu_executor.max_workers)
+    assert not tasks.preview_fits_here()
+
+
+def test_dedicated_workers_skip_the_preview_model(previews, monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_MODELS", "u2net")
+    assert not tasks.preview_fits_here()
+    for models in ("u2net,u2netp", "*", "u2net,*"):
+        monkeypatch.setattr(settings, "WORKER_MODELS", models)
+        assert tasks.preview_fits_here()
+
+
+def test_preview_memory_is_reserved_with_the_job(previews):
+    def enqueue(task_id: str, req: ProcessingRequest) -> str:
+        return asyncio.run(tasks.enqueue_image_processing(
+            req, b"x" * 100, "a.png", task_id=task_id, base_url="http://test/", client="c", dimensions=(4000, 3000)
+        ))
+
+    with_preview = enqueue("t1", request(model="u2net"))
+    without = enqueue("t2", request(model="u2netp"))
+    base = estimate_job_bytes(4000, 3000, 1.0, 100)
+    assert int(get_task(without, ["mem_estimate"])["mem_estimate"]) == base
+    assert int(get_task(with_preview, ["mem_estimate"])["mem_estimate"]) > base
+
+
+def run_job(monkeypatch, preview_seconds: float, full_seconds: float) -> dict:
+    """process_job with stand-ins for the preview render and the pipeline."""
+    events = []
+
+    async def fake_run_cpu(fn, *args):
+        assert fn is tasks.render_preview
+        try:
+            await asyncio.sleep(preview_seconds)
+        except asyncio.CancelledError:
+            events.append("preview cancelled")
+            raise
+        events.append("preview rendered")
+        return b"RIFF preview"
+
+    async def fake_submit(job, trace=None):
+        await asyncio.sleep(full_seconds)
+        events.append("full result")
+        return {"ext": "png", "file_url": "http://test/full.png", "filename": "t1.png", "storage": "local"}
+
+    monkeypatch.setattr(tasks, "run_cpu", fake_run_cpu)
+    monkeypatch.setattr(tasks.PIPELINE, "submit", fake_submit)
+    init_task("t1", status="queued")
+    asyncio.run(tasks.process_job("t1", request(model="u2net"), b"bytes", "http://test/"))
+    task = get_task("t1", ["file_url", "preview_url"])
+    task["events"] = events
+    return task
+
+
+def test_preview_is_cancelled_when_the_full_result_wins(previews, monkeypatch):
+    task = run_job(monkeypatch, preview_seconds=5, full_seconds=0.01)
+    assert task["events"] == ["full result", "preview cancelled"]
+    assert (task["status"], task["file_url"], task["preview_url"]) == ("completed", "http://test/full.png", None)
+
+
+def test_preview_is_published_before_the_full_result(previews, monkeypatch):
+    task = run_job(monkeypatch, preview_seconds=0.01, full_seconds=0.3)
+    assert task["events"] == ["preview rendered", "full result"]
+    assert task["preview_url"].endswith(".preview.webp")
+    assert task["file_url"] == "http://test/full.png"
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.config import settings
+from app.routers import admin
+from app.services import profiling
+from app.services.executors import io_executor
+
+HEADERS = {"X-Admin-Token": "admin-secret"}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "admin-secret")
+    application = FastAPI()
+    application.include_router(admin.router)
+    return application
+
+
+def client(app) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def busy(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profile_runs_off_the_io_pool_and_one_at_a_time(app):
+    async def run():
+        async with client(app) as http:
+            first = asyncio.create_task(http.post("/admin/profile?seconds=0.5&interval_ms=5", headers=HEADERS))
+            await asyncio.sleep(0.2)
+            # The sampler has its own thread; no I/O pool worker is held
+            assert "profiler" in {t.name for t in threading.enumerate()}
+            assert io_executor.active == 0
+            second = await http.post("/admin/profile?seconds=0.1", headers=HEADERS)
+            return await first, second
+
+    stop = threading.Event()
+    worker = threading.Thread(target=busy, args=(stop,), name="busy-worker")
+    worker.start()
+    try:
+        first, second = asyncio.run(run())
+    finally:
+        stop.set()
+        worker.join()
+
+    assert second.status_code == 409
+    assert first.status_code == 200
+    assert first.headers["X-Profile-Clock"] == "wall"
+    assert any(line.startswith("busy-worker;") for line in first.text.splitlines())
+
+
+def test_admin_routes_need_the_token(app, monkeypatch):
+    async def run():
+        async with client(app) as http:
+            return (
+                await http.post("/admin/profile?seconds=0.1"),
+                await http.post("/admin/profile?seconds=0.1", headers={"X-Admin-Token": "wrong"}),
+            )
+
+    assert [r.status_code for r in asyncio.run(run())] == [403, 403]
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "")
+    assert asyncio.run(run())[0].status_code == 404
+
+
+def test_idle_threads_are_left_out():
+    parked = threading.Event()
+    idle = threading.Thread(target=parked.wait, name="parked-thread", daemon=True)
+    idle.start()
+    try:
+        wall = profiling.profile_process(0.05, 0.005, include_idle=True)
+        cpu = profiling.profile_process(0.05, 0.005)
+    finally:
+        parked.set()
+    assert "parked-thread;" in wall
+    assert "parked-thread;" not in cpu
+
+
+def test_run_profile_passes_errors_on(monkeypatch):
+    def broken(*args):
+        raise RuntimeError("sampler failed")
+
+    monkeypatch.setattr(profiling, "profile_process", broken)
+    with pytest.raises(RuntimeError):
+        asyncio.run(profiling.run_profile(0.01, 0.01))
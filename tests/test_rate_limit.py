@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from fastapi_limiter import FastAPILimiter
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.config import settings
+from app.redis_client import make_async_client
+from app.services import rate_limit
+from app.services.rate_limit import LOAD_TEST_HEADER, LocalBuckets, RateLimiter
+
+
+def run(coro_fn):
+    """Runs `coro_fn()` with fastapi-limiter set up on the fake Redis."""
+
+    async def main():
+        await FastAPILimiter.init(make_async_client(decode_responses=True))
+        try:
+            return await coro_fn()
+        finally:
+            await FastAPILimiter.redis.aclose()
+            FastAPILimiter.redis = None
+
+    return asyncio.run(main())
+
+
+def make_request(ip: str, headers: dict = None) -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/process",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": (ip, 50000),
+    })
+
+
+def test_all_windows_are_checked_in_one_call(redis):
+    limiter = RateLimiter(2, 60, windows=[(3, 3600)])
+
+    async def check():
+        results = [await limiter._check_redis("client", "POST") for _ in range(3)]
+        # The short window refills; the hourly one is now the one that is full
+        await FastAPILimiter.redis.delete(f"{FastAPILimiter.prefix}:{{client}}:POST:2/60")
+        results += [await limiter._check_redis("client", "POST") for _ in range(2)]
+        return results
+
+    first, second, blocked, again, hourly = run(check)
+    assert (first, second, again) == (0, 0, 0)
+    assert 59_000 < blocked <= 60_000
+    assert 3_500_000 < hourly <= 3_600_000
+
+
+def test_rejected_request_is_not_counted(redis):
+    limiter = RateLimiter(1, 60, windows=[(5, 3600)])
+
+    async def check():
+        for _ in range(4):
+            await limiter._check_redis("client", "POST")
+
+    run(check)
+    assert redis.get(f"fastapi-limiter:{{client}}:POST:1/60") == b"1"
+    assert redis.get(f"fastapi-limiter:{{client}}:POST:5/3600") == b"1"
+    assert 0 < redis.pttl(f"fastapi-limiter:{{client}}:POST:5/3600") <= 3_600_000
+
+
+def test_over_limit_raises_429_with_retry_after(redis):
+    limiter = RateLimiter(1, 30)
+
+    async def call():
+        await limiter(make_request("10.0.0.1"), Response())
+        with pytest.raises(HTTPException) as exc:
+            await limiter(make_request("10.0.0.1"), Response())
+        # Another client is not affected
+        await limiter(make_request("10.0.0.2"), Response())
+        return exc.value
+
+    error = run(call)
+    assert error.status_code == 429
+    assert 1 <= int(error.headers["Retry-After"]) <= 30
+
+
+def test_rejected_client_is_answered_locally(redis, monkeypatch):
+    monkeypatch.setattr(rate_limit, "LOCAL_BUCKETS", LocalBuckets(100))
+    limiter = RateLimiter(1, 30)
+    calls = []
+    check_redis = limiter._check_redis
+
+    async def counting(rate_key, method):
+        calls.append(rate_key)
+        return await check_redis(rate_key, method)
+
+    monkeypatch.setattr(limiter, "_check_redis", counting)
+
+    async def call():
+        await limiter(make_request("10.0.0.3"), Response())
+        for _ in range(3):
+            with pytest.raises(HTTPException):
+                await limiter(make_request("10.0.0.3"), Response())
+
+    run(call)
+    # The first rejection comes from Redis, the rest of the window is local
+    assert len(calls) == 2
+
+
+def test_load_test_token_skips_the_limits(redis, monkeypatch):
+    monkeypatch.setattr(settings, "LOAD_TEST_TOKEN", "secret")
+    limiter = RateLimiter(1, 30)
+
+    async def call():
+        for _ in range(5):
+            await limiter(make_request("10.0.0.4", {LOAD_TEST_HEADER: "secret"}), Response())
+        await limiter(make_request("10.0.0.4"), Response())
+        with pytest.raises(HTTPException):
+            await limiter(make_request("10.0.0.4", {LOAD_TEST_HEADER: "wrong"}), Response())
+
+    run(call)
+
+
+def test_load_test_token_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(settings, "LOAD_TEST_TOKEN", "")
+    assert not rate_limit.is_load_test(make_request("10.0.0.5", {LOAD_TEST_HEADER: ""}))
+
+
+def test_local_buckets_never_reject_what_redis_admits():
+    buckets = LocalBuckets(10)
+    windows = [(3, 60)]
+    for _ in range(6):
+        assert buckets.check("k", windows) is None
+        buckets.admitted("k", windows)
+    # Only past twice the fixed-window limit is the client certainly over it
+    assert buckets.check("k", windows) > 0
@@ -0,0 +1,205 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from app.config import settings
+from app.routers import render as render_router
+from app.services import renderer
+from app.services.renderer import RenderParams, _LRU, composite, parse_color, render, render_key
+from app.services.storage import ASSET_MASK, ASSET_SOURCE, build_asset_key, get_storage
+from app.services.task_state import init_task
+
+SIZE = (40, 30)
+
+
+def reference_blend(rgb: np.ndarray, alpha: np.ndarray, background: np.ndarray) -> np.ndarray:
+    """out = fg * a + bg * (1 - a) in floating point, rounded to the nearest level."""
+    a = alpha[..., None].astype(np.float64) / 255
+    out = rgb.astype(np.float64) * a + np.broadcast_to(background, rgb.shape).astype(np.float64) * (1 - a)
+    return np.rint(out).astype(np.uint8)
+
+
+def source_and_mask():
+    rng = np.random.default_rng(3)
+    rgb = rng.integers(0, 256, (SIZE[1], SIZE[0], 3), dtype=np.uint8)
+    alpha = rng.integers(0, 256, (SIZE[1], SIZE[0]), dtype=np.uint8)
+    alpha[:, :4] = 255
+    alpha[:, -4:] = 0
+    return rgb, alpha
+
+
+def png(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    """Fresh LRUs, and a count of asset reads behind them."""
+    monkeypatch.setattr(renderer, "_SOURCES", _LRU(max_items=2))
+    monkeypatch.setattr(renderer, "_RENDERS", _LRU(max_bytes=1024 * 1024))
+    reads = []
+    read_asset = renderer.read_asset
+
+    def counting(task_id, name, assets):
+        reads.append((task_id, name))
+        return read_asset(task_id, name, assets)
+
+    monkeypatch.setattr(renderer, "read_asset", counting)
+    return reads
+
+
+@pytest.fixture
+def task(redis):
+    """A completed task whose source and mask are stored locally."""
+    rgb, alpha = source_and_mask()
+    storage = get_storage("local")
+    storage.put_sync(build_asset_key("t1", ASSET_SOURCE), png(rgb), "image/png")
+    storage.put_sync(build_asset_key("t1", ASSET_MASK), png(alpha), "image/png")
+    init_task("t1", status="completed", assets="local", scale=1.0, etag="result-etag")
+    return rgb, alpha
+
+
+def test_composite_matches_reference_blend():
+    rgb, alpha = source_and_mask()
+    background = np.random.default_rng(4).integers(0, 256, rgb.shape, dtype=np.uint8)
+    np.testing.assert_array_equal(composite(rgb, alpha, background), reference_blend(rgb, alpha, background))
+
+    solid = np.array([10, 200, 30], dtype=np.uint8)[None, None, :]
+    out = composite(rgb, alpha, solid)
+    np.testing.assert_array_equal(out, reference_blend(rgb, alpha, solid))
+    # Opaque pixels keep the foreground, transparent ones take the background
+    np.testing.assert_array_equal(out[:, :4], rgb[:, :4])
+    assert (out[:, -4:] == [10, 200, 30]).all()
+
+
+def test_composite_matches_pillow():
+    rgb, alpha = source_and_mask()
+    background = np.full_like(rgb, 255)
+    expected = Image.composite(Image.fromarray(rgb), Image.fromarray(background), Image.fromarray(alpha))
+    difference = np.abs(composite(rgb, alpha, background).astype(np.int16) - np.asarray(expected, dtype=np.int16))
+    assert difference.max() <= 1
+
+
+def test_parse_color():
+    assert parse_color("#ff0000") == (255, 0, 0)
+    assert parse_color("00ff00") == (0, 255, 0)
+    assert parse_color("#00f") == (0, 0, 255)
+    assert parse_color("white") == (255, 255, 255)
+    assert parse_color("transparent") is None
+    assert parse_color("") is None
+    with pytest.raises(ValueError):
+        parse_color("not-a-color")
+
+
+def test_lru_by_count():
+    lru = _LRU(max_items=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    assert lru.get("a") == 1  # a is now the most recent
+    lru.put("c", 3)
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+
+
+def test_lru_by_bytes():
+    lru = _LRU(max_bytes=10)
+    lru.put("a", b"aaaa", 4)
+    lru.put("b", b"bbbb", 4)
+    lru.put("c", b"cccc", 4)
+    assert lru.get("a") is None
+    assert lru.nbytes == 8
+    # Replacing an entry re-counts it; one over the whole budget is not kept
+    lru.put("b", b"bb", 2)
+    assert lru.nbytes == 6
+    lru.put("huge", b"x" * 11, 11)
+    assert lru.get("huge") is None
+    assert lru.nbytes == 6
+
+
+def test_render_transparent_png(task, caches):
+    rgb, alpha = task
+    with Image.open(io.BytesIO(render("t1", "local", 1.0, "result-etag", RenderParams()))) as result:
+        assert result.mode == "RGBA"
+        np.testing.assert_array_equal(np.asarray(result), np.dstack([rgb, alpha]))
+
+
+def test_render_on_color(task, caches):
+    rgb, alpha = task
+    params = RenderParams(background=(10, 200, 30))
+    with Image.open(io.BytesIO(render("t1", "local", 1.0, "result-etag", params))) as result:
+        assert result.mode == "RGB"
+        solid = np.array([10, 200, 30], dtype=np.uint8)[None, None, :]
+        np.testing.assert_array_equal(np.asarray(result), reference_blend(rgb, alpha, solid))
+
+
+def test_render_jpeg_defaults_to_white(task, caches):
+    params = RenderParams(output_format="jpg", width=20)
+    with Image.open(io.BytesIO(render("t1", "local", 1.0, "result-etag", params))) as result:
+        assert result.format == "JPEG"
+        assert result.size == (20, 15)
+        # The fully transparent strip on the right comes out white
+        assert min(result.getpixel((19, 7))) > 240
+
+
+def test_render_caches(task, caches):
+    first = render("t1", "local", 1.0, "result-etag", RenderParams(width=20))
+    assert caches == [("t1", ASSET_SOURCE), ("t1", ASSET_MASK)]
+
+    # Same parameters: the finished bytes; other parameters: the decoded sources
+    assert render("t1", "local", 1.0, "result-etag", RenderParams(width=20)) is first
+    render("t1", "local", 1.0, "result-etag", RenderParams(width=10))
+    assert len(caches) == 2
+
+    # A new result (etag) is a new derivative, from the same decoded sources
+    assert render("t1", "local", 1.0, "new-etag", RenderParams(width=20)) is not first
+    assert len(caches) == 2
+
+
+def test_render_missing_assets(caches, redis):
+    with pytest.raises(FileNotFoundError):
+        render("t-gone", "local", 1.0, "", RenderParams())
+
+
+def test_etag_and_304_before_rendering(client, task, caches, monkeypatch):
+    response = client.get("/render/t1", params={"width": 20, "bg": "#0a0a0a", "format": "webp"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    etag = response.headers["etag"]
+    params = RenderParams(width=20, background=(10, 10, 10), output_format="webp", quality=settings.DEFAULT_QUALITY)
+    assert etag == f'"{render_key("t1", "result-etag", params)}"'
+    assert "max-age" in response.headers["cache-control"]
+
+    # Known before rendering: a matching If-None-Match never reaches render()
+    calls = []
+    monkeypatch.setattr(render_router, "render", lambda *args: calls.append(args) or b"")
+    again = client.get(
+        "/render/t1", params={"width": 20, "bg": "#0a0a0a", "format": "webp"}, headers={"If-None-Match": etag}
+    )
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+    assert again.content == b""
+    assert calls == []
+
+    # Other parameters are another derivative
+    other = client.get("/render/t1", params={"width": 10, "format": "webp"}, headers={"If-None-Match": etag})
+    assert other.status_code == 200
+    assert len(calls) == 1
+
+
+def test_render_statuses(client, task, caches):
+    assert client.get("/render/t1", params={"format": "gif"}).status_code == 400
+    assert client.get("/render/t1", params={"bg": "not-a-color"}).status_code == 400
+    assert client.get("/render/nope").status_code == 404
+
+    init_task("t2", status="processing")
+    assert client.get("/render/t2").status_code == 423
+    init_task("t3", status="failed")
+    assert client.get("/render/t3").status_code == 410
+    init_task("t4", status="completed")
+    assert client.get("/render/t4").status_code == 409
+    init_task("t5", status="completed", assets="local", etag="x")
+    assert client.get("/render/t5").status_code == 410
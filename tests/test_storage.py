@@ -0,0 +1,172 @@
+import asyncio
+import io
+import os
+import time
+
+import pytest
+
+from app.config import settings
+from app.services import s3_storage
+from app.services.s3_storage import PART_SIZE
+from app.services.storage import ASSET_PREFIX, RESULT_PREFIX, LocalStorage, SignedUrl
+
+
+async def chunked(data: bytes, size: int = 1024 * 1024, fail: bool = False):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+    if fail:
+        raise RuntimeError("client went away")
+
+
+@pytest.fixture
+def local(tmp_path):
+    backend = LocalStorage(str(tmp_path / "out"), str(tmp_path / "assets"), concurrency=2)
+    yield backend
+    backend.shutdown()
+
+
+def exercise(backend) -> None:
+    """The same round trip for every backend."""
+
+    async def run():
+        await backend.put(f"{RESULT_PREFIX}a.png", b"result", "image/png")
+        await backend.put(f"{ASSET_PREFIX}a.mask.png", b"mask", "image/png")
+        assert await backend.get(f"{RESULT_PREFIX}a.png") == b"result"
+        assert await backend.read_head(f"{RESULT_PREFIX}a.png", 3) == b"res"
+        assert (await backend.stat(f"{RESULT_PREFIX}a.png")).size == 6
+        assert await backend.stat(f"{RESULT_PREFIX}missing.png") is None
+        with pytest.raises(FileNotFoundError):
+            await backend.get(f"{RESULT_PREFIX}missing.png")
+
+        assert [obj.key for obj in await backend.list(RESULT_PREFIX)] == [f"{RESULT_PREFIX}a.png"]
+        assert [obj.key for obj in await backend.list(ASSET_PREFIX)] == [f"{ASSET_PREFIX}a.mask.png"]
+
+        await backend.delete(f"{RESULT_PREFIX}a.png", f"{ASSET_PREFIX}a.mask.png")
+        assert await backend.list(RESULT_PREFIX) == []
+        assert await backend.stat(f"{ASSET_PREFIX}a.mask.png") is None
+        # Deleting what is gone is not an error
+        await backend.delete(f"{RESULT_PREFIX}a.png")
+
+    asyncio.run(run())
+
+
+def test_local_round_trip(local):
+    exercise(local)
+
+
+def test_s3_round_trip(s3):
+    exercise(s3)
+
+
+def test_local_put_stream_is_atomic(local):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    asyncio.run(local.put_stream(f"{RESULT_PREFIX}big.bin", chunked(data), "application/octet-stream"))
+    assert local.get_sync(f"{RESULT_PREFIX}big.bin") == data
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(local.put_stream(f"{RESULT_PREFIX}broken.bin", chunked(data, fail=True), "application/octet-stream"))
+    # Neither the object nor its temporary file is left behind
+    assert os.listdir(os.path.dirname(local.path(f"{RESULT_PREFIX}big.bin"))) == ["big.bin"]
+
+
+def test_local_cleanup_sweeps_old_objects(local):
+    local.put_sync(f"{RESULT_PREFIX}old.png", b"x", "image/png")
+    local.put_sync(f"{ASSET_PREFIX}old.source", b"x", "image/png")
+    old = time.time() - 3600
+    os.utime(local.path(f"{RESULT_PREFIX}old.png"), (old, old))
+    os.utime(local.path(f"{ASSET_PREFIX}old.source"), (old, old))
+    local.put_sync(f"{RESULT_PREFIX}new.png", b"x", "image/png")
+
+    assert local.cleanup_sync(time.time() - 60) == 2
+    assert [obj.key for obj in local.list_sync(RESULT_PREFIX)] == [f"{RESULT_PREFIX}new.png"]
+
+
+def test_local_rejects_unknown_prefixes(local):
+    with pytest.raises(ValueError):
+        local.put_sync("elsewhere/a.png", b"x", "image/png")
+
+
+def test_s3_put_stream_small_is_one_put(s3):
+    asyncio.run(s3.put_stream(f"{RESULT_PREFIX}small.webm", chunked(b"x" * 1000), "video/webm"))
+    head = s3.client.head_object(Bucket=s3.bucket, Key=f"{RESULT_PREFIX}small.webm")
+    assert head["ContentLength"] == 1000
+    assert head["ContentType"] == "video/webm"
+
+
+def test_s3_put_stream_multipart(s3):
+    data = os.urandom(PART_SIZE + 3 * 1024 * 1024)
+    asyncio.run(s3.put_stream(f"{RESULT_PREFIX}big.webm", chunked(data), "video/webm"))
+
+    assert s3.get_sync(f"{RESULT_PREFIX}big.webm") == data
+    # Two parts: one full PART_SIZE part and the rest
+    head = s3.client.head_object(Bucket=s3.bucket, Key=f"{RESULT_PREFIX}big.webm")
+    assert head["ETag"].strip('"').endswith("-2")
+    assert head["ContentType"] == "video/webm"
+
+
+def test_s3_put_stream_aborts_on_error(s3):
+    data = os.urandom(PART_SIZE + 1024)
+    with pytest.raises(RuntimeError):
+        asyncio.run(s3.put_stream(f"{RESULT_PREFIX}broken.webm", chunked(data, fail=True), "video/webm"))
+
+    assert s3.stat_sync(f"{RESULT_PREFIX}broken.webm") is None
+    assert s3.client.list_multipart_uploads(Bucket=s3.bucket).get("Uploads", []) == []
+
+
+def test_s3_put_file_and_batch_delete(s3):
+    s3.put_file_sync(f"{ASSET_PREFIX}a.source", io.BytesIO(b"source"), "image/png")
+    for i in range(3):
+        s3.put_sync(f"{RESULT_PREFIX}{i}.png", b"x", "image/png")
+    assert s3.get_sync(f"{ASSET_PREFIX}a.source") == b"source"
+
+    s3.delete_sync([f"{RESULT_PREFIX}{i}.png" for i in range(3)])
+    assert list(s3.list_sync(RESULT_PREFIX)) == []
+
+
+def test_presign_cache_reuses_until_the_refresh_margin(s3, monkeypatch):
+    monkeypatch.setattr(settings, "PRESIGNED_URL_EXPIRY", 3600)
+    monkeypatch.setattr(settings, "PRESIGN_REFRESH_MARGIN_SECONDS", 600)
+    key = f"{RESULT_PREFIX}a.png"
+
+    first = s3.sign_sync(key, download_name="a.png")
+    assert first is s3.sign_sync(key, download_name="a.png")
+    assert asyncio.run(s3.sign(key, download_name="a.png")) is first
+    # Different response overrides are a different URL
+    other = s3.sign_sync(key, download_name="b.png")
+    assert other is not first and "b.png" in other.url
+
+    # Still valid, but within the margin: signed afresh
+    cache_key = (key, "a.png", None, None)
+    s3._signed[cache_key] = SignedUrl(first.url, time.time() + 599)
+    refreshed = s3.sign_sync(key, download_name="a.png")
+    assert refreshed.expires_at > time.time() + 3000
+
+    # Just outside the margin: reused
+    s3._signed[cache_key] = SignedUrl("https://cached.example/a.png", time.time() + 601)
+    assert s3.sign_sync(key, download_name="a.png").url == "https://cached.example/a.png"
+
+
+def test_presign_cache_is_bounded_lru(s3, monkeypatch):
+    monkeypatch.setattr(settings, "PRESIGN_CACHE_SIZE", 2)
+    misses = []
+    monkeypatch.setattr(s3_storage.PRESIGN_MISSES, "inc", lambda *a, **kw: misses.append(1))
+
+    a = s3.sign_sync(f"{RESULT_PREFIX}a.png")
+    s3.sign_sync(f"{RESULT_PREFIX}b.png")
+    assert s3.sign_sync(f"{RESULT_PREFIX}a.png") is a  # a is now the most recent
+    s3.sign_sync(f"{RESULT_PREFIX}c.png")  # evicts b
+
+    assert len(s3._signed) == 2
+    assert s3.sign_sync(f"{RESULT_PREFIX}a.png") is a
+    s3.sign_sync(f"{RESULT_PREFIX}b.png")
+    assert len(misses) == 4
+
+
+def test_s3_presigned_url_downloads(s3):
+    import urllib.request
+
+    s3.put_sync(f"{RESULT_PREFIX}a.png", b"result", "image/png")
+    url = s3.presign_sync(f"{RESULT_PREFIX}a.png", download_name="a.png")
+    with urllib.request.urlopen(url) as response:
+        assert response.read() == b"result"
+        assert 'filename="a.png"' in response.headers["Content-Disposition"]
@@ -0,0 +1,95 @@
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from fastapi_limiter import FastAPILimiter
+
+from app.config import settings
+from app.redis_client import make_async_client
+from app.routers import status as status_router
+from app.services.task_state import get_task, get_task_with_ttl, init_task, migrate_legacy, update_task
+
+LEGACY = {"status": "completed", "email": "user@example.com", "filename": "t1.png", "error": None, "s3": False}
+
+
+def seed_legacy(redis, task_id: str = "t1", ttl: int = 1000) -> None:
+    """A task as older releases stored it: one JSON string with SETEX."""
+    redis.setex(task_id, ttl, json.dumps(LEGACY))
+
+
+def test_hash_round_trip(redis):
+    init_task("t1", status="queued", email="user@example.com", scale=1.5, s3=True, error=None)
+    assert redis.type("t1") == b"hash"
+    assert 0 < redis.ttl("t1") <= settings.REDIS_TTL_SECONDS
+
+    update_task("t1", status="processing", attempts=1)
+    update_task("t1", email=None)
+    task = get_task("t1", ["email", "scale", "s3", "attempts", "error"])
+    assert task == {"status": "processing", "email": None, "scale": "1.5", "s3": "1", "attempts": "1", "error": None}
+
+
+def test_missing_task_is_none(redis):
+    assert get_task("nope", ["filename"]) is None
+    assert get_task_with_ttl("nope", ["filename"]) == (None, 0)
+
+
+def test_get_task_converts_legacy_json(redis):
+    seed_legacy(redis)
+
+    task = get_task("t1", ["email", "filename", "error", "s3"])
+    assert task == {"status": "completed", "email": "user@example.com", "filename": "t1.png", "error": None, "s3": "0"}
+    assert redis.type("t1") == b"hash"
+    # The remaining lifetime is kept, not reset to REDIS_TTL_SECONDS
+    assert 990 < redis.ttl("t1") <= 1000
+
+
+def test_get_task_with_ttl_converts_legacy_json(redis):
+    seed_legacy(redis, ttl=500)
+    task, ttl = get_task_with_ttl("t1", ["filename"])
+    assert task["filename"] == "t1.png"
+    assert 490 < ttl <= 500
+
+
+def test_update_task_converts_legacy_json_then_applies(redis):
+    seed_legacy(redis)
+    update_task("t1", email_status="sent")
+
+    assert redis.type("t1") == b"hash"
+    task = get_task("t1", ["email", "email_status"])
+    assert (task["email"], task["email_status"]) == ("user@example.com", "sent")
+    # A write refreshes the TTL as for any task
+    assert redis.ttl("t1") > 1000
+
+
+def test_migrate_legacy_is_idempotent(redis):
+    seed_legacy(redis)
+    assert migrate_legacy("t1") is True
+    # Already a hash (another reader won), or nothing there
+    assert migrate_legacy("t1") is False
+    assert migrate_legacy("nope") is False
+
+
+def test_legacy_without_ttl_stays_without(redis):
+    redis.set("t1", json.dumps(LEGACY))
+    assert get_task("t1", ["filename"])["filename"] == "t1.png"
+    assert redis.ttl("t1") == -1
+
+
+def test_status_endpoint_reads_legacy_tasks(redis):
+    seed_legacy(redis)
+    app = FastAPI()
+    app.include_router(status_router.router)
+
+    async def init_limiter():
+        await FastAPILimiter.init(make_async_client(decode_responses=True))
+
+    app.add_event_handler("startup", init_limiter)
+    with TestClient(app) as client:
+        response = client.get("/status/t1")
+        missing = client.get("/status/nope")
+    FastAPILimiter.redis = None
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "completed"
+    assert missing.status_code == 404
+    assert redis.type("t1") == b"hash"
@@ -0,0 +1,135 @@
+import asyncio
+import io
+import os
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.config import settings
+from app.services import job_queue
+from app.services.job_queue import Job
+from app.services.task_state import get_task
+
+
+def png(width: int = 64, height: int = 48, noise: bool = False) -> bytes:
+    if noise:
+        image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    else:
+        image = Image.new("RGB", (width, height), (200, 30, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", compress_level=0 if noise else 6)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def s3_uploads(s3, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_BACKEND", "s3")
+    return s3
+
+
+def start(client: TestClient, filename: str = "photo.png") -> dict:
+    response = client.post("/uploads/", data={"filename": filename})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def upload_to_store(upload: dict, data: bytes, content_type: str = "image/png") -> httpx.Response:
+    """What the browser does: the form fields, then the file, straight to the store."""
+    return httpx.post(upload["url"], data=upload["fields"], files={"file": ("photo.png", data, content_type)})
+
+
+def complete(client: TestClient, upload: dict, **form) -> "httpx.Response":
+    return client.post(f"/uploads/{upload['upload_id']}/complete", data={"email": "user@example.com", **form})
+
+
+def test_direct_upload_flow(client, s3_uploads):
+    upload = start(client)
+    key = upload["fields"]["key"]
+    assert key.startswith("uploads/") and key.endswith(".png")
+    assert upload["max_bytes"] == settings.MAX_ANIMATION_UPLOAD_MB * 1024 * 1024
+
+    # Completing before the file is there is refused
+    assert complete(client, upload).status_code == 409
+
+    data = png()
+    assert upload_to_store(upload, data).status_code in (200, 201, 204)
+    assert s3_uploads.get_sync(key) == data
+
+    response = complete(client, upload, model="u2netp")
+    assert response.status_code == 202, response.text
+    task_id = response.json()["processing_id"]
+    assert get_task(task_id, ["status"])["status"] == "queued"
+
+    # The job carries the object key instead of the bytes
+    streams = job_queue.worker_streams("")
+    job_queue.ensure_group(streams)
+    [job] = job_queue.consume("test", count=10, block_ms=0, streams=streams)
+    assert job.task_id == task_id
+    assert (job.fields["object_key"], job.fields["storage"]) == (key, "s3")
+    assert job.payload() == data
+
+    # One upload is one job
+    assert complete(client, upload).status_code == 404
+
+
+def test_unknown_upload_is_404(client, s3_uploads):
+    assert complete(client, {"upload_id": "nope"}).status_code == 404
+
+
+def test_local_backend_has_no_direct_uploads(client, monkeypatch):
+    monkeypatch.setattr(settings, "STORAGE_BACKEND", "local")
+    response = client.post("/uploads/", data={"filename": "photo.png"})
+    assert response.status_code == 501
+
+
+def test_unsupported_extension_is_refused(client, s3_uploads):
+    assert client.post("/uploads/", data={"filename": "notes.txt"}).status_code == 400
+
+
+def test_complete_rejects_content_that_is_not_an_image(client, s3_uploads):
+    upload = start(client)
+    # Declared as image/png, but the bytes are not
+    s3_uploads.put_sync(upload["fields"]["key"], b"#!/bin/sh\necho hi\n" * 100, "image/png")
+
+    response = complete(client, upload)
+    assert response.status_code == 400
+    assert "header" in response.json()["detail"]
+    # Still pending: the client may upload a proper file and retry
+    s3_uploads.put_sync(upload["fields"]["key"], png(), "image/png")
+    assert complete(client, upload).status_code == 202
+
+
+def test_complete_holds_stills_to_the_still_size_limit(client, s3_uploads):
+    upload = start(client)
+    # Under the animation limit the form allowed, over the still-image one
+    data = png(1400, 1400, noise=True)
+    assert 5 * 1024 * 1024 < len(data) < upload["max_bytes"]
+    s3_uploads.put_sync(upload["fields"]["key"], data, "image/png")
+
+    response = complete(client, upload)
+    assert response.status_code == 413
+    assert job_queue.backlog(job_queue.worker_streams("")) == {s: 0 for s in job_queue.worker_streams("")}
+
+
+def test_complete_enforces_the_pixel_budget(client, s3_uploads, monkeypatch):
+    monkeypatch.setattr(settings, "MAX_IMAGE_PIXELS", 1000)
+    upload = start(client)
+    s3_uploads.put_sync(upload["fields"]["key"], png(), "image/png")
+    assert complete(client, upload).status_code == 413
+
+
+def test_worker_drops_the_staged_upload(s3_uploads):
+    from app.worker import QueueWorker
+
+    key = "uploads/done.png"
+    s3_uploads.put_sync(key, png(), "image/png")
+    worker = QueueWorker(consumer="test", models="*")
+    job = Job("1-0", "t1", 0, {"object_key": key, "storage": "s3"})
+
+    asyncio.run(worker._drop_staged_upload(job))
+    assert s3_uploads.stat_sync(key) is None
+    # Already gone, or no upload at all: nothing to do, no error
+    asyncio.run(worker._drop_staged_upload(job))
+    asyncio.run(worker._drop_staged_upload(Job("2-0", "t2", 0, {})))
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.config import settings
+from app.services import webhooks
+from app.services.task_state import get_task, init_task
+
+
+class Receiver:
+    """Local HTTP endpoint answering with the given status codes in turn (then 200)."""
+
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.requests = []
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                receiver.requests.append((dict(self.headers), body))
+                status = receiver.statuses.pop(0) if receiver.statuses else 200
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def receiver(monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(settings, "WEBHOOK_RETRY_MAX_DELAY", 0.02)
+    monkeypatch.setattr(settings, "WEBHOOK_POLL_SECONDS", 0.01)
+    receivers = []
+
+    def make(statuses=()):
+        receivers.append(Receiver(statuses))
+        return receivers[-1]
+
+    yield make
+    for r in receivers:
+        r.close()
+
+
+def deliver(task_id: str, url: str, until: set) -> dict:
+    """Queues a webhook and runs a sender until the task's webhook_status is in `until`."""
+    init_task(task_id, status="completed")
+    webhooks.enqueue(task_id, url, webhooks.completion_payload(task_id, {"file_url": "https://example.com/x.png"}))
+
+    async def run():
+        sender = webhooks.WebhookSender(concurrency=2)
+        sender.start()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if get_task(task_id, ["webhook_status"])["webhook_status"] in until:
+                break
+            await asyncio.sleep(0.02)
+        await sender.stop()
+
+    asyncio.run(run())
+    task = get_task(task_id, ["webhook_status", "webhook_attempts", "webhook_log"])
+    task["webhook_log"] = json.loads(task["webhook_log"] or "[]")
+    return task
+
+
+def test_delivery_is_signed(redis, receiver):
+    r = receiver()
+    task = deliver("t1", r.url, {"delivered"})
+
+    assert (task["webhook_status"], task["webhook_attempts"]) == ("delivered", "1")
+    [(headers, body)] = r.requests
+    expected = hmac.new(
+        settings.WEBHOOK_SECRET.encode(), headers["X-Webhook-Timestamp"].encode() + b"." + body, hashlib.sha256
+    ).hexdigest()
+    assert headers["X-Webhook-Signature"] == f"sha256={expected}"
+    assert abs(time.time() - int(headers["X-Webhook-Timestamp"])) < 5
+    payload = json.loads(body)
+    assert (payload["event"], payload["processing_id"]) == ("task.completed", "t1")
+    assert redis.zcard(webhooks.QUEUE_KEY) == 0
+
+
+def test_retries_5xx_and_429_with_a_stable_id(redis, receiver):
+    r = receiver([503, 429])
+    task = deliver("t1", r.url, {"delivered", "failed"})
+
+    assert (task["webhook_status"], task["webhook_attempts"]) == ("delivered", "3")
+    assert [e["status_code"] for e in task["webhook_log"]] == [503, 429, 200]
+    assert [e["outcome"] for e in task["webhook_log"]] == ["retrying", "retrying", "delivered"]
+    assert len({headers["X-Webhook-Id"] for headers, _ in r.requests}) == 1
+
+
+def test_other_4xx_fail_without_retry(redis, receiver):
+    r = receiver([400])
+    task = deliver("t1", r.url, {"delivered", "failed"})
+
+    assert (task["webhook_status"], task["webhook_attempts"]) == ("failed", "1")
+    assert len(r.requests) == 1
+    assert redis.zcard(webhooks.QUEUE_KEY) == 0
+
+
+def test_gives_up_after_max_attempts(redis, receiver, monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_MAX_ATTEMPTS", 2)
+    r = receiver([500, 500, 500])
+    task = deliver("t1", r.url, {"delivered", "failed"})
+
+    assert (task["webhook_status"], task["webhook_attempts"]) == ("failed", "2")
+    assert len(r.requests) == 2
+
+
+def test_unreachable_receiver_is_retried(redis, receiver, monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_MAX_ATTEMPTS", 2)
+    r = receiver()
+    url = r.url
+    r.close()
+    task = deliver("t1", url, {"delivered", "failed"})
+
+    assert (task["webhook_status"], task["webhook_attempts"]) == ("failed", "2")
+    assert all(e["status_code"] is None and e["error"] for e in task["webhook_log"])
+
+
+def test_claim_lapses_for_a_stopped_sender(redis, monkeypatch):
+    init_task("t1", status="completed")
+    webhooks.enqueue("t1", "http://127.0.0.1:9/hook", {"event": "task.completed"})
+
+    [raw] = webhooks.claim(10)
+    # Held while the request may still be running
+    assert webhooks.claim(10) == []
+
+    # The sender never recorded an outcome; after the claim window it is due again
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + settings.WEBHOOK_TIMEOUT_SECONDS + 61)
+    assert webhooks.claim(10) == [raw]
+
+
+def test_callback_url_validation(monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_ALLOW_PRIVATE", False)
+    assert webhooks.validate_callback_url("https://example.com/hook")
+    for url in ("ftp://example.com/hook", "http://127.0.0.1/hook", "http://10.0.0.1/hook", "http://localhost/hook"):
+        with pytest.raises(ValueError):
+            webhooks.validate_callback_url(url)